@@ -0,0 +1,898 @@
+##########################################################################
+#
+# Purpose:
+#       Fast-path parser for the Alliance orthology file and the direct
+#	and clustered homology builders, shared by the Alliance direct,
+#	clustered and combined preprocessors
+#
+# Usage: import alliance
+#
+# Inputs:
+#       1. Alliance file tab-delimited, opened in binary mode, with '#'
+#	   comment lines and a header line naming the columns:
+#
+#           1. Gene1ID
+#           2-4. (not used)
+#           5. Gene2ID
+#           6-13. (not used)
+#
+# Outputs:
+#        1. (mouse MGI ID, homology ID, prefix code) for each line
+#	    whose Gene1ID is a mouse MGI ID and whose Gene2ID has one of
+#	    the requested prefixes
+#        2. direct and clustered load ready files and QC reports
+#
+# Exit Codes:
+#
+#      0:  Successful completion
+#      1:  An exception occurred
+#
+#  Assumes:  Nothing
+#
+#  Notes:  The Gene1ID/Gene2ID positions are resolved once from the
+#	header. Each line is split only as far as the last needed column
+#	and filtered on its prefixes as bytes; only the lines kept have
+#	their two IDs decoded. DirectHomologies and ClusteredHomologies
+#	take the parsed lines one at a time, so a single pass over the
+#	file can feed both.
+#
+#	VectorParser (requires numpy) reads a block of lines at a time.
+#	It finds the line and tab positions with array operations, the
+#	Gene1ID and Gene2ID columns of every line by searchsorted over the
+#	tab positions, and applies both prefix tests as masks over the
+#	whole block; only the lines kept have their IDs sliced out and
+#	decoded. parse() passes the lines of each block together to the
+#	builders (addRows), and DirectHomologies looks up their IDs with a
+#	searchsorted join against the sorted IDs of its FrozenKeyMap
+#	lookups. newParser falls back to AllianceParser when numpy is not
+#	installed.
+#
+#	For a memory mapped file (tsvreader.MappedFile) AllianceParser
+#	searches the map for the lines starting with a mouse MGI ID, so the
+#	other lines are never copied out of the page cache.
+#
+#	parse() adds the lines to one or more homology builders. With more
+#	than one worker and a memory mapped file, the lines after the
+#	header are split into newline-aligned byte ranges parsed by forked
+#	processes; each returns the partial state of its builders, which
+#	are merged in file order so the load ready files and QC reports
+#	match a serial run
+#
+###########################################################################
+
+import copy
+import multiprocessing
+import threading
+import bcpwriter
+import clusterize
+import idstore
+import lookupcache
+import tsvreader
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+###--- globals ---###
+
+# constants
+TAB= '\t'
+CRT = '\n'
+
+# prefix codes
+MGI = 'MGI:'
+HGNC = 'HGNC:'
+RGD = 'RGD:'
+ZFIN = 'ZFIN:'
+
+# homology prefixes kept by each load
+DIRECT_PREFIXES = (ZFIN, HGNC, RGD)
+CLUSTERED_PREFIXES = (HGNC,)
+
+# [ 'human', 'mouse, laboratory', 'rat', 'zebrafish' ]
+
+organismOrder = [2, 1, 40, 84]
+
+# bytes read per VectorParser block
+VECTOR_BLOCK = 16777216
+
+# byte ranges per parse worker, so a slow range does not hold up the
+# others for long
+RANGES_PER_WORKER = 4
+
+# (mapped file, prefixes, Gene1ID index, Gene2ID index, builders)
+# inherited by the parse workers
+parallelJob = None
+
+# QC report section separator
+sep = '--------------------------------------------------\n'
+
+###--- classes ---###
+
+class AllianceParser:
+    # Purpose: iterate over the mouse homologies in an Alliance file
+    # Assumes: fp is open for reading bytes
+    # Effects: Reads the file
+    # Throws: ValueError from readHeader if there is no header line or
+    #	it is missing Gene1ID or Gene2ID
+
+    def __init__(self, fp, prefixes):
+        # prefixes: the prefix codes of the homology IDs to keep
+        self.fp = fp
+        self.prefixes = prefixes
+        self.prefixBytes = tuple([str.encode(p) for p in prefixes])
+
+        # column positions from the header line
+        self.gene1Idx = None
+        self.gene2Idx = None
+
+        # number of the current line in the file, counting comment and
+        # header lines, and the current line as read
+        self.lineNum = 0
+        self.rawLine = b''
+
+    def readHeader(self):
+        # Purpose: read up to and including the header line
+        # Returns: the list of column names
+
+        for line in self.fp:
+            self.lineNum += 1
+            if line.startswith(b'Gene1ID'):
+                headers = bytes.decode(line).rstrip('\r\n').split('\t')
+                self.gene1Idx = headers.index('Gene1ID')
+                self.gene2Idx = headers.index('Gene2ID')
+                return headers
+        raise ValueError('no Gene1ID header line')
+
+    def __iter__(self):
+        if self.gene1Idx is None:
+            self.readHeader()
+        gene1Idx = self.gene1Idx
+        gene2Idx = self.gene2Idx
+        # columns past the last one needed are left unsplit
+        maxSplit = max(gene1Idx, gene2Idx) + 1
+        mgiBytes = str.encode(MGI)
+        prefixBytes = self.prefixBytes
+        prefixes = list(zip(prefixBytes, self.prefixes))
+
+        for lineNum, line in self.lines():
+            tokens = line.split(b'\t', maxSplit)
+            if len(tokens) < maxSplit:
+                continue
+            mgiID = tokens[gene1Idx]
+            if not mgiID.startswith(mgiBytes):
+                continue
+            homologyID = tokens[gene2Idx]
+            if not homologyID.startswith(prefixBytes):
+                continue
+            for prefix, code in prefixes:
+                if homologyID.startswith(prefix):
+                    break
+            self.lineNum = lineNum
+            self.rawLine = line
+            yield (bytes.decode(mgiID.strip()), bytes.decode(homologyID.strip()), code)
+
+    def lines(self):
+        # Purpose: the lines after the header that may be kept; from a
+        #	memory mapped file only the lines starting with a mouse MGI
+        #	ID are read, when Gene1ID is the first column
+        # Returns: generator of (line number, line)
+
+        if self.gene1Idx == 0 and isinstance(self.fp, tsvreader.MappedFile):
+            for lineNum, line in self.fp.scan(str.encode(MGI), self.lineNum):
+                yield (lineNum, line)
+            return
+
+        lineNum = self.lineNum
+        for line in self.fp:
+            lineNum += 1
+            yield (lineNum, line)
+
+    @property
+    def line(self):
+        # Returns: the current line as text without its line terminator
+
+        return bytes.decode(self.rawLine).strip()
+
+class VectorParser(AllianceParser):
+    # Purpose: iterate over the mouse homologies in an Alliance file,
+    #	a block of lines at a time with numpy
+    # Assumes: fp is open for reading bytes; numpy is installed
+    # Effects: Reads the file
+    # Throws: ValueError from readHeader if there is no header line or
+    #	it is missing Gene1ID or Gene2ID
+
+    def __iter__(self):
+        for rows in self.batches():
+            for self.lineNum, self.rawLine, mgiID, homologyID, code in rows:
+                yield (mgiID, homologyID, code)
+
+    def batches(self):
+        # Purpose: the mouse homologies of the file, a block at a time
+        # Returns: generator of lists of (line number, line, mouse MGI ID,
+        #	homology ID, prefix code), one list per block
+
+        if self.gene1Idx is None:
+            self.readHeader()
+        lineNum = self.lineNum
+        rest = b''
+        while True:
+            block = self.fp.read(VECTOR_BLOCK)
+            if block:
+                # scan whole lines; carry the partial last line over
+                data = rest + block
+                end = data.rfind(b'\n') + 1
+                data, rest = data[:end], data[end:]
+            elif rest:
+                # last line has no line terminator
+                data, rest = rest, b''
+            else:
+                break
+            if not data:
+                continue
+
+            lineCt, rows = self.scan(data, lineNum)
+            if rows:
+                yield rows
+            lineNum += lineCt
+
+    def scan(self, data, lineNum):
+        # Purpose: find the lines of data kept by AllianceParser
+        # Returns: (number of lines, list of (line number, line, mouse
+        #	MGI ID, homology ID, prefix code) for the lines kept)
+        # Assumes: data is whole lines, the last without a newline only
+        #	at the end of the file; lineNum is the number of the line
+        #	before data
+
+        buf = numpy.frombuffer(data, numpy.uint8)
+        ends = numpy.flatnonzero(buf == 10) + 1
+        if not data.endswith(b'\n'):
+            ends = numpy.append(ends, len(data))
+        starts = numpy.concatenate(([0], ends[:-1]))
+        lineCt = len(ends)
+        tabs = numpy.flatnonzero(buf == 9)
+        if not len(tabs):
+            return (lineCt, [])
+
+        # the tabs of line i are tabs[first[i]:last[i]]; lines with too
+        # few columns are skipped, as AllianceParser does
+        first = numpy.searchsorted(tabs, starts)
+        last = numpy.searchsorted(tabs, ends)
+        rows = numpy.flatnonzero(last - first >= max(self.gene1Idx, self.gene2Idx))
+
+        # Gene1ID must be a mouse MGI ID
+        mgiStarts, mgiEnds = fieldBounds(tabs, first[rows], last[rows], starts[rows], ends[rows], self.gene1Idx)
+        mask = startsWith(buf, mgiStarts, mgiEnds, str.encode(MGI))
+        rows = rows[mask]
+        mgiStarts = mgiStarts[mask]
+        mgiEnds = mgiEnds[mask]
+
+        # Gene2ID must have one of the prefixes; the first that matches
+        # is its code
+        homStarts, homEnds = fieldBounds(tabs, first[rows], last[rows], starts[rows], ends[rows], self.gene2Idx)
+        codes = numpy.full(len(rows), -1)
+        for i in reversed(range(len(self.prefixBytes))):
+            codes[startsWith(buf, homStarts, homEnds, self.prefixBytes[i])] = i
+        mask = codes >= 0
+
+        prefixes = self.prefixes
+        kept = []
+        for row, lineStart, lineEnd, mgiStart, mgiEnd, homStart, homEnd, code in zip(
+                rows[mask].tolist(), starts[rows[mask]].tolist(), ends[rows[mask]].tolist(),
+                mgiStarts[mask].tolist(), mgiEnds[mask].tolist(),
+                homStarts[mask].tolist(), homEnds[mask].tolist(), codes[mask].tolist()):
+            kept.append((lineNum + row + 1, data[lineStart:lineEnd],
+                bytes.decode(data[mgiStart:mgiEnd].strip()),
+                bytes.decode(data[homStart:homEnd].strip()), prefixes[code]))
+        return (lineCt, kept)
+
+class DirectHomologies:
+    # Purpose: group the direct homologies of each mouse marker for the
+    #	Alliance direct load
+    # Assumes: a database connection has been opened
+    # Effects: queries a database through lookupcache
+    # Throws: Nothing
+
+    # the lookups of initLookups, started by startLookups
+    LOOKUPS = [lookupcache.HOMOLOGY_ANY, lookupcache.MGI_ANY]
+
+    def __init__(self):
+        # Rat, Human Zebra Fish lookup
+        # ( ID:_Marker_key)
+        self.homologyLookup = idstore.FrozenKeyMap()
+
+        # Rat, Human Zebra Fish organism lookup
+        # ( ID:_Organism_key)
+        self.homologyOrgLookup = idstore.FrozenKeyMap()
+
+        # Mouse gene lookup
+        # (ID:_Marker_key)
+        self.mouseLookup = idstore.FrozenKeyMap()
+
+        # {mouse marker key:[[organism index, marker key], ...], ...}
+        self.homologyDict = {}
+
+        # sortedKeys of mouseLookup and homologyLookup, made by addRows
+        self.sortedKeys = None
+
+        # QC report descriptions and column headings
+        self.rptOne = 'Lines where a Mouse MGI ID not in database %s%s%s' % (CRT, sep, CRT)
+        self.rptOne = self.rptOne + 'LineNum%sline%s' % (TAB, CRT)
+        self.rptTwo = '%s%sLines where a Homology ID not in database%s%s%s%s' % (CRT, CRT, CRT, CRT, sep, CRT)
+        self.rptTwo = self.rptTwo + 'LineNum%sline%s' % (TAB, CRT)
+
+        # true once initLookups has run
+        self.lookupsReady = 0
+
+    def startLookups(self):
+        # Purpose: start loading the lookups of initLookups in the
+        #	background, so they load while the file is parsed
+        # Returns: Nothing
+
+        lookupcache.startLookups(self.LOOKUPS)
+
+    def initLookups(self, mgiIDs=None, homologyIDs=None):
+        # Purpose: create the database lookups, waiting for any started
+        #	with startLookups; for only the IDs given with
+        #	LOOKUP_MODE=input (see collectIDs)
+        # Returns: Nothing
+
+        # Create lookup of homology IDs to their marker and organism keys
+        lookup = lookupcache.markerLookup(*lookupcache.HOMOLOGY_ANY, accIDs=homologyIDs)
+        self.homologyLookup = lookup.markers
+        self.homologyOrgLookup = lookup.organisms
+
+        # Create lookup of mouse MGI IDs to their marker keys
+        self.mouseLookup = lookupcache.markerMap(*lookupcache.MGI_ANY, accIDs=mgiIDs)
+        self.sortedKeys = None
+        self.lookupsReady = 1
+
+    def partial(self):
+        # Purpose: an empty copy for one byte range of the file
+        # Returns: DirectHomologies sharing this one's lookups
+
+        other = copy.copy(self)
+        other.homologyDict = {}
+        other.rptOne = ''
+        other.rptTwo = ''
+        return other
+
+    def state(self):
+        # Returns: the homologies and QC report lines added so far
+
+        return (self.homologyDict, self.rptOne, self.rptTwo)
+
+    def merge(self, state):
+        # Purpose: add the state of the partial for the next byte range
+        # Returns: Nothing
+
+        homologyDict, rptOne, rptTwo = state
+        for mouseKey in homologyDict:
+            if mouseKey in self.homologyDict:
+                # skip the mouse key, it is already in the list
+                self.homologyDict[mouseKey].extend(homologyDict[mouseKey][1:])
+            else:
+                self.homologyDict[mouseKey] = homologyDict[mouseKey]
+        self.rptOne = self.rptOne + rptOne
+        self.rptTwo = self.rptTwo + rptTwo
+
+    def addRow(self, parser, mgiID, homologyID, prefix):
+        # Purpose: add one parsed line, reporting IDs not in the database
+        # Returns: Nothing
+
+        #Alliance adds a prefix to the zfin id, remove it
+        if prefix == ZFIN:
+            homologyID = homologyID[5:]
+
+        self.addKeys(parser, self.mouseLookup.get(mgiID, 0),
+            self.homologyLookup.get(homologyID, 0), self.homologyOrgLookup.get(homologyID, 0))
+
+    def addRows(self, parser, rows):
+        # Purpose: add a block of lines from VectorParser.batches, their
+        #	IDs looked up with one searchsorted join per lookup
+        # Returns: Nothing
+        # Assumes: numpy is installed; the lookups have been initialized
+
+        if self.sortedKeys is None:
+            self.sortedKeys = (sortedKeys(self.mouseLookup), sortedKeys(self.homologyLookup))
+        mouseIDs, homologyIDs = self.sortedKeys
+
+        mgiIDList = []
+        homologyIDList = []
+        for lineNum, rawLine, mgiID, homologyID, prefix in rows:
+            #Alliance adds a prefix to the zfin id, remove it
+            if prefix == ZFIN:
+                homologyID = homologyID[5:]
+            mgiIDList.append(mgiID)
+            homologyIDList.append(homologyID)
+
+        mouseKeys = joinKeys(mouseIDs, self.mouseLookup.values, mgiIDList)
+        homologyKeys = joinKeys(homologyIDs, self.homologyLookup.values, homologyIDList)
+        orgKeys = joinKeys(homologyIDs, self.homologyOrgLookup.values, homologyIDList)
+        for row, mouseKey, homologyKey, orgKey in zip(rows, mouseKeys, homologyKeys, orgKeys):
+            parser.lineNum, parser.rawLine = row[:2]
+            self.addKeys(parser, mouseKey, homologyKey, orgKey)
+
+    def addKeys(self, parser, mouseKey, homologyKey, orgKey):
+        # Purpose: add the keys of one parsed line, reporting IDs not in
+        #	the database (key 0)
+        # Returns: Nothing
+
+        lineCt = parser.lineNum
+
+        # Check IDs in the database
+        notIn = 0
+
+        # report if mgiID not in db
+        if not mouseKey:
+            self.rptOne = '%s%s%s%s%s' % (self.rptOne, lineCt, TAB, parser.line, CRT)
+            notIn = 1
+
+        # report if homology ID not in MGI
+        if not homologyKey:
+            self.rptTwo = '%s%s%s%s%s' % (self.rptTwo, lineCt, TAB, parser.line, CRT)
+            notIn = 1
+        # if either mgiID or homologyID not in MGI skip
+        if notIn == 1:
+            return
+
+        # create list of homologies for mouseKey
+        homologyDict = self.homologyDict
+        if mouseKey not in homologyDict:
+            homologyDict[mouseKey] = []
+            # add the mouse key, it is second
+            homologyDict[mouseKey].append([1, int(mouseKey)])
+
+        # [orgKey index in organismOrder, homologyKey]
+        l = [organismOrder.index(orgKey), homologyKey]
+        homologyDict[mouseKey].append(l)# add homologies to the dictionary
+
+    def writeLoadFile(self, loadWriter):
+        # Purpose: write one load ready cluster (with no cluster ID) per
+        #	mouse marker
+        # Returns: Nothing
+        # loadWriter: bcpwriter.LoadReadyWriter
+
+        for mKey in self.homologyDict:
+            homologyList = self.homologyDict[mKey]  # list of lists e.g. [ [2, rKey], [0, hKey], [1, mKey] ]
+            sortedList = sorted(homologyList, key=lambda hom: hom[0])    # sort by the index in position 1
+
+            # get the list of marker keys for writing out to load ready file
+            keyList = []
+            for l in sortedList:
+                keyList.append(l[1])
+            loadWriter.writeCluster('', keyList)
+        loadWriter.flush()
+
+    def writeReports(self, fpQcRpt):
+        # Purpose: writes out all sections of the QC report
+        # Returns: Nothing
+
+        fpQcRpt.write(self.rptOne)
+        fpQcRpt.write(self.rptTwo)
+
+class ClusteredHomologies:
+    # Purpose: cluster the mouse/human homologies for the Alliance
+    #	clustered load
+    # Assumes: a database connection has been opened
+    # Effects: queries a database through lookupcache
+    # Throws: Nothing
+
+    # the lookups of initLookups, started by startLookups
+    LOOKUPS = [lookupcache.HGNC_HUMAN, lookupcache.MGI_MOUSE]
+
+    def __init__(self, clusterWorkers, clusterMapPath):
+        # clusterWorkers: number of processes the clusterizer shards the
+        #	id pairs across
+        # clusterMapPath: cluster signatures and IDs from the previous load
+        self.clusterWorkers = clusterWorkers
+        self.clusterMapPath = clusterMapPath
+
+        # Mouse MGI ID/HGNC ID associations from the file
+        # {mouse MGI ID:[list of human hgncIDs], ...}
+        self.mouseMgiToHGNCDict = {}
+
+        # HGNC ID/Mouse Marker associations from the database
+        # {hgncID:marker key, ...}
+        self.hgncToMarkerDict = idstore.FrozenKeyMap()
+
+        # MGI ID/Mouse Marker associations from the database
+        # {mgiID:marker key, ...}
+        self.mgiToMarkerDict = idstore.FrozenKeyMap()
+
+        # QC report descriptions and column headings
+        self.rptOne = 'Lines where a Mouse MGI ID not in database %s%s%s' % (CRT, sep, CRT)
+        self.rptOne = self.rptOne + 'LineNum%sline%s' % (TAB, CRT)
+        self.rptTwo = '%s%sLines where a HGNC ID not in database%s%s%s%s' % (CRT, CRT, CRT, CRT, sep, CRT)
+        self.rptTwo = self.rptTwo + 'LineNum%sline%s' % (TAB, CRT)
+        self.rptDebug = '%s%sInput resolved to keys%s%s' % (CRT, CRT, CRT, sep)
+
+        # true once initLookups has run
+        self.lookupsReady = 0
+
+    def startLookups(self):
+        # Purpose: start loading the lookups of initLookups in the
+        #	background, so they load while the file is parsed
+        # Returns: Nothing
+
+        lookupcache.startLookups(self.LOOKUPS)
+
+    def initLookups(self, mgiIDs=None, homologyIDs=None):
+        # Purpose: create the database lookups, waiting for any started
+        #	with startLookups; for only the IDs given with
+        #	LOOKUP_MODE=input (see collectIDs)
+        # Returns: Nothing
+
+        # create hgncID to marker lookup from database
+        self.hgncToMarkerDict = lookupcache.markerMap(*lookupcache.HGNC_HUMAN, accIDs=homologyIDs)
+
+        # get all mouse markers
+        # removed per Richard
+        # and a.preferred = 1
+        self.mgiToMarkerDict = lookupcache.markerMap(*lookupcache.MGI_MOUSE, accIDs=mgiIDs)
+        self.lookupsReady = 1
+
+    def partial(self):
+        # Purpose: an empty copy for one byte range of the file
+        # Returns: ClusteredHomologies sharing this one's lookups
+
+        other = copy.copy(self)
+        other.mouseMgiToHGNCDict = {}
+        return other
+
+    def state(self):
+        # Returns: the mouse/human associations added so far
+
+        return self.mouseMgiToHGNCDict
+
+    def merge(self, state):
+        # Purpose: add the state of the partial for the next byte range
+        # Returns: Nothing
+
+        for mgiID in state:
+            for homologyID in state[mgiID]:
+                self.addRow(None, mgiID, homologyID, HGNC)
+
+    def addRow(self, parser, mgiID, homologyID, prefix):
+        # Purpose: add one parsed mouse/human line; lines with other
+        #	homology prefixes are ignored
+        # Returns: Nothing
+
+        if prefix not in CLUSTERED_PREFIXES:
+            return
+        if not mgiID in self.mouseMgiToHGNCDict:
+            self.mouseMgiToHGNCDict[idstore.canonical(mgiID)] = []
+        # add the human  homology to the dictionary
+        self.mouseMgiToHGNCDict[mgiID].append(idstore.canonical(homologyID))
+
+    def addRows(self, parser, rows):
+        # Purpose: add a block of lines from VectorParser.batches; the
+        #	IDs are looked up once clustered, in writeLoadFile
+        # Returns: Nothing
+
+        for lineNum, rawLine, mgiID, homologyID, prefix in rows:
+            self.addRow(parser, mgiID, homologyID, prefix)
+
+    def writeLoadFile(self, loadWriter, fpClustererFile):
+        # Purpose: cluster the homologies and write the load ready
+        #	clusters and the file of id pairs sent to the clusterizer
+        # Returns: Nothing
+        # loadWriter: bcpwriter.LoadReadyWriter
+
+        mgiToMarkerDict = self.mgiToMarkerDict
+        hgncToMarkerDict = self.hgncToMarkerDict
+
+        # the clusterizer forks its workers, so stop the lookup threads
+        # first; the lookups are loaded by now
+        if self.clusterWorkers > 1:
+            lookupcache.close()
+
+        # id pairs are sent to the clusterizer as they are found
+        clusterizer = clusterize.Clusterizer(self.clusterWorkers)
+        clustererWriter = bcpwriter.BcpWriter(fpClustererFile, 2)
+
+        # for reporting - the actual line in the file including the header
+        lineCt =  1  
+
+        for mgiID in self.mouseMgiToHGNCDict:
+            hgncIDList = self.mouseMgiToHGNCDict[mgiID]
+            lineCt += 1
+            
+            # 1 means error on this line
+            error = 0
+
+            # current cluster - if there are no errors it will be added to
+            # the clusterizer
+            currentClusterList = []
+            # report and skip lines where hgncID not in the database
+            if  mgiID not in mgiToMarkerDict:
+                toReport = '%s%s%s%s' % (mgiID, TAB, ''.join(hgncIDList), CRT)
+                self.rptOne = '%s%s%s%s' % (self.rptOne, lineCt, TAB, toReport)
+            
+                # if mgiID not in database continue to next input line
+                continue
+
+            #
+            # mgiID is in the database; check the hgnc IDs
+            #
+
+            # add clusters with human to the list
+            for id in hgncIDList:
+                id = str.strip(id)
+                # report and skip lines with hgncId not in the database
+                if id not in hgncToMarkerDict: 
+                    error = 1
+                    toReport = '%s%s%s%s' % (mgiID, TAB, id, CRT)
+                    self.rptTwo = '%s%s%s%s' % (self.rptTwo, lineCt, TAB, toReport)
+                    # No need to check any more ids, get out of the loop
+                    break
+                else:
+                    currentClusterList.append((mgiID, id))
+
+            # if any hgnc IDs not in database continue to next input line
+            if error == 1:
+                    continue
+
+            # if we have a cluster add it to the cluster list and to the file
+            if currentClusterList != []:
+                # no errors so add the next cluster
+                clusterizer.add_edges(currentClusterList)
+
+                clustererWriter.writeRows(currentClusterList)
+                # if we get here, we know mgiID is in the database and ALL the
+                # hgncIds are in the database
+                    
+        clustererWriter.flush()
+
+        clusterDict = clusterizer.clusters('Alliance', self.clusterMapPath)
+        print('clusters unchanged from previous load: %s of %s' % (len(clusterizer.unchangedSet), len(clusterDict)))
+
+        # now resolve the ids to database keys; human and mouse gene keys
+        for clusterId in list(clusterDict.keys()):
+            idTuple = clusterDict[clusterId]
+            humanKeyList = []
+            mouseKeyList = []
+            for id in idTuple:
+                if id.startswith(MGI):
+                    mouseKeyList.append(mgiToMarkerDict[id])
+                else:
+                    humanKeyList.append(hgncToMarkerDict[id])
+            # we want human before mouse for cluster member sequence numbering
+            keyList = humanKeyList + mouseKeyList
+            # write debug to qc rpt, the keys listed as strings
+            self.rptDebug = '%s%s%s%s%s%s%s' % (self.rptDebug, idTuple, TAB, list(map(str, humanKeyList)), TAB, list(map(str, mouseKeyList)), CRT)
+            loadWriter.writeCluster(clusterId, keyList)
+        loadWriter.flush()
+
+    def writeReports(self, fpQcRpt):
+        # Purpose: writes out all sections of the QC report
+        # Returns: Nothing
+
+        fpQcRpt.write(self.rptOne)
+        fpQcRpt.write(self.rptTwo)
+
+        fpQcRpt.write(self.rptDebug)
+
+###--- functions ---###
+
+def newParser(fp, prefixes, vector=False):
+    # Purpose: create the parser for an Alliance file
+    # Returns: a VectorParser if vector is true and numpy is installed,
+    #	otherwise an AllianceParser
+    # Assumes: fp is open for reading bytes
+    # Effects: Nothing
+    # Throws: Nothing
+
+    if vector and numpy is not None:
+        return VectorParser(fp, prefixes)
+    return AllianceParser(fp, prefixes)
+
+def startsWith(buf, starts, ends, prefix):
+    # Purpose: test many byte ranges of buf for a prefix at once
+    # Returns: boolean array, true where buf[start:end] starts with prefix
+    # Assumes: buf is a numpy uint8 array
+    # Effects: Nothing
+    # Throws: Nothing
+
+    mask = (ends - starts) >= len(prefix)
+    last = len(buf) - 1
+    for i, b in enumerate(prefix):
+        mask &= buf[numpy.minimum(starts + i, last)] == b
+    return mask
+
+def fieldBounds(tabs, first, last, starts, ends, idx):
+    # Purpose: find one column of many lines at once
+    # Returns: (column starts, column ends); the last column split off
+    #	ends at the end of the line, as with bytes.split(b'\t', n)
+    # Assumes: tabs is a numpy array of the tab positions; tabs[first:last]
+    #	are the tabs of each line, and there are at least idx of them
+    # Effects: Nothing
+    # Throws: Nothing
+
+    if idx == 0:
+        fieldStarts = starts
+    else:
+        fieldStarts = tabs[first + idx - 1] + 1
+    endTab = first + idx
+    fieldEnds = numpy.where(endTab < last, tabs[numpy.minimum(endTab, len(tabs) - 1)], ends)
+    return (fieldStarts, fieldEnds)
+
+def sortedKeys(lookup):
+    # Purpose: the accession IDs of a lookup, for joinKeys
+    # Returns: numpy bytes array of the IDs in the lookup's sort order
+    # Assumes: lookup is an idstore.FrozenKeyMap
+    # Effects: Nothing
+    # Throws: Nothing
+
+    table = lookup.table
+    block = table.block
+    offsets = table.offsets
+    return numpy.array([block[offsets[i]:offsets[i + 1]] for i in range(len(table))], dtype=bytes)
+
+def joinKeys(keys, values, accIDs):
+    # Purpose: look up many accession IDs at once, with a searchsorted
+    #	join against the sorted IDs of a lookup
+    # Returns: list of the value for each of accIDs, 0 where it is not
+    #	in the lookup
+    # Assumes: keys is from sortedKeys; values is the lookup's values
+    #	(FrozenKeyMap.values), which are positive
+    # Effects: Nothing
+    # Throws: Nothing
+
+    if not len(keys):
+        return [0] * len(accIDs)
+    ids = numpy.array(list(map(str.encode, accIDs)), dtype=bytes)
+    pos = numpy.minimum(numpy.searchsorted(keys, ids), len(keys) - 1)
+    return numpy.where(keys[pos] == ids, numpy.asarray(values)[pos], 0).tolist()
+
+def parse(fp, prefixes, builders, vector=False, workers=1):
+    # Purpose: parse an Alliance file, adding each mouse homology line
+    #	to every builder (DirectHomologies, ClusteredHomologies)
+    # Returns: Nothing
+    # Assumes: fp is open for reading bytes; the builders' lookups have
+    #	been initialized or started with startLookups
+    # Effects: Reads the file; forks workers if workers > 1 and fp is
+    #	a tsvreader.MappedFile; waits for lookups still loading, and
+    #	before forking stops the lookup threads and closes their
+    #	connections (lookupcache.close)
+    # Throws: ValueError if there is no header line
+
+    global parallelJob
+
+    parser = newParser(fp, prefixes, vector)
+    parser.readHeader()
+    print("headers.index('Gene1ID'): %s" % parser.gene1Idx)
+
+    loading = [builder for builder in builders if not builder.lookupsReady]
+
+    if workers > 1 and not isinstance(fp, tsvreader.MappedFile):
+        print('parsing serially: %s workers need an uncompressed input file (INPUT_FILE_DECOMPRESS=1)' % workers)
+        workers = 1
+
+    if workers > 1:
+        # the workers need the lookups before they fork. Forking a
+        # process with other threads running is unsafe (the workers
+        # may inherit locks those threads hold), so the lookup threads
+        # are stopped and their connections closed first; the workers
+        # exit with os._exit, so they never close the connections left
+        # open in this process
+        for builder in loading:
+            builder.initLookups()
+        loading = []
+        lookupcache.close()
+        if threading.active_count() > 1:
+            print('parsing serially: %s other threads are running' % (threading.active_count() - 1))
+            workers = 1
+
+    if workers < 2 and isinstance(parser, VectorParser):
+        # the lines of a block are added together, so each builder can
+        # join their IDs to its lookups at once; they are kept while
+        # the lookups load
+        if loading:
+            batches = list(parser.batches())
+            for builder in loading:
+                builder.initLookups()
+        else:
+            batches = parser.batches()
+        for rows in batches:
+            for builder in builders:
+                builder.addRows(parser, rows)
+        return
+
+    if workers < 2:
+        if not loading:
+            for mgiID, homologyID, prefix in parser:
+                for builder in builders:
+                    builder.addRow(parser, mgiID, homologyID, prefix)
+            return
+
+        # the mouse homology lines are a small part of the file; keep
+        # them while the lookups load, then add them
+        rows = []
+        for mgiID, homologyID, prefix in parser:
+            rows.append((parser.lineNum, parser.rawLine, mgiID, homologyID, prefix))
+        for builder in loading:
+            builder.initLookups()
+        for parser.lineNum, parser.rawLine, mgiID, homologyID, prefix in rows:
+            for builder in builders:
+                builder.addRow(parser, mgiID, homologyID, prefix)
+        return
+
+    # the workers inherit the open map and the lookups through fork
+    parallelJob = (fp, prefixes, parser.gene1Idx, parser.gene2Idx, builders)
+    pool = multiprocessing.get_context('fork').Pool(workers)
+    try:
+        results = pool.map(parseRange, byteRanges(fp, parser.lineNum, workers * RANGES_PER_WORKER), 1)
+    finally:
+        pool.close()
+        pool.join()
+        parallelJob = None
+
+    for states in results:
+        for builder, state in zip(builders, states):
+            builder.merge(state)
+
+def collectIDs(path, prefixes):
+    # Purpose: find the distinct IDs of an Alliance file, for lookups of
+    #	only those IDs
+    # Returns: (set of mouse MGI IDs, set of homology IDs) of the lines
+    #	the parser keeps; ZFIN IDs without their 'ZFIN:' prefix
+    # Assumes: Nothing
+    # Effects: Reads the file
+    # Throws: ValueError if there is no header line
+
+    mgiIDs = set()
+    homologyIDs = set()
+    fp = tsvreader.openFile(path, binary=True, mapped=True)
+    for mgiID, homologyID, prefix in AllianceParser(fp, prefixes):
+        mgiIDs.add(mgiID)
+        if prefix == ZFIN:
+            homologyID = homologyID[5:]
+        homologyIDs.add(str.strip(homologyID))
+    fp.close()
+    return (mgiIDs, homologyIDs)
+
+def byteRanges(fp, lineNum, rangeCt):
+    # Purpose: split the rest of a mapped file into ranges of whole lines
+    # Returns: list of (start, end, number of the line before start)
+    # Assumes: fp is a tsvreader.MappedFile
+    # Effects: Nothing
+    # Throws: Nothing
+
+    mm = fp.mm
+    start = fp.tell()
+    size = fp.end
+    ranges = []
+    while start < size:
+        end = start + max((size - start) // rangeCt, 1)
+        end = mm.find(b'\n', min(end, size) - 1, size) + 1
+        if end == 0:
+            end = size
+        ranges.append((start, end, lineNum))
+        lineNum += mm[start:end].count(b'\n')
+        start = end
+        rangeCt = max(rangeCt - 1, 1)
+    return ranges
+
+def parseRange(args):
+    # Purpose: parse one byte range of the file in a worker process
+    # Returns: list of the partial state of each builder
+    # Assumes: parallelJob was set before the worker was forked
+    # Effects: Reads the file
+    # Throws: Nothing
+
+    start, end, lineNum = args
+    fp, prefixes, gene1Idx, gene2Idx, builders = parallelJob
+
+    fp.seek(start, end)
+    parser = AllianceParser(fp, prefixes)
+    parser.gene1Idx = gene1Idx
+    parser.gene2Idx = gene2Idx
+    parser.lineNum = lineNum
+
+    partials = [builder.partial() for builder in builders]
+    for mgiID, homologyID, prefix in parser:
+        for builder in partials:
+            builder.addRow(parser, mgiID, homologyID, prefix)
+    return [builder.state() for builder in partials]
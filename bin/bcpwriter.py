@@ -0,0 +1,184 @@
+##########################################################################
+#
+# Purpose:
+#       Buffered writer of tab-delimited rows, for the bcp files and the
+#	load ready files
+#
+# Usage: import bcpwriter
+#
+# Inputs:
+#       1. Rows as tuples of column values (integers or strings)
+#
+# Outputs:
+#        1. One tab-delimited line per row, written to an open file
+#	    and/or passed on as it is formatted (e.g. to dbcopy.copyLines)
+#        2. LoadReadyWriter: the clusters of a load ready file, kept as
+#	    (cluster ID, [marker key, ...]) records for
+#	    homologyload.loadRecords and/or written to the file (see
+#	    openLoadReadyWriter for the PIPELINE_LOAD and PIPELINE_ARCHIVE
+#	    settings)
+#
+# Exit Codes:
+#
+#      0:  Successful completion
+#      1:  An exception occurred
+#
+#  Assumes:  Nothing
+#
+#  Notes:  The line format of a file is built once, with the columns
+#	that are the same in every row (cluster type, source, dates,
+#	created by) already in it, so each row is one % of a tuple.
+#	Lines are kept in a list and written BATCH_ROWS at a time with
+#	writelines, rather than with a write call per row
+#
+###########################################################################
+
+import os
+
+###--- globals ---###
+
+# constants
+TAB = '\t'
+CRT = '\n'
+
+# rows kept before they are written
+BATCH_ROWS = 10000
+
+###--- classes ---###
+
+class BcpWriter:
+    # Purpose: write rows to an open file as tab-delimited lines
+    # Assumes: fp is open for writing text, or None if the lines are
+    #	only passed on by lines(); rows are tuples
+    # Effects: Writes to the file system
+    # Throws: TypeError from writeRow if a row does not have one value
+    #	per variable column
+
+    def __init__(self, fp, columnCt, constants=None):
+        # columnCt: number of columns in a line
+        # constants: {column index:value, ...} the columns with the same
+        #	value in every line; the rows written give the others, in
+        #	order
+        self.fp = fp
+        self.buffer = []
+        self.rowCt = 0
+
+        if constants is None:
+            constants = {}
+        fields = []
+        for i in range(columnCt):
+            if i in constants:
+                fields.append(str.replace(str(constants[i]), '%', '%%'))
+            else:
+                fields.append('%s')
+        self.format = TAB.join(fields) + CRT
+
+    def writeRow(self, row):
+        # Purpose: write one row
+        # Returns: Nothing
+
+        self.buffer.append(self.format % row)
+        if len(self.buffer) >= BATCH_ROWS:
+            self.flush()
+
+    def writeRows(self, rows):
+        # Purpose: write each row of an iterable of rows
+        # Returns: Nothing
+
+        format = self.format
+        self.buffer.extend([format % row for row in rows])
+        if len(self.buffer) >= BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        # Purpose: write the lines kept so far to the file
+        # Returns: Nothing
+
+        self.rowCt += len(self.buffer)
+        self.fp.writelines(self.buffer)
+        self.buffer = []
+
+    def lines(self, rows):
+        # Purpose: format each row of an iterable of rows, also writing
+        #	the line to the file if there is one
+        # Returns: generator of lines
+
+        format = self.format
+        for row in rows:
+            line = format % row
+            if self.fp is not None:
+                self.buffer.append(line)
+                if len(self.buffer) >= BATCH_ROWS:
+                    self.flush()
+            yield line
+        if self.fp is not None:
+            self.flush()
+
+class LoadReadyWriter:
+    # Purpose: write the clusters of a load ready file (cluster ID, comma
+    #	separated marker keys) and/or keep them for the loader
+    # Assumes: fp is open for writing text, or None if the file is not
+    #	written; marker keys are integers
+    # Effects: Writes to the file system
+    # Throws: Nothing
+
+    def __init__(self, fp, keep):
+        # keep: true to keep the clusters in records, for
+        #	homologyload.loadRecords (pipeline mode)
+        self.fp = fp
+        self.writer = None
+        if fp is not None:
+            self.writer = BcpWriter(fp, 2)
+
+        # [(cluster ID, [marker key, ...]), ...] in the order written
+        self.records = None
+        if keep:
+            self.records = []
+
+    def writeCluster(self, clusterId, markerKeys):
+        # Purpose: write one cluster; markerKeys are in sequence order
+        # Returns: Nothing
+
+        if self.records is not None:
+            self.records.append((clusterId, markerKeys))
+        if self.writer is not None:
+            self.writer.writeRow((clusterId, ', '.join(map(str, markerKeys))))
+
+    def flush(self):
+        # Purpose: write the lines kept so far to the file
+        # Returns: Nothing
+
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self):
+        # Purpose: flush and close the file, if there is one
+        # Returns: Nothing
+
+        if self.fp is not None:
+            self.flush()
+            self.fp.close()
+
+###--- functions ---###
+
+def openLoadReadyWriter(path):
+    # Purpose: open the writer of a preprocessor's load ready clusters.
+    #	With PIPELINE_LOAD=1 the clusters are kept for
+    #	homologyload.loadRecords rather than read back from the file,
+    #	which is then written only if PIPELINE_ARCHIVE=1, for the archive
+    # Returns: LoadReadyWriter; its records are None unless
+    #	PIPELINE_LOAD=1
+    # Assumes: Nothing
+    # Effects: opens path for writing; exits if it cannot be opened
+    # Throws: Nothing
+
+    keep = os.environ['PIPELINE_LOAD'] == '1'
+    archive = os.environ['PIPELINE_ARCHIVE'] == '1'
+
+    fp = None
+    if not keep or archive:
+        try:
+            fp = open(path, 'w')
+        except:
+            exit('Could not open file for writing %s\n' % path)
+    return LoadReadyWriter(fp, keep)
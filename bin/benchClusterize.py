@@ -0,0 +1,247 @@
+#
+#  benchClusterize.py
+###########################################################################
+#
+#  Purpose:
+#
+#       Time clusterize.cluster on reproducible synthetic orthology
+#	graphs so changes to the clustering engine can be compared
+#
+#  Usage:
+#
+#      benchClusterize.py [maxEdges [workers [seed]]]
+#
+#      where:
+#          maxEdges = largest graph to run, default 10000000
+#          workers = clusterizer worker processes, default 1
+#          seed = random seed for the graphs, default 1
+#
+#  Env Vars: None
+#
+#  Inputs: None
+#
+#  Outputs:
+#
+#      One line per graph to stdout:
+#	  shape, edges, wall seconds, tracemalloc peak MB,
+#	  peak RSS MB, component count
+#
+#  Exit Codes:
+#
+#      0:  Successful completion
+#      1:  An exception occurred
+#
+#  Implementation:
+#
+#      Each graph is generated lazily and run in its own child process,
+#      once untraced for the wall time and peak RSS (resource) and once
+#      under tracemalloc for the peak traced allocation. Graph shapes:
+#
+#	  star   - hubs with COMPONENT_SIZE leaves each
+#	  chain  - paths of COMPONENT_SIZE edges
+#	  small  - many components of 1 to 3 edges
+#	  giant  - GIANT_COUNT components, each a path through all its
+#		   IDs plus randomly placed edges
+#
+#  Notes:  None
+#
+###########################################################################
+
+import itertools
+import multiprocessing
+import random
+import resource
+import sys
+import time
+import tracemalloc
+import clusterize
+
+USAGE = 'Usage: benchClusterize.py [maxEdges [workers [seed]]]'
+TAB = '\t'
+
+SIZES = [10000, 100000, 1000000, 10000000]
+SHAPES = ['star', 'chain', 'small', 'giant']
+
+# edges per component for the star and chain shapes
+COMPONENT_SIZE = 1000
+
+# number of components in the giant shape
+GIANT_COUNT = 4
+
+maxEdges = SIZES[-1]
+workers = 1
+seed = 1
+
+###--- functions ---###
+
+def checkArgs ():
+    # Purpose: Validate the arguments to the script.
+    # Returns: Nothing
+    # Assumes: Nothing
+    # Effects: Sets global variables, exits if arguments are invalid
+    # Throws: Nothing
+
+    global maxEdges, workers, seed
+
+    if len(sys.argv) > 4:
+        print(USAGE)
+        sys.exit(1)
+    try:
+        if len(sys.argv) > 1:
+            maxEdges = int(sys.argv[1])
+        if len(sys.argv) > 2:
+            workers = int(sys.argv[2])
+        if len(sys.argv) > 3:
+            seed = int(sys.argv[3])
+    except ValueError:
+        print(USAGE)
+        sys.exit(1)
+    return
+
+def edges(shape, edgeCt, seed):
+    # Purpose: generate the edges of a synthetic graph
+    # Returns: generator of (mouse ID, homolog ID) pairs
+    # Assumes: shape is one of SHAPES
+    # Effects: Nothing
+    # Throws: Nothing
+
+    rnd = random.Random(seed)
+    if shape == 'star':
+        for i in range(edgeCt):
+            yield ('MGI:%s' % (i // COMPONENT_SIZE), 'HGNC:%s' % i)
+    elif shape == 'chain':
+        # alternate the organism along each path
+        for i in range(edgeCt):
+            start = i // COMPONENT_SIZE * (COMPONENT_SIZE + 1)
+            one = start + i % COMPONENT_SIZE
+            if one % 2:
+                yield ('HGNC:%s' % one, 'MGI:%s' % (one + 1))
+            else:
+                yield ('MGI:%s' % one, 'HGNC:%s' % (one + 1))
+    elif shape == 'small':
+        i = 0
+        component = 0
+        while i < edgeCt:
+            size = min(rnd.randint(1, 3), edgeCt - i)
+            for j in range(size):
+                yield ('MGI:%s' % component, 'HGNC:%s.%s' % (component, j))
+            i += size
+            component += 1
+    elif shape == 'giant':
+        # a quarter as many IDs as edges on each side, split into
+        # components; about half the edges are the paths that join each
+        # component, the rest are placed at random within them
+        nodeCt = max(edgeCt // (4 * GIANT_COUNT), 1)
+        for pair in itertools.islice(itertools.chain(
+                giantPaths(nodeCt), giantEdges(nodeCt, rnd)), edgeCt):
+            yield pair
+
+def giantPaths(nodeCt):
+    # Purpose: the paths through every ID of each giant component
+    # Returns: generator of (mouse ID, homolog ID) pairs
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    for component in range(GIANT_COUNT):
+        start = component * nodeCt
+        for i in range(start, start + nodeCt):
+            yield ('MGI:%s' % i, 'HGNC:%s' % i)
+            if i + 1 < start + nodeCt:
+                yield ('MGI:%s' % (i + 1), 'HGNC:%s' % i)
+
+def giantEdges(nodeCt, rnd):
+    # Purpose: random edges within the giant components
+    # Returns: endless generator of (mouse ID, homolog ID) pairs
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    while True:
+        start = rnd.randrange(GIANT_COUNT) * nodeCt
+        yield ('MGI:%s' % (start + rnd.randrange(nodeCt)),
+            'HGNC:%s' % (start + rnd.randrange(nodeCt)))
+
+def runCase(shape, edgeCt, traced):
+    # Purpose: cluster one graph; run in a child process so peak RSS
+    #	is measured for this graph alone (the clusterizer's own worker
+    #	processes are not counted)
+    # Returns: (wall seconds, tracemalloc peak bytes or None,
+    #	peak RSS kilobytes, component count)
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    if traced:
+        tracemalloc.start()
+    start = time.perf_counter()
+    clusterizer = clusterize.Clusterizer(workers)
+    clusterizer.add_edges(edges(shape, edgeCt, seed))
+    clusterDict = clusterizer.clusters('BENCH')
+    seconds = time.perf_counter() - start
+    peak = None
+    if traced:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return (seconds, peak, maxRss, len(clusterDict))
+
+def runChild(conn, shape, edgeCt, traced):
+    # Purpose: runCase, sending the result to the parent; child process
+    #	target
+    # Returns: Nothing
+    # Assumes: Nothing
+    # Effects: writes to conn
+    # Throws: Nothing
+
+    conn.send(runCase(shape, edgeCt, traced))
+    conn.close()
+
+def runInChild(shape, edgeCt, traced):
+    # Purpose: runCase in a fresh child process; not a Pool worker,
+    #	which is daemonic and so could not start the clusterizer's
+    #	worker processes
+    # Returns: the runCase result
+    # Assumes: Nothing
+    # Effects: starts and stops a process
+    # Throws: EOFError if the child fails without a result
+
+    context = multiprocessing.get_context('fork')
+    parentConn, childConn = context.Pipe(duplex=False)
+    process = context.Process(target=runChild, args=(childConn, shape, edgeCt, traced))
+    process.start()
+    childConn.close()
+    try:
+        result = parentConn.recv()
+    finally:
+        parentConn.close()
+        process.join()
+    return result
+
+def bench():
+    # Purpose: run every shape at every size up to maxEdges
+    # Returns: Nothing
+    # Assumes: Nothing
+    # Effects: Writes to stdout
+    # Throws: Nothing
+
+    print('workers: %s seed: %s' % (workers, seed))
+    print(TAB.join(['shape', 'edges', 'seconds', 'tracedMB', 'rssMB', 'components']))
+    for edgeCt in SIZES:
+        if edgeCt > maxEdges:
+            break
+        for shape in SHAPES:
+            seconds, peak, maxRss, clusterCt = runInChild(shape, edgeCt, 0)
+            peak = runInChild(shape, edgeCt, 1)[1]
+            print(TAB.join([shape, str(edgeCt), '%.2f' % seconds,
+                '%.1f' % (peak / 1048576.0), '%.1f' % (maxRss / 1024.0),
+                str(clusterCt)]))
+            sys.stdout.flush()
+    return
+
+###--- main program ---###
+
+checkArgs()
+bench()
+sys.exit(0)
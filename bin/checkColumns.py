@@ -36,6 +36,7 @@
 
 import string
 import sys
+import tsvreader
 
 USAGE = 'Usage: checkColumns.py  inputFile numColumns'
 TAB = '\t'
@@ -71,7 +72,7 @@ def openFile ():
     global fpInput
 
     try:
-        fpInput = open(inputFile, 'r')
+        fpInput = tsvreader.openFile(inputFile)
     except:
         print('Cannot open input file: ' + inputFile)
         sys.exit(1)
@@ -86,13 +87,10 @@ def checkColumns ():
 
     global errors
     lineNum = 0
-    for line in fpInput.readlines():
-        if str.find(line, '#') == 0:
-            continue
+    for columns in tsvreader.records(fpInput):
         colError = 0
         lineNum = lineNum + 1
-        columns = str.split(line, TAB)
-        # remove newline from last column
+        # remove whitespace from last column
         last = columns[-1].strip()
         columns[-1] = last
         nc = len(columns) 
@@ -9,10 +9,16 @@
 # Inputs:
 #       1. List of lists
 #           [ [idType1, idType2], [idType1, idType2], ...]
+#	   or pairs added one at a time to a Clusterizer
+#	2. Optional cluster map file from the previous load, tab delimited:
+#	    1. Cluster signature
+#	    2. Cluster ID
 #
 # Outputs:
 #        1. Dictionary of auto-generated clusterIDs mapped to tuples of clusters
 #	     {clusterID:(id1, ..., idn), ...}
+#	 2. Optional staged cluster map file (same format as input 2), which
+#	    replaces the map once the load has succeeded
 #
 # Exit Codes:
 #
@@ -21,101 +27,346 @@
 #
 #  Assumes:  Nothing
 #
-#  Notes:  None
+#  Notes:  Clustering is done with a union-find (disjoint-set) engine;
+#	IDs are interned to dense integers and the parent/rank tables
+#	are kept in arrays, using union by rank and path compression.
+#	Cluster IDs are deterministic: clusters are numbered in the order
+#	of their sorted members, and a cluster whose signature (a hash of
+#	its sorted members) is in the previous load's map keeps its old ID.
+#	The IDs are those of the load ready file and the map only; the
+#	loader leaves MRK_Cluster.clusterID empty, and finds the unchanged
+#	clusters by their member markers (LOAD_DELTA=1). Members keep the
+#	order they were first added in, which sequences them.
+#	The map is written to a staged file (stagedMapPath), which
+#	homologyload.sh moves over the map once the load has succeeded, so a failed run leaves the previous map in
+#	place.
+#	With more than one worker, edges are sharded across a process pool;
+#	each worker returns a spanning forest of its shard and the forests
+#	are merged, which gives exactly the serial components. The pool is
+#	forked, which is only safe with no other threads running (a thread
+#	may hold a lock the workers then wait on forever), so the caller
+#	stops its threads first (e.g. lookupcache.close()); if any are
+#	still running the edges are merged serially
 #
 # sc   01/14/2015
 #       - initial implementation
 ###########################################################################
 
-import string
-import Set
+import hashlib
+import multiprocessing
+import os
+import threading
+from array import array
+
+###--- globals ---###
+
+# constants
+TAB = '\t'
+CRT = '\n'
+
+# in parallel mode, fewer edges than this per worker are clustered serially
+MIN_SHARD_EDGES = 50000
+
+###--- classes ---###
+
+class UnionFind:
+    # Purpose: disjoint-set forest over IDs interned to dense integers;
+    #	union by rank with path compression
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    def __init__(self):
+        # {id:node index, ...}
+        self.index = {}
+        # [id, ...] node index to id
+        self.ids = []
+        # parent node index of each node, roots are their own parent
+        self.parent = array('l')
+        # upper bound on the height of each root's tree
+        self.rank = array('B')
+
+    def node(self, id):
+        # Purpose: intern id, adding it as a singleton set if new
+        # Returns: the node index of id
+
+        n = self.index.get(id)
+        if n is None:
+            n = len(self.ids)
+            self.index[id] = n
+            self.ids.append(id)
+            self.parent.append(n)
+            self.rank.append(0)
+        return n
+
+    def find(self, n):
+        # Purpose: find the root of node n, compressing the path to it
+        # Returns: the node index of the root
+
+        parent = self.parent
+        root = n
+        while parent[root] != root:
+            root = parent[root]
+        while parent[n] != root:
+            parent[n], n = root, parent[n]
+        return root
+
+    def union(self, a, b):
+        # Purpose: merge the sets containing nodes a and b
+        # Returns: Nothing
+
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return
+        rank = self.rank
+        if rank[a] < rank[b]:
+            a, b = b, a
+        self.parent[b] = a
+        if rank[a] == rank[b]:
+            rank[a] += 1
+
+    def components(self):
+        # Purpose: group every node by its root
+        # Returns: list of lists of ids, in order of each component's
+        #	first interned member; members in interned order
+
+        find = self.find
+        ids = self.ids
+        byRoot = {}
+        for n in range(len(ids)):
+            root = find(n)
+            if root not in byRoot:
+                byRoot[root] = []
+            byRoot[root].append(ids[n])
+        return list(byRoot.values())
+
+class Clusterizer:
+    # Purpose: incrementally cluster ID pairs as they are produced, so
+    #	callers do not need to build a list of every pair first
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    def __init__(self, workers=1):
+        self.uf = UnionFind()
+
+        # parallel mode: edges are kept as pairs of node indexes until
+        # clusters() shards them across a pool of this many processes
+        self.workers = workers
+        self.edgeOne = array('l')
+        self.edgeTwo = array('l')
+
+        # set by clusters()
+        # {clusterID:signature, ...}
+        self.signatureDict = {}
+        # cluster IDs whose signature was in the previous load's map
+        self.unchangedSet = set([])
+
+    def add_edge(self, idOne, idTwo):
+        # Purpose: relate idOne and idTwo; idOne is clustered on its own
+        #	when idTwo is 'None'
+        # Returns: Nothing
+
+        nodeOne = self.uf.node(idOne)
+        if idTwo == 'None':
+            return
+        nodeTwo = self.uf.node(idTwo)
+        if self.workers > 1:
+            self.edgeOne.append(nodeOne)
+            self.edgeTwo.append(nodeTwo)
+        else:
+            self.uf.union(nodeOne, nodeTwo)
+
+    def add_edges(self, pairs):
+        # Purpose: add_edge for each two-element pair in an iterable
+        # Returns: Nothing
+
+        for idOne, idTwo in pairs:
+            self.add_edge(idOne, idTwo)
+
+    def clusters(self, idPrefix, mapFilePath=None):
+        # Purpose: name the clusters found so far; if mapFilePath is
+        #	given, reuse the IDs of unchanged clusters from it and
+        #	then write this run's clusters to its staged path
+        # Returns: A dictionary mapping an auto-generated ID (using idPrefix)
+        # to a cluster (list) of IDs, in the order they were first added
+
+        self.mergeEdges()
+
+        previousDict = {}
+        if mapFilePath:
+            previousDict = readClusterMap(mapFilePath)
+
+        # new IDs are numbered after the highest ID of the previous load
+        clusterCt = 0
+        for clusterId in previousDict.values():
+            prefix, sep, number = clusterId.rpartition(':')
+            if prefix == idPrefix and number.isdigit():
+                clusterCt = max(clusterCt, int(number))
+
+        # numbered in sorted order, so the IDs do not depend on the order
+        # of the input
+        clusterList = [(sorted(cluster), cluster) for cluster in self.uf.components()]
+        clusterList.sort()
+
+        # {clusterID:(id1, ..., idn), ...} 
+        namedDict = {}
+        self.signatureDict = {}
+        self.unchangedSet = set([])
+        for members, cluster in clusterList:
+            signature = clusterSignature(members)
+            if signature in previousDict:
+                nextId = previousDict[signature]
+                self.unchangedSet.add(nextId)
+            else:
+                clusterCt += 1
+                nextId = '%s:%s' % (idPrefix, clusterCt)
+            namedDict[nextId] = cluster
+            self.signatureDict[nextId] = signature
+
+        if mapFilePath:
+            writeClusterMap(stagedMapPath(mapFilePath), self.signatureDict)
+
+        return namedDict
+
+    def mergeEdges(self):
+        # Purpose: parallel mode; union the edges buffered by add_edge,
+        #	sharding them across a process pool when there are enough
+        #	and no other threads are running
+        # Returns: Nothing
+        # Effects: starts and stops worker processes
+
+        edgeCt = len(self.edgeOne)
+        if edgeCt == 0:
+            return
+        workers = min(self.workers, edgeCt // MIN_SHARD_EDGES)
+        if workers > 1 and threading.active_count() > 1:
+            print('clustering serially: %s other threads are running' % (threading.active_count() - 1))
+            workers = 1
+        if workers > 1:
+            shardSize = (edgeCt + workers - 1) // workers
+            shardList = []
+            for start in range(0, edgeCt, shardSize):
+                end = start + shardSize
+                shardList.append((len(self.uf.ids), self.edgeOne[start:end], self.edgeTwo[start:end]))
+            # fork, so the workers do not re-import the calling script
+            pool = multiprocessing.get_context('fork').Pool(workers)
+            forestList = pool.map(spanningForest, shardList)
+            pool.close()
+            pool.join()
+        else:
+            forestList = [(self.edgeOne, self.edgeTwo)]
+
+        # each forest has the same components as its shard, so merging
+        # the forests gives the same components as the serial engine
+        uf = self.uf
+        for nodeList, rootList in forestList:
+            for i in range(len(nodeList)):
+                uf.union(nodeList[i], rootList[i])
+
+        self.edgeOne = array('l')
+        self.edgeTwo = array('l')
+
+        return
 
 ###--- functions ---###
 
-# getRoots from:
-# http://stackoverflow.com/questions/10301000/python-connected-components
-def getRoots(aNeigh):
-    def findRoot(aNode,aRoot):
-        while aNode != aRoot[aNode][0]:
-            aNode = aRoot[aNode][0]
-        return (aNode,aRoot[aNode][1])
-    myRoot = {}
-    for myNode in list(aNeigh.keys()):
-        myRoot[myNode] = (myNode,0)
-    for myI in aNeigh:
-        for myJ in aNeigh[myI]:
-            (myRoot_myI,myDepthMyI) = findRoot(myI,myRoot)
-            (myRoot_myJ,myDepthMyJ) = findRoot(myJ,myRoot)
-            if myRoot_myI != myRoot_myJ:
-                myMin = myRoot_myI
-                myMax = myRoot_myJ
-                if  myDepthMyI > myDepthMyJ:
-                    myMin = myRoot_myJ
-                    myMax = myRoot_myI
-                myRoot[myMax] = (myMax,max(myRoot[myMin][1]+1,myRoot[myMax][1]))
-                myRoot[myMin] = (myRoot[myMax][0],-1)
-    myToRet = {}
-    for myI in aNeigh:
-        if myRoot[myI][0] == myI:
-            myToRet[myI] = []
-    for myI in aNeigh:
-        myToRet[findRoot(myI,myRoot)[0]].append(myI)
-    return myToRet
-
-def cluster(toClusterList, idPrefix):
+def spanningForest(shard):
+    # Purpose: worker process side of the parallel mode; find the
+    #	components of one shard of edges
+    # Returns: two arrays (node indexes, root indexes) with one edge
+    #	from each non-root node of the shard to its root
+    # Assumes: shard is (node count, array of node indexes, array of
+    #	node indexes)
+    # Effects: Nothing
+    # Throws: Nothing
+
+    nodeCt, edgeOne, edgeTwo = shard
+    uf = UnionFind()
+    uf.parent = array('l', range(nodeCt))
+    uf.rank = array('B', bytes(nodeCt))
+    for i in range(len(edgeOne)):
+        uf.union(edgeOne[i], edgeTwo[i])
+
+    nodeList = array('l')
+    rootList = array('l')
+    for n in set(edgeOne) | set(edgeTwo):
+        root = uf.find(n)
+        if root != n:
+            nodeList.append(n)
+            rootList.append(root)
+
+    return (nodeList, rootList)
+
+def clusterSignature(members):
+    # Purpose: content-derived identity of a cluster, independent of
+    #	the order its members were found in
+    # Returns: hex SHA-1 digest of the sorted member IDs
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    return hashlib.sha1('\n'.join(sorted(members)).encode()).hexdigest()
+
+def readClusterMap(mapFilePath):
+    # Purpose: read the cluster map file of the previous load
+    # Returns: {signature:clusterID, ...}, empty if there is no file
+    # Assumes: Nothing
+    # Effects: Reads the file system
+    # Throws: Nothing
+
+    previousDict = {}
+    if not os.path.exists(mapFilePath):
+        return previousDict
+    fpMap = open(mapFilePath, 'r')
+    for line in fpMap:
+        tokens = str.split(line[:-1], TAB)
+        if len(tokens) == 2:
+            previousDict[tokens[0]] = tokens[1]
+    fpMap.close()
+
+    return previousDict
+
+def stagedMapPath(mapFilePath):
+    # Purpose: the file a run's cluster map is written to until its load
+    #	has succeeded
+    # Returns: path
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    return '%s.new' % mapFilePath
+
+def writeClusterMap(mapFilePath, signatureDict):
+    # Purpose: write {clusterID:signature, ...} as a cluster map file;
+    #	the file is replaced in one step, through a temp file of this
+    #	process, so readers and other writers never see it half written
+    # Returns: Nothing
+    # Assumes: Nothing
+    # Effects: Writes to the file system
+    # Throws: Nothing
+
+    tmpPath = '%s.%s.tmp' % (mapFilePath, os.getpid())
+    fpMap = open(tmpPath, 'w')
+    for clusterId in signatureDict:
+        fpMap.write('%s%s%s%s' % (signatureDict[clusterId], TAB, clusterId, CRT))
+    fpMap.close()
+    os.replace(tmpPath, mapFilePath)
+
+    return
+
+def cluster(toClusterList, idPrefix, workers=1):
     # Purpose: finds clusters of related elements in toClusterList, 
-    # a list of two-element lists
+    # a list of two-element lists, using workers processes
     # Returns: A dictionary mapping an auto-generated ID (using idPrefix)
-    # to a cluster (tuple) of IDs
+    # to a cluster (list) of IDs
     # Assumes: toClusterList is a list of two-element lists
     # Effects: Nothing
     # Throws: Nothing
 
-    #fpCF = open(inputFile, 'r')
-    
-    # read file into two data structures representing column 1 and column 2
     # e.g. idOne=human NCBI ID, idTwo=mouse MGI ID
+    clusterizer = Clusterizer(workers)
+    clusterizer.add_edges(toClusterList)
 
-    # ids from column 1 mapped to ids in column 2
-    idOneToIdTwoDict = {}
-
-    # ids from column 2 mapped to ids from column 2
-    idTwoToIdOneDict = {}
-
-    #for line in fpCF.readlines():
-    for pair in toClusterList:
-        idOne = pair[0] # egID
-        idTwo = pair[1] # MGI ID
-        #
-        if idOne not in idOneToIdTwoDict:
-            idOneToIdTwoDict[idOne] = []
-        if idTwo != 'None':
-            idOneToIdTwoDict[idOne].append(idTwo)
-            if idTwo not in idTwoToIdOneDict:
-                idTwoToIdOneDict[idTwo] = []
-            idTwoToIdOneDict[idTwo].append(idOne)
-                 
-    # concatenate the dicts together
-    allDict = dict(list(idOneToIdTwoDict.items()) + list(idTwoToIdOneDict.items()))
-    #print 'allDict:'
-    #for key in allDict:
-        #print 'key: %s value: %s' % (key, allDict[key])
-
-    #print getRoots(allDict)
-    clusterDict = getRoots(allDict)
-    #print 'clusterDict'
-    #for key in clusterDict:
-        #print 'key: %s value: %s' % (key, clusterDict[key])
-    #print clusterDict
-    # {clusterID:(id1, ..., idn), ...} 
-    namedDict = {}
-    clusterCt = 0
-    for c in clusterDict:
-        cluster = clusterDict[c]
-        
-        clusterCt += 1
-        nextId = '%s:%s' % (idPrefix, clusterCt)
-        #clusterDict[nextId] = ', '.join(c)
-        namedDict[nextId] = cluster
-        
-    return namedDict
+    return clusterizer.clusters(idPrefix)
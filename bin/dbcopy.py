@@ -0,0 +1,197 @@
+##########################################################################
+#
+# Purpose:
+#       Bulk COPY to and from the database for the homology loads, on a
+#	psycopg2 connection of their own
+#
+# Usage: import dbcopy
+#
+# Inputs:
+#       1. Configuration - MGD_DBSERVER, MGD_DBNAME, MGD_DBUSER and
+#	   MGD_DBPASSWORDFILE (see master.config)
+#       2. Rows to copy in, as tuples of values or as lines already in
+#	   the text format
+#
+# Outputs:
+#        1. Rows copied into a table
+#        2. Rows of a query, passed one at a time to a function as
+#	    lists of field values
+#
+# Exit Codes:
+#
+#      0:  Successful completion
+#      1:  An exception occurred
+#
+#  Assumes:  Nothing
+#
+#  Notes:  The db module has no COPY support, so COPY runs on a separate
+#	connection; temp tables created here are only visible on that
+#	connection. Rows are written in the default text format, streamed
+#	to the server in chunks rather than built as one string. Query
+#	results are read with COPY (select ...) TO STDOUT and decoded a
+#	chunk at a time, so no per-row dicts or result list are built
+#
+###########################################################################
+
+import os
+import re
+import psycopg2
+
+###--- globals ---###
+
+# constants
+TAB = '\t'
+CRT = '\n'
+
+# bytes sent to the server per COPY chunk
+CHUNK_SIZE = 1048576
+
+# characters escaped in the text format
+escapes = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+# escape sequences of the text format and the characters they stand for
+escapeRE = re.compile(r'\\(.)')
+unescapes = {'t': '\t', 'n': '\n', 'r': '\r', 'b': '\b', 'f': '\f', 'v': '\v'}
+
+###--- classes ---###
+
+class LineReader:
+    # Purpose: file-like object read by copy_expert; encodes the COPY
+    #	text lines of an iterable as they are read
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buffer = b''
+        self.lineCt = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            size = CHUNK_SIZE
+        lines = [self.buffer]
+        length = len(self.buffer)
+        while length < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            line = str.encode(line)
+            self.lineCt += 1
+            lines.append(line)
+            length += len(line)
+        data = b''.join(lines)
+        self.buffer = data[size:]
+        return data[:size]
+
+class RowWriter:
+    # Purpose: file-like object written by copy_expert; decodes the
+    #	COPY text lines as they arrive and passes each row to a function
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    def __init__(self, rowFunction):
+        self.rowFunction = rowFunction
+        self.rest = b''
+        self.rowCt = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = str.encode(data)
+        # decode only whole lines, so no character is split
+        complete, newline, self.rest = (self.rest + data).rpartition(b'\n')
+        if newline:
+            rowFunction = self.rowFunction
+            for line in bytes.decode(complete).split(CRT):
+                if '\\' in line:
+                    rowFunction(list(map(copyValue, line.split(TAB))))
+                else:
+                    rowFunction(line.split(TAB))
+                self.rowCt += 1
+        return len(data)
+
+###--- functions ---###
+
+def connect():
+    # Purpose: open a connection to the MGD database
+    # Returns: psycopg2 connection
+    # Assumes: Nothing
+    # Effects: opens a database connection
+    # Throws: psycopg2.Error if the connection fails
+
+    fpPassword = open(os.environ['MGD_DBPASSWORDFILE'], 'r')
+    password = str.strip(fpPassword.readline())
+    fpPassword.close()
+
+    return psycopg2.connect(host=os.environ['MGD_DBSERVER'],
+        dbname=os.environ['MGD_DBNAME'], user=os.environ['MGD_DBUSER'],
+        password=password)
+
+def copyLine(row):
+    # Purpose: format one row in the COPY text format
+    # Returns: string ending in a newline
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    values = []
+    for value in row:
+        if value is None:
+            values.append('\\N')
+        else:
+            values.append(str.translate(str(value), escapes))
+    return TAB.join(values) + CRT
+
+def copyValue(field):
+    # Purpose: decode one field of the COPY text format
+    # Returns: string, or None for a null
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    if field == '\\N':
+        return None
+    return escapeRE.sub(lambda m: unescapes.get(m.group(1), m.group(1)), field)
+
+def copyOut(cursor, query, rowFunction):
+    # Purpose: run query, passing each row of the result to rowFunction
+    #	as a list of strings (None for nulls) as the rows arrive
+    # Returns: number of rows
+    # Assumes: Nothing
+    # Effects: queries the database
+    # Throws: psycopg2.Error
+
+    writer = RowWriter(rowFunction)
+    cursor.copy_expert('copy (%s) to stdout' % query, writer, CHUNK_SIZE)
+    return writer.rowCt
+
+def copyIn(cursor, table, rows, columns=None):
+    # Purpose: COPY rows into table
+    # Returns: Nothing
+    # Assumes: Nothing
+    # Effects: writes to the database
+    # Throws: psycopg2.Error
+
+    copyLines(cursor, table, map(copyLine, rows), columns)
+
+    return
+
+def copyLines(cursor, table, lines, columns=None, null=None):
+    # Purpose: COPY lines of the text format into table
+    # Returns: number of lines copied
+    # Assumes: each line ends in a newline; null, if given, is the
+    #	string the lines use for a null (e.g. '' in a bcp file) instead
+    #	of \N
+    # Effects: writes to the database
+    # Throws: psycopg2.Error
+
+    if columns:
+        table = '%s (%s)' % (table, ', '.join(columns))
+    options = ''
+    if null is not None:
+        options = " with null as '%s'" % null
+    reader = LineReader(lines)
+    cursor.copy_expert('copy %s from stdin%s' % (table, options), reader, CHUNK_SIZE)
+
+    return reader.lineCt
@@ -0,0 +1,333 @@
+#
+#  homologyOrchestrator.py
+###########################################################################
+#
+#  Purpose:
+#
+#       Run several homology loads (homologyload.sh configFile) at the
+#	same time, with one log and one summary for the whole run
+#
+#  Usage:
+#
+#      homologyOrchestrator.py configFile [configFile ...]
+#
+#      where:
+#          configFile = a load configuration, relative to HOMOLOGYLOAD
+#		(e.g. zfinload.config)
+#
+#  Env Vars:
+#
+#      HOMOLOGYLOAD, ALLIANCE_COMBINED, ORCHESTRATOR_LOG, ORCHESTRATOR_LOADS,
+#      ORCHESTRATOR_DIAG_LINES, and the lookup settings (see common.config)
+#
+#  Inputs:
+#
+#      The load configuration files
+#
+#  Outputs:
+#
+#      ORCHESTRATOR_LOG: the output of every load, each line prefixed
+#	  with its configuration, followed when the load finishes by the
+#	  last ORCHESTRATOR_DIAG_LINES lines of its diagnostic log
+#	  (LOG_DIAG), then the summary; the summary is also written to
+#	  stdout
+#
+#  Exit Codes:
+#
+#      0:  Successful completion
+#      1:  A load failed or an exception occurred
+#
+#  Implementation:
+#
+#      1. The marker lookups of the loads are loaded once, into the
+#	  lookup snapshots (LOOKUP_CACHE_DIR), so each load reads them
+#	  from there instead of querying them again.
+#      2. Up to ORCHESTRATOR_LOADS loads run at once, each through
+#	  homologyload.sh, so each still has its own jobstream, logs and
+#	  reports. A load waits for the loads it depends on (DEPENDENCIES),
+#	  and is skipped if any of them failed or was skipped.
+#	  Every load gets the same HOMOLOGY_RUN_ID, so files one load
+#	  stages for another are only used within the run.
+#      3. The database stage of each load (loader and bcp) is bounded by
+#	  homologyload.sh itself, with the DB_SLOTS lock files.
+#
+#  Notes:  With ALLIANCE_COMBINED=1 the Alliance clustered load waits for
+#	the Alliance direct load, whose combined preprocessor stages the
+#	clustered load ready file, so the Alliance file is parsed only once
+#
+###########################################################################
+
+import collections
+import os
+import subprocess
+import sys
+import threading
+import time
+import alliance
+import lookupcache
+
+USAGE = 'Usage: homologyOrchestrator.py configFile [configFile ...]'
+TAB = '\t'
+CRT = '\n'
+
+# {configFile:[configFile it waits for, ...], ...} a load runs only if
+# the loads it waits for succeeded
+DEPENDENCIES = {}
+
+# {configFile:[(logical DBs, organism, preferred, prefixPart), ...], ...}
+# the lookups each load's preprocessor starts, from the lists the
+# preprocessors themselves start them from
+LOOKUPS = {
+    'zfinload.config': lookupcache.ZFIN_LOOKUPS,
+    'geishaload.config': lookupcache.GEISHA_LOOKUPS,
+    'xenbaseload.config': lookupcache.XENBASE_LOOKUPS,
+    'alliance_directload.config': alliance.DirectHomologies.LOOKUPS,
+    'alliance_clusteredload.config': alliance.ClusteredHomologies.LOOKUPS,
+}
+
+# the combined preprocessor of alliance_directload also starts the
+# clustered load's lookups, and stages the clustered load's files
+if os.environ['ALLIANCE_COMBINED'] == '1':
+    LOOKUPS['alliance_directload.config'] = alliance.DirectHomologies.LOOKUPS + alliance.ClusteredHomologies.LOOKUPS
+    DEPENDENCIES['alliance_clusteredload.config'] = ['alliance_directload.config']
+
+homologyload = os.environ['HOMOLOGYLOAD']
+logPath = os.environ['ORCHESTRATOR_LOG']
+
+# number of loads run at the same time
+maxLoads = int(os.environ['ORCHESTRATOR_LOADS'])
+
+# lines of each load's diagnostic log copied to the consolidated log;
+# 0 for all of it
+diagLines = int(os.environ['ORCHESTRATOR_DIAG_LINES'])
+
+# configuration files, in the order given
+configList = []
+
+# the consolidated log, and the lock the load threads write it under
+fpLog = None
+logLock = threading.Lock()
+
+# {configFile:Load, ...}
+loadDict = {}
+
+###--- classes ---###
+
+class Load:
+    # Purpose: one homologyload.sh run
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    def __init__(self, configFile):
+        self.configFile = configFile
+        self.name = configFile.replace('.config', '')
+
+        # set when the run has finished, whatever its status
+        self.done = threading.Event()
+
+        # exit status of homologyload.sh, 'skipped' if a load it waits
+        # for did not succeed, or the error that stopped it being run
+        self.status = None
+        self.startTime = None
+        self.endTime = None
+
+###--- functions ---###
+
+def checkArgs ():
+    # Purpose: Validate the arguments to the script.
+    # Returns: Nothing
+    # Assumes: Nothing
+    # Effects: Sets global variables, exits if arguments are invalid
+    # Throws: Nothing
+
+    global configList
+
+    if len(sys.argv) < 2:
+        print(USAGE)
+        sys.exit(1)
+    configList = sys.argv[1:]
+    for configFile in configList:
+        if configList.count(configFile) > 1:
+            print('%s given more than once' % configFile)
+            sys.exit(1)
+    return
+
+def log(name, line):
+    # Purpose: write a line to the consolidated log
+    # Returns: Nothing
+    # Assumes: fpLog is open
+    # Effects: Writes to the file system
+    # Throws: Nothing
+
+    with logLock:
+        fpLog.write('%s %s%s%s%s' % (time.strftime('%H:%M:%S'), name, TAB, line.rstrip(CRT), CRT))
+        fpLog.flush()
+
+def diagPath(load):
+    # Purpose: find the diagnostic log of a load, by sourcing the
+    #	configuration files the way homologyload.sh does
+    # Returns: the LOG_DIAG path, '' if the load does not set one
+    # Assumes: Nothing
+    # Effects: runs a shell
+    # Throws: subprocess.CalledProcessError if a file cannot be sourced
+
+    return subprocess.check_output(
+        ['sh', '-c', '. ./common.config && . ./"$1" && echo "${LOG_DIAG}"',
+        'sh', load.configFile],
+        cwd=homologyload, stderr=subprocess.DEVNULL,
+        universal_newlines=True).strip()
+
+def appendDiag(load):
+    # Purpose: copy the end of a load's diagnostic log to the
+    #	consolidated log
+    # Returns: Nothing
+    # Assumes: the load has finished
+    # Effects: Writes to the file system
+    # Throws: Nothing
+
+    try:
+        path = diagPath(load)
+        if not path or not os.path.exists(path):
+            log(load.name, 'no diagnostic log')
+            return
+        with open(path, errors='replace') as fpDiag:
+            if diagLines > 0:
+                lineList = collections.deque(fpDiag, diagLines)
+            else:
+                lineList = fpDiag.readlines()
+        log(load.name, 'diagnostic log %s:' % path)
+        for line in lineList:
+            log(load.name, 'diag: %s' % line)
+    except Exception as e:
+        log(load.name, 'could not read the diagnostic log: %s' % e)
+
+    return
+
+def warmLookups():
+    # Purpose: load the lookups of the loads into the lookup snapshots,
+    #	each lookup once however many loads use it
+    # Returns: Nothing
+    # Assumes: Nothing
+    # Effects: queries a database, writes snapshot files
+    # Throws: Nothing
+
+    if not lookupcache.cacheDir or lookupcache.inputDriven:
+        log('orchestrator', 'lookup snapshots not used; each load queries its own lookups')
+        return
+
+    # the loads query any lookup that is not warmed, so a failure here
+    # only costs time
+    try:
+        futureList = []
+        for configFile in configList:
+            for logicalDBs, organism, preferred, prefixPart in LOOKUPS.get(os.path.basename(configFile), []):
+                futureList.append(lookupcache.startLookup(logicalDBs, organism, preferred, prefixPart))
+        for future in futureList:
+            future.result()
+        log('orchestrator', '%s lookups ready' % len(lookupcache.lookupDict))
+    except Exception as e:
+        log('orchestrator', 'could not warm the lookups: %s' % e)
+    lookupcache.close()
+
+    return
+
+def runLoad(load, slots):
+    # Purpose: run one load once the loads it depends on have finished
+    #	and a load slot is free; thread target
+    # Returns: Nothing
+    # Assumes: Nothing
+    # Effects: runs homologyload.sh, writes to the consolidated log
+    # Throws: Nothing
+
+    try:
+        for configFile in DEPENDENCIES.get(os.path.basename(load.configFile), []):
+            for other in loadDict.values():
+                if os.path.basename(other.configFile) == configFile:
+                    log(load.name, 'waiting for %s' % other.name)
+                    other.done.wait()
+                    if other.status != 0:
+                        load.status = 'skipped'
+                        log(load.name, 'skipped: %s finished with status %s' % (other.name, other.status))
+                        return
+
+        with slots:
+            load.startTime = time.time()
+            log(load.name, 'starting homologyload.sh %s' % load.configFile)
+            process = subprocess.Popen(
+                [os.path.join(homologyload, 'bin', 'homologyload.sh'), load.configFile],
+                cwd=homologyload, stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT, universal_newlines=True)
+            for line in process.stdout:
+                log(load.name, line)
+            load.status = process.wait()
+            load.endTime = time.time()
+            log(load.name, 'finished with status %s' % load.status)
+            appendDiag(load)
+    except Exception as e:
+        load.status = 'error: %s' % e
+        log(load.name, load.status)
+    finally:
+        load.done.set()
+
+    return
+
+def runLoads():
+    # Purpose: run all the loads
+    # Returns: Nothing
+    # Assumes: Nothing
+    # Effects: runs the loads
+    # Throws: Nothing
+
+    slots = threading.Semaphore(maxLoads)
+    threadList = []
+    for configFile in configList:
+        loadDict[configFile] = Load(configFile)
+    for configFile in configList:
+        thread = threading.Thread(target=runLoad, args=(loadDict[configFile], slots))
+        thread.start()
+        threadList.append(thread)
+    for thread in threadList:
+        thread.join()
+
+    return
+
+def writeSummary(startTime):
+    # Purpose: write the summary of the run to the log and stdout
+    # Returns: 0 if every load succeeded, otherwise 1
+    # Assumes: Nothing
+    # Effects: Writes to the file system
+    # Throws: Nothing
+
+    lines = [TAB.join(['load', 'status', 'seconds'])]
+    failed = 0
+    for configFile in configList:
+        load = loadDict[configFile]
+        seconds = ''
+        if load.startTime and load.endTime:
+            seconds = '%.0f' % (load.endTime - load.startTime)
+        if load.status != 0:
+            failed = 1
+        lines.append(TAB.join([load.name, str(load.status), seconds]))
+    lines.append(TAB.join(['total', str(failed), '%.0f' % (time.time() - startTime)]))
+
+    for line in lines:
+        log('summary', line)
+        print(line)
+
+    return failed
+
+###--- main program ---###
+
+checkArgs()
+fpLog = open(logPath, 'a')
+startTime = time.time()
+os.environ['HOMOLOGY_RUN_ID'] = '%s.%s' % (time.strftime('%Y%m%d%H%M%S'), os.getpid())
+log('orchestrator', 'running %s as %s' % (' '.join(configList), os.environ['HOMOLOGY_RUN_ID']))
+
+warmLookups()
+runLoads()
+status = writeSummary(startTime)
+
+fpLog.close()
+sys.exit(status)
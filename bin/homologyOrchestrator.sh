@@ -0,0 +1,52 @@
+#!/bin/sh
+
+#
+# This script is a wrapper around the orchestrator that runs several
+# homology loads at the same time
+#
+# Usage:
+#
+#     homologyOrchestrator.sh configFile [configFile ...]
+#
+#     e.g. homologyOrchestrator.sh zfinload.config xenbaseload.config
+#	geishaload.config alliance_directload.config
+#	alliance_clusteredload.config
+#
+USAGE='Usage: homologyOrchestrator.sh configFile [configFile ...]'
+
+cd `dirname $0`/..
+
+CONFIG_COMMON=`pwd`/common.config
+
+#
+#  Verify the argument(s) to the shell script.
+#
+if [ $# -lt 1 ]
+then
+    echo ${USAGE}; exit 1
+fi
+
+#
+# verify & source the common configuration file
+#
+if [ ! -r ${CONFIG_COMMON} ]
+then
+    echo "Missing configuration file: ${CONFIG_COMMON}"
+    exit 1
+fi
+
+. ${CONFIG_COMMON}
+
+for c in "$@"
+do
+    if [ ! -r `pwd`/${c} ]
+    then
+        echo "Cannot read configuration file: ${c}"
+        exit 1
+    fi
+done
+
+mkdir -p `dirname ${ORCHESTRATOR_LOG}`
+${PYTHON} ${HOMOLOGYLOAD}/bin/homologyOrchestrator.py "$@"
+STAT=$?
+exit ${STAT}
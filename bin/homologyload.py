@@ -2,20 +2,28 @@
 ##########################################################################
 #
 # Purpose:
-#       Create bcp files for the MRK_Cluster* tables
+#       Create bcp files for the MRK_Cluster* tables, or copy the rows
+#	straight into them
 #
 # Usage: homologyload.py
+#	or, from a preprocessor (PIPELINE_LOAD=1),
+#	homologyload.loadRecords(records)
 #
 # Inputs:
 #       1. load-ready file tab-delimited in following format:
 #           1. Cluster ID - identifies the HG cluster
 #           2. Comma separated list of marker keys in the cluster
 #		ordered as you would like them sequenced in MGI_ClusterMember
+#	   or the same clusters as (cluster ID, [marker key, ...]) records
+#	   handed over by a preprocessor
 #       2. Configuration - see homologyload.config and individual load configs
 #
 # Outputs:
 #        1. MRK_Cluster.bcp
 #        2. MRK_ClusterMember.bcp
+#        3. with LOAD_MODE=copy or staging, MRK_Cluster and
+#	    MRK_ClusterMember rows (and the bcp files only if
+#	    LOAD_TEE_BCP=1)
 #
 # Exit Codes:
 #
@@ -24,15 +32,55 @@
 #
 #  Assumes:  Nothing
 #
-#  Notes:  None
+#  Notes:  With LOAD_MODE=bcp the bcp files are loaded by
+#	homologyload.sh with bcpin. With LOAD_MODE=copy the same lines
+#	are sent with COPY FROM STDIN on a dbcopy connection as they are
+#	made, and committed together once both tables are copied; the
+#	load ready file is read once per table.
+#
+#	With LOAD_MODE=staging the rows are copied into temp staging
+#	tables (never WAL-logged, and private to the load) and committed
+#	there, and their counts checked. Only then are the old clusters
+#	deleted and the staged rows inserted with INSERT ... SELECT, in
+#	one short transaction, so readers never see the jobstream's
+#	clusters missing and the delete's locks are held only for the
+#	swap.
+#
+#	The MRK_Cluster and MRK_ClusterMember keys are reserved up front,
+#	exactly as many as the load inserts, each from nextval of the
+#	table's sequence. The keys are unique however many loads (or other
+#	writers) use the sequences at the same time, so the homology loads
+#	can run in parallel; they may not be consecutive
+#
+#	With LOAD_DELTA=1 the clusters already loaded by the jobstream
+#	are read in one COPY query and matched to the clusters of the
+#	load ready file by their member marker keys, in sequence order.
+#	Only the clusters that are gone are deleted and only the new ones
+#	inserted; the clusters that match keep their keys and members and
+#	only have cluster_date brought up to date
+#
+#	With PIPELINE_LOAD=1 the preprocessor runs the loader itself,
+#	in the same process, handing over the clusters it made with
+#	loadRecords; the load ready file is written only if
+#	PIPELINE_ARCHIVE=1, for the archive, and never read back. As
+#	homologyload.sh then runs no separate loader, the loader waits for
+#	a database slot (DB_SLOT_LOCK) of its own. This needs
+#	LOAD_MODE=copy or staging, which delete and insert in that one
+#	slot; with LOAD_MODE=bcp the loader exits
 #
 # sc   01/14/2015
 #       - initial implementation
 ###########################################################################
 import os
+import sys
+import fcntl
 import mgi_utils
 import time
+from array import array
 import db
+import bcpwriter
+import dbcopy
+import tsvreader
 
 ###--- globals ---###
 
@@ -45,14 +93,41 @@ inFile = os.environ['INPUT_FILE_LOAD']
 clusterBCP = os.environ['CLUSTER_BCP']
 memberBCP = os.environ['MEMBER_BCP']
 
+# 'bcp' to write the bcp files for bcpin; 'copy' to copy the rows into
+# the database, 'staging' to copy them into staging tables first; both
+# also write the bcp files if teeBCP is true
+loadMode = os.environ['LOAD_MODE']
+teeBCP = os.environ['LOAD_TEE_BCP'] == '1'
+
+# true to delete and insert only the clusters that changed
+loadDelta = os.environ['LOAD_DELTA'] == '1'
+
+# true if the loader is run by the preprocessor (see loadRecords)
+pipelineLoad = os.environ['PIPELINE_LOAD'] == '1'
+
+# database slot lock files (see homologyload.sh), taken in pipeline mode
+dbSlotLock = os.environ['DB_SLOT_LOCK']
+dbSlots = int(os.environ['DB_SLOTS'])
+
 # file descriptors
-fpInFile = ''
 fpClusterBCP = ''
 fpMemberBCP = ''
+fpDbSlot = None
+
+# [(cluster ID, [marker key, ...]), ...] the clusters handed over by the
+# preprocessor; None to read them from the load ready file
+recordList = None
 
-# database primary keys, the next one available
-nextClusterKey = ''	# MRK_Cluster
-nextMemberKey = ''	# MRK_ClusterMember
+# database primary keys reserved for this load, in the order they are
+# used
+clusterKeys = array('q')	# MRK_Cluster
+memberKeys = array('q')		# MRK_ClusterMember
+
+# dbcopy connection for the delta queries and COPY, opened when needed
+copyConnection = None
+
+# [member list, ...] the clusters to insert in delta mode
+insertList = []
 
 # get MRK_Cluster type and source keys from Configuration
 clusterTypeKey = os.environ['CLUSTER_TYPE_KEY']
@@ -84,26 +159,31 @@ def init():
     # Effects: opens a database connection
     # Throws: Nothing
 
-    global fpInFile, fpClusterBCP, fpMemberBCP
-    global createdByKey, nextClusterKey, nextMemberKey
+    global fpClusterBCP, fpMemberBCP
+    global createdByKey
 
     # create file descriptors for input/output files
-    try:
-        fpInFile = open(inFile, 'r')
-    except:
-        exit(1, 'Could not open file %s\n' % inFile)
-
-    try:
-        fpClusterBCP = open(clusterBCP, 'w')
-    except:
-        exit(1, 'Could not open file %s\n' % clusterBCP)
-
-    try:
-        fpMemberBCP = open(memberBCP, 'w')
-    except:
-        exit(1, 'Could not open file %s\n' % memberBCP)
-
-    # get next MRK_Cluster and MRK_ClusterMember key
+    if recordList is None:
+        try:
+            tsvreader.openFile(inFile).close()
+        except:
+            exit(1, 'Could not open file %s\n' % inFile)
+
+    # copied rows are written to the bcp files only when teed
+    fpClusterBCP = None
+    fpMemberBCP = None
+    if loadMode == 'bcp' or teeBCP:
+        try:
+            fpClusterBCP = open(clusterBCP, 'w')
+        except:
+            exit(1, 'Could not open file %s\n' % clusterBCP)
+
+        try:
+            fpMemberBCP = open(memberBCP, 'w')
+        except:
+            exit(1, 'Could not open file %s\n' % memberBCP)
+
+    # get the MGI_User key of the load
     user = os.environ['MGD_DBUSER']
     passwordFileName = os.environ['MGD_DBPASSWORDFILE']
     db.useOneConnection(1)
@@ -114,12 +194,6 @@ def init():
     createdByKey = results[0]['_User_key']
     #print 'createdByKey: %s' % createdByKey
 
-    results = db.sql(''' select nextval('mrk_cluster_seq') as nextKey ''', 'auto')
-    nextClusterKey = results[0]['nextKey']
-
-    results = db.sql(''' select nextval('mrk_clustermember_seq') as nextKey ''', 'auto')
-    nextMemberKey = results[0]['nextKey']
-
     return
 
 def deleteHomologies():
@@ -145,39 +219,366 @@ def deleteHomologies():
 
     return
 
+def waitForDbSlot():
+    # Purpose: pipeline mode; wait for a database slot, as
+    #	homologyload.sh does for a separate loader
+    # Returns: Nothing
+    # Assumes: Nothing
+    # Effects: creates and locks a DB_SLOT_LOCK file; the slot is held
+    #	until closeFiles or the process exits
+    # Throws: Nothing
+
+    global fpDbSlot
+
+    if not dbSlotLock:
+        return
+    os.makedirs(os.path.dirname(dbSlotLock), exist_ok=True)
+    while True:
+        for slot in range(1, dbSlots + 1):
+            fp = open('%s.%s' % (dbSlotLock, slot), 'w')
+            try:
+                fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                fp.close()
+                continue
+            fpDbSlot = fp
+            print('Holding database slot %s' % slot)
+            return
+        time.sleep(10)
+
+def connection():
+    # Purpose: the dbcopy connection, opened when first used
+    # Returns: psycopg2 connection
+    # Assumes: Nothing
+    # Effects: opens a database connection
+    # Throws: psycopg2.Error
+
+    global copyConnection
+
+    if copyConnection is None:
+        copyConnection = dbcopy.connect()
+    return copyConnection
+
+def memberLists():
+    # Purpose: the clusters handed over by the preprocessor, or else
+    #	those of the load ready file
+    # Returns: generator of lists of member marker keys (integers), in
+    #	sequence order
+    # Assumes: Nothing
+    # Effects: Reads the file
+    # Throws: ValueError if a marker key is not an integer
+
+    if recordList is not None:
+        for id, memberList in recordList:
+            yield memberList
+        return
+
+    fp = tsvreader.openFile(inFile)
+    for tokens in tsvreader.records(fp, comment=None):
+        id = tokens[0]
+        members = tokens[1]
+        yield list(map(int, str.split(members, ',')))
+    fp.close()
+
+def clusters(memberListIter):
+    # Purpose: number clusters and their members with the reserved keys
+    # Returns: generator of (cluster key, member keys, list of member
+    #	marker keys)
+    # Assumes: reserveKeys has been run for these clusters
+    # Effects: Nothing
+    # Throws: IndexError if more clusters or members are numbered than
+    #	keys were reserved
+
+    memberIdx = 0
+    for clusterIdx, memberList in enumerate(memberListIter):
+        memberEnd = memberIdx + len(memberList)
+        if memberEnd > len(memberKeys):
+            raise IndexError('more cluster members than reserved keys')
+        yield (clusterKeys[clusterIdx], memberKeys[memberIdx:memberEnd], memberList)
+        memberIdx = memberEnd
+
+def insertClusters():
+    # Purpose: the clusters to insert: the new clusters in delta mode,
+    #	otherwise every cluster (see memberLists)
+    # Returns: generator of numbered clusters (see clusters)
+    # Assumes: deleteChangedHomologies has been run in delta mode
+    # Effects: Reads the file
+    # Throws: Nothing
+
+    if loadDelta:
+        return clusters(insertList)
+    return clusters(memberLists())
+
+def clusterWriter():
+    # Purpose: writer of MRK_Cluster rows; the rows differ only in the
+    #	cluster key
+    # Returns: bcpwriter.BcpWriter
+    # Assumes: init has been run
+    # Effects: Nothing
+    # Throws: Nothing
+
+    return bcpwriter.BcpWriter(fpClusterBCP, 10, {1:clusterTypeKey,
+        2:clusterSource, 3:'', 4:'', 5:clusterDate, 6:createdByKey,
+        7:createdByKey, 8:cdate, 9:cdate})
+
+def memberRows(clusterList):
+    # Purpose: MRK_ClusterMember rows of the clusters
+    # Returns: generator of (member key, cluster key, marker key,
+    #	sequence number)
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    # members are sequenced in the order of the load ready file
+    for clusterKey, keys, memberList in clusterList:
+        for i, markerKey in enumerate(memberList):
+            yield (keys[i], clusterKey, markerKey, i + 1)
+
+def sequenceKeys(cursor, sequence, count):
+    # Purpose: reserve count keys from a sequence
+    # Returns: array of the keys, ascending
+    # Assumes: Nothing
+    # Effects: advances the sequence; nextval is not rolled back, so
+    #	the keys stay reserved whatever happens to the transaction
+    # Throws: psycopg2.Error
+
+    keys = array('q')
+    if count:
+        dbcopy.copyOut(cursor, '''select nextval('%s')
+            from generate_series(1, %s)''' % (sequence, count),
+            lambda fields: keys.append(int(fields[0])))
+    keys = array('q', sorted(keys))
+    return keys
+
+def reserveKeys():
+    # Purpose: reserve the MRK_Cluster and MRK_ClusterMember keys of the
+    #	clusters to insert
+    # Returns: Nothing
+    # Assumes: findChangedHomologies has been run in delta mode
+    # Effects: advances mrk_cluster_seq and mrk_clustermember_seq; sets
+    #	clusterKeys and memberKeys
+    # Throws: psycopg2.Error
+
+    global clusterKeys, memberKeys
+
+    if loadDelta:
+        memberCts = list(map(len, insertList))
+    else:
+        memberCts = list(map(len, memberLists()))
+
+    cursor = connection().cursor()
+    clusterKeys = sequenceKeys(cursor, 'mrk_cluster_seq', len(memberCts))
+    memberKeys = sequenceKeys(cursor, 'mrk_clustermember_seq', sum(memberCts))
+    cursor.close()
+    connection().commit()
+    print('Reserved %s MRK_Cluster keys, %s MRK_ClusterMember keys' % (len(clusterKeys), len(memberKeys)))
+
+    return
+
+def findChangedHomologies():
+    # Purpose: delta mode; find the clusters of this jobstream that are
+    #	not in the load ready file, and the clusters of the file that
+    #	are not loaded
+    # Returns: Nothing
+    # Assumes: init has been run
+    # Effects: queries a database, sets insertList, creates the temp
+    #	table todelete2 of the cluster keys to delete
+    # Throws: psycopg2.Error
+
+    global insertList
+
+    cursor = connection().cursor()
+
+    # {(marker key, ...):[cluster key, ...], ...} the loaded clusters
+    # by their members in sequence order
+    loadedDict = {}
+    currentKey = [None, []]
+
+    def addMember(fields):
+        clusterKey, markerKey = fields
+        if clusterKey != currentKey[0]:
+            addCluster()
+            currentKey[0] = clusterKey
+            currentKey[1] = []
+        if markerKey is not None:
+            currentKey[1].append(int(markerKey))
+
+    def addCluster():
+        if currentKey[0] is not None:
+            loadedDict.setdefault(tuple(currentKey[1]), []).append(currentKey[0])
+
+    dbcopy.copyOut(cursor, '''select c._Cluster_key, m._Marker_key
+        from MRK_Cluster c left outer join MRK_ClusterMember m
+            on m._Cluster_key = c._Cluster_key
+        where c._CreatedBy_key = %s
+        order by c._Cluster_key, m.sequenceNum''' % createdByKey, addMember)
+    addCluster()
+    loadedCt = sum(map(len, loadedDict.values()))
+
+    # a loaded cluster matches at most one cluster of the file
+    insertList = []
+    for memberList in memberLists():
+        loadedKeys = loadedDict.get(tuple(memberList))
+        if loadedKeys:
+            loadedKeys.pop()
+        else:
+            insertList.append(memberList)
+    deleteKeys = [(clusterKey,) for loadedKeys in loadedDict.values() for clusterKey in loadedKeys]
+
+    print('Changed Homology Clusters: deleting %s of %s loaded; inserting %s' % \
+        (len(deleteKeys), loadedCt, len(insertList)))
+    cursor.execute('create temp table todelete2 (_Cluster_key int)')
+    dbcopy.copyIn(cursor, 'todelete2', deleteKeys)
+    cursor.close()
+    connection().commit()
+
+    return
+
+def deleteClusters(cursor):
+    # Purpose: delete the clusters being replaced: in delta mode those
+    #	in todelete2, also updating the cluster_date of the others;
+    #	otherwise every cluster of this jobstream
+    # Returns: Nothing
+    # Assumes: findChangedHomologies has been run in delta mode
+    # Effects: deletes records from a database, without committing
+    # Throws: psycopg2.Error
+
+    print('Deleting Homology Clusters, Members')
+    if not loadDelta:
+        cursor.execute('''delete from MRK_Cluster
+            where _CreatedBy_key = %s''' % createdByKey)
+        return
+
+    cursor.execute('''delete from MRK_Cluster m
+        using todelete2 d
+        where d._Cluster_key = m._Cluster_key''')
+    cursor.execute('''update MRK_Cluster
+        set cluster_date = '%s'
+        where _CreatedBy_key = %s
+        and cluster_date != '%s' ''' % (clusterDate, createdByKey, clusterDate))
+
+    return
+
+def deleteChangedHomologies():
+    # Purpose: delta mode; delete the clusters that are gone
+    # Returns: Nothing
+    # Assumes: findChangedHomologies has been run
+    # Effects: deletes records from a database
+    # Throws: psycopg2.Error
+
+    cursor = connection().cursor()
+    deleteClusters(cursor)
+    cursor.close()
+
+    # with LOAD_MODE=copy the inserts are committed with the deletes
+    if loadMode != 'copy':
+        connection().commit()
+
+    return
+
 def createBCPFiles():
-    # Purpose: Create bcp files from the load ready file 
+    # Purpose: Create bcp files of the clusters to insert
     # Returns: 0
     # Assumes: Nothing
     # Effects: Writes to the file system
     # Throws: Nothing
 
-    global nextClusterKey,  nextMemberKey
-    for line in fpInFile.readlines():
-        tokens = str.split(line[:-1], TAB)
-        id = tokens[0]
-        members = tokens[1]
-        memberList = list(map(str.strip, str.split(members, ',')))
+    clusterBcpWriter = clusterWriter()
+    memberWriter = bcpwriter.BcpWriter(fpMemberBCP, 4)
+
+    for cluster in insertClusters():
+        clusterKey, keys, memberList = cluster
 
         #
         # create MRK_Cluster
         #
 
-        fpClusterBCP.write('%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s' % (nextClusterKey, TAB, clusterTypeKey, TAB, clusterSource, TAB, TAB, TAB, clusterDate, TAB, createdByKey, TAB, createdByKey, TAB, cdate, TAB, cdate, CRT))
+        clusterBcpWriter.writeRow((clusterKey,))
 
         #
         # create MRK_ClusterMember
         #
 
         # sort the list by organism and symbol
-        sequenceNum = 0
-        for markerKey in memberList:
-            sequenceNum += 1
-            fpMemberBCP.write('%s%s%s%s%s%s%s%s' % (nextMemberKey, TAB, nextClusterKey, TAB, markerKey, TAB, sequenceNum, CRT))
-            nextMemberKey += 1
+        memberWriter.writeRows(memberRows([cluster]))
 
-        # now increment the cluster key
-        nextClusterKey += 1
+    clusterBcpWriter.flush()
+    memberWriter.flush()
+
+    return
+
+def copyTables(clusterTable, memberTable):
+    # Purpose: copy the rows of the clusters to insert into clusterTable
+    #	and memberTable (MRK_Cluster and MRK_ClusterMember or their
+    #	staging tables), writing the bcp files as well if they are open
+    # Returns: (number of clusters, number of members) copied
+    # Assumes: init has been run; deleteHomologies has been committed
+    #	or deleteChangedHomologies run
+    # Effects: writes to the database, without committing, and to the
+    #	file system
+    # Throws: psycopg2.Error
+
+    cursor = connection().cursor()
+
+    # the bcp lines leave the null columns empty
+    clusterLines = clusterWriter().lines([(clusterKey,) for clusterKey, keys, memberList in insertClusters()])
+    clusterCt = dbcopy.copyLines(cursor, clusterTable, clusterLines, null='')
+    print('Copied %s rows into %s' % (clusterCt, clusterTable))
+
+    memberLines = bcpwriter.BcpWriter(fpMemberBCP, 4).lines(memberRows(insertClusters()))
+    memberCt = dbcopy.copyLines(cursor, memberTable, memberLines, null='')
+    print('Copied %s rows into %s' % (memberCt, memberTable))
+
+    cursor.close()
+
+    return (clusterCt, memberCt)
+
+def stageTables():
+    # Purpose: copy the rows into the staging tables and check them
+    # Returns: Nothing
+    # Assumes: init has been run; findChangedHomologies has been run in
+    #	delta mode
+    # Effects: writes to the database and the file system; exits if
+    #	the staged rows are not the rows copied
+    # Throws: psycopg2.Error
+
+    cursor = connection().cursor()
+    cursor.execute('create temp table mrk_cluster_stage (like MRK_Cluster)')
+    cursor.execute('create temp table mrk_clustermember_stage (like MRK_ClusterMember)')
+
+    clusterCt, memberCt = copyTables('mrk_cluster_stage', 'mrk_clustermember_stage')
+
+    cursor.execute('''select (select count(*) from mrk_cluster_stage),
+        (select count(*) from mrk_clustermember_stage),
+        (select count(*) from mrk_clustermember_stage m
+            where not exists (select 1 from mrk_cluster_stage c
+            where c._Cluster_key = m._Cluster_key))''')
+    stagedClusterCt, stagedMemberCt, orphanCt = cursor.fetchone()
+    cursor.close()
+    connection().commit()
+
+    if (stagedClusterCt, stagedMemberCt, orphanCt) != (clusterCt, memberCt, 0):
+        print('Staging check failed: copied %s clusters, %s members; staged %s clusters, %s members, %s without a cluster' % \
+            (clusterCt, memberCt, stagedClusterCt, stagedMemberCt, orphanCt))
+        sys.exit(1)
+
+    return
+
+def swapTables():
+    # Purpose: replace the clusters of this jobstream with the staged
+    #	clusters in one transaction
+    # Returns: Nothing
+    # Assumes: stageTables has been run
+    # Effects: deletes and inserts records in a database
+    # Throws: psycopg2.Error
+
+    cursor = connection().cursor()
+    deleteClusters(cursor)
+    cursor.execute('insert into MRK_Cluster select * from mrk_cluster_stage')
+    cursor.execute('insert into MRK_ClusterMember select * from mrk_clustermember_stage')
+    cursor.close()
+    connection().commit()
+    print('Swapped the staged clusters into MRK_Cluster, MRK_ClusterMember')
 
     return
 
@@ -189,17 +590,73 @@ def closeFiles():
     # Throws: Nothing
 
     db.useOneConnection(0)
-    fpClusterBCP.close()
-    fpMemberBCP.close()
+    if copyConnection is not None:
+        copyConnection.close()
+    if fpClusterBCP:
+        fpClusterBCP.close()
+        fpMemberBCP.close()
+    if fpDbSlot is not None:
+        fpDbSlot.close()
     return
 
-###--- main program ---###
+def load():
+    # Purpose: run the load
+    # Returns: Nothing
+    # Assumes: recordList is set if the clusters are handed over
+    # Effects: see the functions called
+    # Throws: Nothing
 
-print('%s' % mgi_utils.date())
+    print('%s' % mgi_utils.date())
+
+    if pipelineLoad:
+        # bcpin would run later, in homologyload.sh's own slot, after
+        # the deletes were committed and this slot released
+        if loadMode == 'bcp':
+            print('PIPELINE_LOAD=1 needs LOAD_MODE=copy or staging')
+            sys.exit(1)
+        waitForDbSlot()
+    init()
+    if loadDelta:
+        findChangedHomologies()
+    reserveKeys()
+    if loadMode == 'staging':
+        stageTables()
+        swapTables()
+    else:
+        if loadDelta:
+            deleteChangedHomologies()
+        else:
+            deleteHomologies()
+        if loadMode == 'copy':
+            copyTables('MRK_Cluster', 'MRK_ClusterMember')
+            connection().commit()
+        else:
+            createBCPFiles()
+    closeFiles()
+
+    print('%s' % mgi_utils.date())
 
-init()
-deleteHomologies()
-createBCPFiles()
-closeFiles()
+    return
+
+def loadRecords(records):
+    # Purpose: pipeline mode; load the clusters a preprocessor made,
+    #	without the load ready file
+    # Returns: Nothing
+    # Assumes: records is a list of (cluster ID, [marker key, ...]),
+    #	marker keys as integers in sequence order (see
+    #	bcpwriter.LoadReadyWriter); the preprocessor has closed its own
+    #	database connection
+    # Effects: see load
+    # Throws: Nothing
+
+    global recordList
+
+    recordList = records
+    load()
+
+    return
+
+###--- main program ---###
 
-print('%s' % mgi_utils.date())
+if __name__ == '__main__':
+    load()
@@ -13,8 +13,6 @@ USAGE='Usage: homologyload.sh configFile'
 cd `dirname $0`/..
 
 CONFIG_COMMON=`pwd`/common.config
-LOG=`pwd`/homologyload.log
-rm -rf ${LOG}
 
 #
 #  Verify the argument(s) to the shell script.
@@ -27,6 +25,10 @@ else
 fi
 CONFIG_LOAD=`pwd`/${CONFIG_LOAD}
 
+# one log per load, so loads run at the same time keep their own
+LOG=`pwd`/`basename ${CONFIG_LOAD} .config`.homologyload.log
+rm -rf ${LOG}
+
 #
 # Create a temporary file and make sure that it is removed when this script
 # terminates.
@@ -118,19 +120,45 @@ then
 fi
 
 #
-# copy file from default to input - some files are gzipped
+# check that PIPELINE_LOAD=1 is not used with LOAD_MODE=bcp: the loader
+# in the preprocessor would delete the clusters and release its database
+# slot before this script could take one for bcpin, leaving the
+# jobstream without clusters in between
+#
+if [ "${PIPELINE_LOAD}" = "1" -a "${LOAD_MODE}" = "bcp" ]
+then
+    # set STAT for endJobStream.py
+    STAT=1
+    checkStatus ${STAT} "PIPELINE_LOAD=1 needs LOAD_MODE=copy or staging"
+fi
+
+#
+# copy file from default to input - gzipped files are read in place
+# (their configs set INPUT_FILE to INPUT_FILE_DEFAULT), unless
+# INPUT_FILE_DECOMPRESS=1: then they are decompressed into INPUTDIR and
+# INPUT_FILE is pointed at the copy, which the preprocessor can memory
+# map (and split across PARSE_WORKERS)
 # loads with no input file will be specified as 'None'
 #
 
 if [ "${INPUT_FILE_DEFAULT}" != "None" ]
 then
 
-    echo "copying ${INPUT_FILE_DEFAULT} to ${INPUTDIR}" >> ${LOG_DIAG}
-    # copy the latest file from /data/downloads to the input dir
-    if [ ${INPUT_FILE_DEFAULT: -2} = 'gz' ]
+    if [ ${INPUT_FILE_DEFAULT: -2} = 'gz' -a "${INPUT_FILE_DECOMPRESS}" = "1" ]
     then
-        zcat ${INPUT_FILE_DEFAULT} > ${INPUT_FILE}
+        INPUT_FILE=${INPUTDIR}/`basename ${INPUT_FILE_DEFAULT} .gz`
+        export INPUT_FILE
+        echo "decompressing ${INPUT_FILE_DEFAULT} to ${INPUT_FILE}" >> ${LOG_DIAG}
+        gzip -dc ${INPUT_FILE_DEFAULT} > ${INPUT_FILE}.tmp && \
+        mv ${INPUT_FILE}.tmp ${INPUT_FILE}
+        STAT=$?
+        checkStatus ${STAT} "decompressing ${INPUT_FILE_DEFAULT}"
+    elif [ ${INPUT_FILE_DEFAULT: -2} = 'gz' ]
+    then
+        echo "reading ${INPUT_FILE_DEFAULT} in place" >> ${LOG_DIAG}
     else
+        echo "copying ${INPUT_FILE_DEFAULT} to ${INPUTDIR}" >> ${LOG_DIAG}
+        # copy the latest file from /data/downloads to the input dir
         cp ${INPUT_FILE_DEFAULT} ${INPUTDIR}
     fi
 fi
@@ -154,6 +182,37 @@ checkColumns ()
     fi
 }
 
+#
+# FUNCTION: wait for a database slot, one of the DB_SLOT_LOCK.1 to
+#           DB_SLOT_LOCK.<DB_SLOTS> lock files, so only DB_SLOTS loads
+#           write to the database at the same time. The slot is held on
+#           file descriptor 9 until it is closed or the script exits.
+#
+waitForDbSlot ()
+{
+    if [ "${DB_SLOT_LOCK}" = "" ]
+    then
+        return 0
+    fi
+    mkdir -p `dirname ${DB_SLOT_LOCK}`
+    while true
+    do
+        SLOT=1
+        while [ ${SLOT} -le ${DB_SLOTS} ]
+        do
+            exec 9>${DB_SLOT_LOCK}.${SLOT}
+            if flock -n 9
+            then
+                echo "Holding database slot ${SLOT}" >> ${LOG_DIAG}
+                return 0
+            fi
+            exec 9>&-
+            SLOT=`expr ${SLOT} + 1`
+        done
+        sleep 10
+    done
+}
+
 #
 # FUNCTION: run sanity checks on input file
 #           write the line numbers to the sanity report.
@@ -175,7 +234,12 @@ runSanityChecks()
     fi
 
     # check file length, remove whitespace
-    len=`cat ${INPUT_FILE} | wc -l | sed 's/ //g'`
+    if [ ${INPUT_FILE: -2} = 'gz' ]
+    then
+        len=`gzip -dc ${INPUT_FILE} | wc -l | sed 's/ //g'`
+    else
+        len=`cat ${INPUT_FILE} | wc -l | sed 's/ //g'`
+    fi
     if [ ${len} -lt ${MIN_LENGTH} ]
     then
 	echo "" >> ${SANITY_RPT}
@@ -236,22 +300,31 @@ STAT=$?
 checkStatus ${STAT} "${PREPROCESSOR}"
 
 #
-# Run the load
+# Run the load; with PIPELINE_LOAD=1 the preprocessor has already run
+# the loader, in its own process and database slot
 #
 echo "" >> ${LOG_DIAG}
 date >> ${LOG_DIAG}
-echo "Running loader ${LOADER}" >> ${LOG_DIAG}
-${PYTHON} ${LOADER}
-STAT=$?
-checkStatus ${STAT} "${LOADER}"
+echo "Waiting for a database slot" >> ${LOG_DIAG}
+waitForDbSlot
+if [ "${PIPELINE_LOAD}" != "1" ]
+then
+    date >> ${LOG_DIAG}
+    echo "Running loader ${LOADER}" >> ${LOG_DIAG}
+    ${PYTHON} ${LOADER}
+    STAT=$?
+    checkStatus ${STAT} "${LOADER}"
+fi
 
 
 #
-# Do BCP
+# Do BCP; with LOAD_MODE=copy or staging the loader has copied the
+# MRK_Cluster and MRK_ClusterMember rows itself (any bcp files are only
+# for the archive)
 #
 TABLE=MRK_Cluster
 
-if [ -s "${OUTPUTDIR}/${TABLE}.bcp" ]
+if [ "${LOAD_MODE}" = "bcp" -a -s "${OUTPUTDIR}/${TABLE}.bcp" ]
 then
 
     echo "" >> ${LOG_DIAG}
@@ -260,11 +333,13 @@ then
 
     # BCP new data 
     ${PG_DBUTILS}/bin/bcpin.csh ${MGD_DBSERVER} ${MGD_DBNAME} ${TABLE} ${OUTPUTDIR} ${TABLE}.bcp ${COLDELIM} ${LINEDELIM} >> ${LOG_DIAG}
+    STAT=$?
+    checkStatus ${STAT} "bcpin ${TABLE}"
 fi
 
 TABLE=MRK_ClusterMember
 
-if [ -s "${OUTPUTDIR}/${TABLE}.bcp" ]
+if [ "${LOAD_MODE}" = "bcp" -a -s "${OUTPUTDIR}/${TABLE}.bcp" ]
 then
 
     echo "" >> ${LOG_DIAG}
@@ -273,6 +348,20 @@ then
 
     # BCP new data 
     ${PG_DBUTILS}/bin/bcpin.csh ${MGD_DBSERVER} ${MGD_DBNAME} ${TABLE} ${OUTPUTDIR} ${TABLE}.bcp ${COLDELIM} ${LINEDELIM} >> ${LOG_DIAG}
+    STAT=$?
+    checkStatus ${STAT} "bcpin ${TABLE}"
+fi
+
+#
+# The clusters are loaded, so the cluster map the preprocessor staged
+# for this run (clusterize.stagedMapPath) replaces the previous one
+#
+if [ "${CLUSTER_MAP_FILE}" != "" -a -f "${CLUSTER_MAP_FILE}.new" ]
+then
+    echo "Replacing the cluster map ${CLUSTER_MAP_FILE}" >> ${LOG_DIAG}
+    mv ${CLUSTER_MAP_FILE}.new ${CLUSTER_MAP_FILE}
+    STAT=$?
+    checkStatus ${STAT} "mv ${CLUSTER_MAP_FILE}.new"
 fi
 
 TABLE=ACC_Accession
@@ -301,11 +390,12 @@ then
     ${PG_DBUTILS}/bin/bcpin.csh ${MGD_DBSERVER} ${MGD_DBNAME} ${TABLE} ${OUTPUTDIR} ${TABLE}.bcp ${COLDELIM} ${LINEDELIM} >> ${LOG_DIAG}
 fi
 
+# release the database slot
+exec 9>&-
 
-cat - <<EOSQL | ${PG_DBUTILS}/bin/doisql.csh $0 >> ${LOG_DIAG}
-select setval('mrk_cluster_seq', (select max(_Cluster_key) from MRK_Cluster));
-select setval('mrk_clustermember_seq', (select max(_ClusterMember_key) from MRK_ClusterMember));
-EOSQL
+# the loader reserves its keys with nextval, so the sequences are not
+# reset to the table maximums (that would let two loads running at the
+# same time reuse keys)
 
 #
 # run postload cleanup and email logs
@@ -0,0 +1,283 @@
+##########################################################################
+#
+# Purpose:
+#       Interned, compact accession ID store shared by the preprocessors
+#
+# Usage: import idstore
+#
+# Inputs:
+#       1. Accession ID strings from the database and the input files
+#
+# Outputs:
+#        1. Each distinct accession ID mapped to a compact integer, once
+#        2. IdMap lookups keyed by those integers
+#        3. FrozenKeyMap read-only lookups of the database accession IDs
+#
+# Exit Codes:
+#
+#      0:  Successful completion
+#      1:  An exception occurred
+#
+#  Assumes:  Nothing
+#
+#  Notes:  An IdMap stores the interned ID of each value in an
+#	array('i') indexed by the interned ID of the key, so an accession
+#	ID is held as a string only once however many lookups and edge
+#	lists refer to it; 0 marks a missing entry.
+#
+#	The database lookups are built once and only read, so they are
+#	frozen instead (FrozenKeyMap): the accession IDs are sorted and
+#	packed into one bytes block with an array of offsets, found
+#	through an open addressing table of crc32 hashes (stable across
+#	processes, unlike hash(), so the table can be saved), and the
+#	values are an array('i') in key order. Several maps over the same
+#	IDs share one KeyTable, and a KeyTable is written and read as a
+#	few flat blocks for the lookup snapshots (see lookupcache.py)
+#
+###########################################################################
+
+import threading
+import zlib
+from array import array
+
+###--- globals ---###
+
+# {accID:interned ID, ...}
+idDict = {}
+
+# [accID, ...] interned ID to accID; ID 0 is reserved for 'not present'
+accIDList = [None]
+
+# guards adding new IDs, which lookups loading on other threads may do
+# at the same time
+lock = threading.Lock()
+
+###--- classes ---###
+
+class IdMap:
+    # Purpose: dict-like lookup of accession ID to accession ID; the
+    #	value is stored as its interned ID
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: KeyError from __getitem__ and pop
+
+    def __init__(self):
+        # interned ID of the value indexed by interned ID of the key, 0
+        # where there is no entry
+        self.values = array('i')
+        self.count = 0
+
+    def __setitem__(self, accID, value):
+        id = intern(accID)
+        values = self.values
+        if id >= len(values):
+            # grow geometrically so loading n entries stays linear
+            values.frombytes(bytes(values.itemsize * max(id + 1 - len(values), len(values))))
+        if not values[id]:
+            self.count += 1
+        values[id] = intern(value)
+
+    def __getitem__(self, accID):
+        value = self.get(accID)
+        if value is None:
+            raise KeyError(accID)
+        return value
+
+    def __contains__(self, accID):
+        return self.get(accID) is not None
+
+    def __len__(self):
+        return self.count
+
+    def get(self, accID, default=None):
+        id = idDict.get(accID, 0)
+        if id and id < len(self.values) and self.values[id]:
+            return accIDList[self.values[id]]
+        return default
+
+    def pop(self, accID):
+        value = self[accID]
+        self.values[idDict[accID]] = 0
+        self.count -= 1
+        return value
+
+    def keys(self):
+        # Returns: list of accession IDs with an entry, in interned order
+        return [accIDList[id] for id in range(1, len(self.values)) if self.values[id]]
+
+class KeyTable:
+    # Purpose: sorted, packed set of accession IDs, each found by its
+    #	position in the sort order
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    def __init__(self, block=b'', offsets=None, slots=None):
+        # block: the accession IDs in sort order, encoded and run
+        #	together
+        # offsets: array('i') where ID i starts in block, plus the end
+        # slots: array('i') hash table of positions + 1, 0 where empty;
+        #	its size is a power of 2
+        self.block = block
+        self.offsets = offsets if offsets is not None else array('i', [0])
+        self.slots = slots if slots is not None else array('i', [0])
+        self.mask = len(self.slots) - 1
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def index(self, accID):
+        # Returns: position of accID in the sort order, -1 if not present
+
+        key = str.encode(accID)
+        block = self.block
+        offsets = self.offsets
+        slots = self.slots
+        mask = self.mask
+        slot = zlib.crc32(key) & mask
+        while True:
+            i = slots[slot]
+            if not i:
+                return -1
+            if block[offsets[i - 1]:offsets[i]] == key:
+                return i - 1
+            slot = (slot + 1) & mask
+
+    def keys(self):
+        # Returns: list of the accession IDs in sort order
+
+        block = self.block
+        offsets = self.offsets
+        return [bytes.decode(block[offsets[i]:offsets[i + 1]]) for i in range(len(self))]
+
+    def write(self, fp):
+        # Purpose: write the table to a file open for writing bytes
+        # Returns: Nothing
+
+        fp.write(str.encode('%s %s %s\n' % (len(self), len(self.block), len(self.slots))))
+        fp.write(self.block)
+        self.offsets.tofile(fp)
+        self.slots.tofile(fp)
+
+class FrozenKeyMap:
+    # Purpose: read-only dict-like lookup of accession ID to integer
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: KeyError from __getitem__
+
+    def __init__(self, table=None, values=None):
+        # table: KeyTable of the accession IDs
+        # values: array('i') of the values in the table's sort order
+        self.table = table if table is not None else KeyTable()
+        self.values = values if values is not None else array('i')
+
+    def __getitem__(self, accID):
+        i = self.table.index(accID)
+        if i < 0:
+            raise KeyError(accID)
+        return self.values[i]
+
+    def __contains__(self, accID):
+        return self.table.index(accID) >= 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, accID, default=None):
+        i = self.table.index(accID)
+        if i < 0:
+            return default
+        return self.values[i]
+
+    def keys(self):
+        # Returns: list of the accession IDs, in sort order
+        return self.table.keys()
+
+###--- functions ---###
+
+def intern(accID):
+    # Purpose: map accID to its compact integer, adding it if new
+    # Returns: the interned ID (> 0)
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    id = idDict.get(accID)
+    if id is None:
+        with lock:
+            id = idDict.get(accID)
+            if id is None:
+                # list first, so an ID found in idDict is always in it
+                id = len(accIDList)
+                accIDList.append(accID)
+                idDict[accID] = id
+    return id
+
+def canonical(accID):
+    # Purpose: intern accID
+    # Returns: the single shared string object for accID, so lists and
+    #	dicts built from input files do not keep their own copies
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    return accIDList[intern(accID)]
+
+def freeze(accIDs, valueLists):
+    # Purpose: build read-only lookups over one set of accession IDs
+    # Returns: list of FrozenKeyMap, one per list of valueLists, sharing
+    #	one KeyTable
+    # Assumes: each list of valueLists is parallel to accIDs; where an
+    #	accession ID repeats, its last values are kept (as a dict would)
+    # Effects: Nothing
+    # Throws: Nothing
+
+    # stable sort, so the last of each run of equal IDs is the last added
+    order = sorted(range(len(accIDs)), key=accIDs.__getitem__)
+    keys = []
+    positions = []
+    for i in order:
+        if keys and accIDs[i] == keys[-1]:
+            positions[-1] = i
+        else:
+            keys.append(accIDs[i])
+            positions.append(i)
+
+    keys = list(map(str.encode, keys))
+    offsets = array('i', [0])
+    end = 0
+    for key in keys:
+        end += len(key)
+        offsets.append(end)
+
+    # at most half full, so probe runs stay short
+    slots = array('i', bytes(4 << (2 * len(keys) - 1).bit_length()))
+    mask = len(slots) - 1
+    for i, key in enumerate(keys):
+        slot = zlib.crc32(key) & mask
+        while slots[slot]:
+            slot = (slot + 1) & mask
+        slots[slot] = i + 1
+
+    table = KeyTable(b''.join(keys), offsets, slots)
+    return [FrozenKeyMap(table, array('i', [values[i] for i in positions])) for values in valueLists]
+
+def readKeyTable(fp):
+    # Purpose: read a KeyTable written by KeyTable.write
+    # Returns: KeyTable
+    # Assumes: fp is open for reading bytes
+    # Effects: Reads the file
+    # Throws: ValueError, EOFError if the file is truncated or not a
+    #	KeyTable
+
+    count, blockSize, slotCt = map(int, fp.readline().split())
+    block = fp.read(blockSize)
+    if len(block) != blockSize:
+        raise EOFError('short KeyTable block')
+    offsets = array('i')
+    offsets.fromfile(fp, count + 1)
+    slots = array('i')
+    slots.fromfile(fp, slotCt)
+    if slotCt & (slotCt - 1) or offsets[-1] != blockSize:
+        raise ValueError('bad KeyTable')
+    return KeyTable(block, offsets, slots)
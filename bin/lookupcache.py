@@ -0,0 +1,488 @@
+##########################################################################
+#
+# Purpose:
+#       Marker accession lookups shared by the preprocessors, each
+#	fetched from the database once and kept as an on-disk snapshot
+#	for the next load
+#
+# Usage: import lookupcache
+#
+# Inputs:
+#       1. ACC_Accession/MRK_Marker in the database
+#       2. Snapshot files in LOOKUP_CACHE_DIR
+#       3. Configuration - see common.config
+#
+# Outputs:
+#        1. idstore.FrozenKeyMap lookups of accession ID to marker key
+#	    and to organism key
+#        2. Snapshot files in LOOKUP_CACHE_DIR
+#
+# Exit Codes:
+#
+#      0:  Successful completion
+#      1:  An exception occurred
+#
+#  Assumes:  Nothing
+#
+#  Notes:  A lookup is identified by its logical DB keys, organism key,
+#	whether only preferred accession IDs are used and the accession
+#	ID prefix. Each lookup is queried at most once per process.
+#
+#	The snapshot of a lookup records a freshness probe: the count and
+#	latest modification date of the accession IDs in its logical DBs
+#	and the latest modification date of the markers of its organism.
+#	A snapshot is used only while the probe still matches, so a load
+#	after a database change re-queries the lookup. Snapshots are
+#	replaced in one step, so loads running at the same time only
+#	ever read whole snapshots. An empty LOOKUP_CACHE_DIR turns the
+#	snapshots off.
+#
+#	With LOOKUP_MODE=input a preprocessor passes the distinct IDs of
+#	its input files. They are copied into a temp table and joined to
+#	ACC_Accession on the server, so only the markers of those IDs are
+#	returned. These lookups depend on the input, so they are neither
+#	shared nor snapshotted.
+#
+#	Lookups are read with COPY (select ...) TO STDOUT on a dbcopy
+#	connection and decoded straight into the lookup, rather than
+#	fetched as a list of row dicts. Once loaded a lookup is frozen
+#	into FrozenKeyMaps (see idstore.py), which hold the accession IDs
+#	packed in one block instead of as strings in a dict; a snapshot
+#	is those blocks written out, so it is read without rebuilding
+#	the lookup entry by entry.
+#
+#	startLookup loads a lookup on a pool of LOOKUP_THREADS threads,
+#	each with its own connection, so a preprocessor can start its
+#	lookups, process its input files, and only wait for the lookups
+#	(markerLookup, markerMap) when it needs them
+#
+###########################################################################
+
+import os
+import sys
+import threading
+from array import array
+from concurrent import futures
+import dbcopy
+import idstore
+
+###--- globals ---###
+
+# constants
+CRT = '\n'
+
+# snapshot file format
+SNAPSHOT_VERSION = b'homologyload lookup 2'
+
+# logical DB keys
+MGI_LDB = 1
+EG_LDB = 55
+HGNC_LDB = 64
+RGD_LDB = 47
+ZFIN_LDB = 172
+
+# organism keys
+MOUSE = 1
+HUMAN = 2
+CHICKEN = 63
+ZEBRAFISH = 84
+XENOPUS = 95
+
+# the lookups of the preprocessors, each the arguments of startLookup
+# and markerMap: (logical DBs, organism, preferred, prefixPart)
+EG_ZEBRAFISH = ([EG_LDB], ZEBRAFISH, 1, None)
+EG_CHICKEN = ([EG_LDB], CHICKEN, 1, None)
+EG_XENOPUS = ([EG_LDB], XENOPUS, 1, None)
+EG_MOUSE = ([EG_LDB], MOUSE, 0, None)
+MGI_MOUSE = ([MGI_LDB], MOUSE, 0, 'MGI:')
+MGI_ANY = ([MGI_LDB], None, 0, 'MGI:')
+HGNC_HUMAN = ([HGNC_LDB], HUMAN, 1, None)
+HOMOLOGY_ANY = ([RGD_LDB, HGNC_LDB, ZFIN_LDB], None, 0, None)
+
+# the lookups each of the ZFIN, GEISHA and Xenbase preprocessors starts
+# (startLookups) and then uses; they are kept here, rather than in the
+# preprocessors, so homologyOrchestrator.py can warm the same lookups
+# (the Alliance builders have theirs as alliance.*Homologies.LOOKUPS)
+ZFIN_LOOKUPS = [EG_ZEBRAFISH, MGI_MOUSE]
+GEISHA_LOOKUPS = [EG_CHICKEN, EG_MOUSE]
+XENBASE_LOOKUPS = [EG_XENOPUS, EG_MOUSE]
+
+# directory of the snapshot files; empty for none
+cacheDir = os.environ['LOOKUP_CACHE_DIR']
+
+# {lookup name:Future of the MarkerLookup, ...} lookups started by this
+# process
+lookupDict = {}
+
+# true to look up only the IDs in the input files
+inputDriven = os.environ['LOOKUP_MODE'] == 'input'
+
+# number of threads loading lookups at the same time
+lookupThreads = int(os.environ['LOOKUP_THREADS'])
+
+# thread pool loading the lookups, started when first used
+pool = None
+
+# guards lookupDict, pool and connectionList
+lock = threading.Lock()
+
+# guards stdout, written by the lookup threads (see report)
+reportLock = threading.Lock()
+
+# per-thread dbcopy connection, opened when first used
+threadData = threading.local()
+
+# all the connections opened, for close()
+connectionList = []
+
+###--- classes ---###
+
+class MarkerLookup:
+    # Purpose: accession ID to marker key and organism key lookups for
+    #	the active markers with accession IDs in some logical DBs
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    def __init__(self, name):
+        self.name = name
+
+        # {accID:marker key, ...}
+        self.markers = idstore.FrozenKeyMap()
+
+        # {accID:organism key, ...}
+        self.organisms = idstore.FrozenKeyMap()
+
+        # the rows added since the lookup was last frozen
+        self.accIDs = []
+        self.markerKeys = array('i')
+        self.organismKeys = array('i')
+
+    def add(self, accID, markerKey, organismKey):
+        self.accIDs.append(accID)
+        self.markerKeys.append(markerKey)
+        self.organismKeys.append(organismKey)
+
+    def freeze(self):
+        # Purpose: build markers and organisms from the rows added
+        # Assumes: the lookup is frozen once, after all its rows are added
+
+        self.markers, self.organisms = idstore.freeze(self.accIDs, [self.markerKeys, self.organismKeys])
+        self.accIDs = []
+        self.markerKeys = array('i')
+        self.organismKeys = array('i')
+
+###--- functions ---###
+
+def startLookup(logicalDBs, organism=None, preferred=0, prefixPart=None):
+    # Purpose: start loading the lookup of the active markers that have
+    #	accession IDs in logicalDBs on the thread pool, unless it has
+    #	already been started
+    # Returns: Future of the MarkerLookup
+    # Assumes: Nothing
+    # Effects: starts a thread pool
+    # Throws: Nothing
+
+    global pool
+
+    logicalDBs = tuple(sorted(logicalDBs))
+    name = lookupName(logicalDBs, organism, preferred, prefixPart)
+    with lock:
+        if name not in lookupDict:
+            if pool is None:
+                pool = futures.ThreadPoolExecutor(lookupThreads)
+            lookupDict[name] = pool.submit(loadLookup, name, logicalDBs, organism, preferred, prefixPart)
+        return lookupDict[name]
+
+def startLookups(lookupList):
+    # Purpose: startLookup each lookup of lookupList
+    # Returns: Nothing
+    # Assumes: lookupList is a list of startLookup arguments, e.g.
+    #	ZFIN_LOOKUPS
+    # Effects: starts a thread pool
+    # Throws: Nothing
+
+    for lookup in lookupList:
+        startLookup(*lookup)
+
+    return
+
+def markerLookup(logicalDBs, organism=None, preferred=0, prefixPart=None, accIDs=None):
+    # Purpose: get the lookup of the active markers that have accession
+    #	IDs in logicalDBs, waiting for it if it was started with
+    #	startLookup
+    # Returns: MarkerLookup
+    # Assumes: accIDs, the IDs of the input files, is given if
+    #	inputDriven is true
+    # Effects: queries a database, reads and writes snapshot files
+    # Throws: psycopg2.Error
+
+    if inputDriven and accIDs is not None:
+        logicalDBs = tuple(sorted(logicalDBs))
+        name = lookupName(logicalDBs, organism, preferred, prefixPart)
+        return queryInputLookup(name, logicalDBs, organism, preferred, prefixPart, accIDs)
+    return startLookup(logicalDBs, organism, preferred, prefixPart).result()
+
+def markerMap(logicalDBs, organism=None, preferred=0, prefixPart=None, accIDs=None):
+    # Purpose: get the accession ID to marker key lookup of the active
+    #	markers that have accession IDs in logicalDBs
+    # Returns: idstore.FrozenKeyMap
+    # Assumes: a database connection has been opened
+    # Effects: see markerLookup
+    # Throws: Nothing
+
+    return markerLookup(logicalDBs, organism, preferred, prefixPart, accIDs).markers
+
+def loadLookup(name, logicalDBs, organism, preferred, prefixPart):
+    # Purpose: load a lookup from its snapshot or the database; run on
+    #	the thread pool
+    # Returns: MarkerLookup
+    # Assumes: Nothing
+    # Effects: queries a database, reads and writes snapshot files
+    # Throws: psycopg2.Error
+
+    lookup = None
+    if cacheDir:
+        probe = freshnessProbe(logicalDBs, organism)
+        lookup = readSnapshot(name, probe)
+    if lookup is None:
+        lookup = queryLookup(name, logicalDBs, organism, preferred, prefixPart)
+        if cacheDir:
+            writeSnapshot(lookup, probe)
+    return lookup
+
+def close():
+    # Purpose: stop the thread pool and close the lookup connections
+    # Returns: Nothing
+    # Assumes: Nothing
+    # Effects: closes database connections
+    # Throws: Nothing
+
+    global pool
+
+    if pool is not None:
+        pool.shutdown()
+        pool = None
+    for conn in connectionList:
+        conn.close()
+    del connectionList[:]
+    threadData.__dict__.clear()
+
+    return
+
+def lookupName(logicalDBs, organism, preferred, prefixPart):
+    # Purpose: name a lookup; also its snapshot file name
+    # Returns: string
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    name = 'ldb%s' % '_'.join(map(str, logicalDBs))
+    if organism is not None:
+        name = '%s.org%s' % (name, organism)
+    if preferred:
+        name = '%s.preferred' % name
+    if prefixPart:
+        name = '%s.%s' % (name, prefixPart.rstrip(':'))
+    return name
+
+def freshnessProbe(logicalDBs, organism):
+    # Purpose: summarize the rows a lookup depends on without reading
+    #	them
+    # Returns: string that changes when the lookup may have changed
+    # Assumes: Nothing
+    # Effects: queries a database, on the dbcopy connection
+    # Throws: psycopg2.Error
+
+    organismClause = ''
+    if organism is not None:
+        organismClause = 'where _Organism_key = %s' % organism
+    cursor = connection().cursor()
+    cursor.execute('''select (select count(*)
+            from ACC_Accession
+            where _MGIType_key = 2
+            and _LogicalDB_key in (%s)) as accCount,
+        (select max(modification_date)
+            from ACC_Accession
+            where _MGIType_key = 2
+            and _LogicalDB_key in (%s)) as accDate,
+        (select max(modification_date)
+            from MRK_Marker %s) as markerDate''' % \
+        (', '.join(map(str, logicalDBs)), ', '.join(map(str, logicalDBs)), organismClause))
+    probe = '%s|%s|%s' % cursor.fetchone()
+    cursor.close()
+    connection().commit()
+    return probe
+
+def lookupClauses(logicalDBs, organism, preferred, prefixPart):
+    # Purpose: the where clauses selecting the accession IDs of a lookup
+    # Returns: string
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    clauses = '''a._MGIType_key = 2
+        and a._LogicalDB_key in (%s)
+        and a._Object_key = m._Marker_key
+        and m._Marker_Status_key = 1''' % ', '.join(map(str, logicalDBs))
+    if preferred:
+        clauses = clauses + '\n        and a.preferred = 1'
+    if prefixPart:
+        clauses = clauses + "\n        and a.prefixPart = '%s'" % prefixPart
+    if organism is not None:
+        clauses = clauses + '\n        and m._Organism_key = %s' % organism
+    return clauses
+
+def connection():
+    # Purpose: the dbcopy connection the current thread queries the
+    #	lookups on
+    # Returns: psycopg2 connection
+    # Assumes: Nothing
+    # Effects: opens a database connection when first called by a thread
+    # Throws: psycopg2.Error
+
+    conn = getattr(threadData, 'connection', None)
+    if conn is None:
+        conn = dbcopy.connect()
+        threadData.connection = conn
+        with lock:
+            connectionList.append(conn)
+    return conn
+
+def report(line):
+    # Purpose: write a line to stdout in one piece; print writes the
+    #	line and its newline separately, so lines printed by the lookup
+    #	threads at the same time run together
+    # Returns: Nothing
+    # Assumes: Nothing
+    # Effects: Writes to stdout
+    # Throws: Nothing
+
+    with reportLock:
+        sys.stdout.write(line + CRT)
+        sys.stdout.flush()
+
+def streamLookup(name, cursor, query):
+    # Purpose: create a lookup from a query of (accID, marker key,
+    #	organism key) rows, streamed straight into it
+    # Returns: MarkerLookup, frozen
+    # Assumes: Nothing
+    # Effects: queries a database
+    # Throws: psycopg2.Error
+
+    lookup = MarkerLookup(name)
+    accIDs = lookup.accIDs
+    markerKeys = lookup.markerKeys
+    organismKeys = lookup.organismKeys
+
+    def addRow(fields):
+        accIDs.append(fields[0])
+        markerKeys.append(int(fields[1]))
+        organismKeys.append(int(fields[2]))
+
+    dbcopy.copyOut(cursor, query, addRow)
+    lookup.freeze()
+    return lookup
+
+def queryLookup(name, logicalDBs, organism, preferred, prefixPart):
+    # Purpose: create a lookup from the database
+    # Returns: MarkerLookup
+    # Assumes: Nothing
+    # Effects: queries a database, on the dbcopy connection
+    # Throws: psycopg2.Error
+
+    cursor = connection().cursor()
+    lookup = streamLookup(name, cursor, '''select distinct a.accID, m._Marker_key, m._Organism_key
+        from ACC_Accession a, MRK_Marker m
+        where %s''' % lookupClauses(logicalDBs, organism, preferred, prefixPart))
+    cursor.close()
+    connection().commit()
+    return lookup
+
+def queryInputLookup(name, logicalDBs, organism, preferred, prefixPart, accIDs):
+    # Purpose: create a lookup of only the accession IDs in accIDs
+    # Returns: MarkerLookup
+    # Assumes: Nothing
+    # Effects: queries a database, on the dbcopy connection
+    # Throws: psycopg2.Error
+
+    cursor = connection().cursor()
+
+    # the distinct input IDs, in a temp table the planner has statistics for
+    cursor.execute('create temp table if not exists lookup_accids (accID text)')
+    cursor.execute('truncate lookup_accids')
+    accIDSet = set(accIDs)
+    dbcopy.copyIn(cursor, 'lookup_accids', [(accID,) for accID in accIDSet])
+    cursor.execute('analyze lookup_accids')
+
+    lookup = streamLookup(name, cursor, '''select distinct a.accID, m._Marker_key, m._Organism_key
+        from lookup_accids t, ACC_Accession a, MRK_Marker m
+        where a.accID = t.accID
+        and %s''' % lookupClauses(logicalDBs, organism, preferred, prefixPart))
+    cursor.close()
+    connection().commit()
+    report('lookup %s: %s entries for %s input IDs' % (name, len(lookup.markers), len(accIDSet)))
+    return lookup
+
+def snapshotPath(name):
+    # Returns: path of the snapshot file of the lookup called name
+
+    return os.path.join(cacheDir, '%s.snapshot' % name)
+
+def readSnapshot(name, probe):
+    # Purpose: read the snapshot of a lookup if it matches probe
+    # Returns: MarkerLookup, or None if there is no snapshot or it is
+    #	stale or unreadable
+    # Assumes: Nothing
+    # Effects: Reads the file system
+    # Throws: Nothing
+
+    try:
+        fpSnapshot = open(snapshotPath(name), 'rb')
+    except OSError:
+        return None
+
+    try:
+        # version, probe, the accession IDs, the marker keys and the
+        # organism keys
+        if fpSnapshot.readline().rstrip(b'\n') != SNAPSHOT_VERSION:
+            return None
+        if bytes.decode(fpSnapshot.readline()).rstrip(CRT) != probe:
+            return None
+        table = idstore.readKeyTable(fpSnapshot)
+        markerKeys = array('i')
+        markerKeys.fromfile(fpSnapshot, len(table))
+        organismKeys = array('i')
+        organismKeys.fromfile(fpSnapshot, len(table))
+    except (ValueError, EOFError, UnicodeDecodeError):
+        return None
+    finally:
+        fpSnapshot.close()
+
+    lookup = MarkerLookup(name)
+    lookup.markers = idstore.FrozenKeyMap(table, markerKeys)
+    lookup.organisms = idstore.FrozenKeyMap(table, organismKeys)
+    report('lookup %s: %s entries from snapshot' % (name, len(table)))
+    return lookup
+
+def writeSnapshot(lookup, probe):
+    # Purpose: write the snapshot of a lookup; the file is replaced in
+    #	one step so readers never see a partial snapshot
+    # Returns: Nothing
+    # Assumes: the lookup is frozen
+    # Effects: Writes to the file system
+    # Throws: Nothing
+
+    os.makedirs(cacheDir, exist_ok=True)
+    path = snapshotPath(lookup.name)
+    tmpPath = '%s.%s.tmp' % (path, os.getpid())
+    fpSnapshot = open(tmpPath, 'wb')
+    fpSnapshot.write(SNAPSHOT_VERSION + b'\n')
+    fpSnapshot.write(str.encode(probe + CRT))
+    lookup.markers.table.write(fpSnapshot)
+    lookup.markers.values.tofile(fpSnapshot)
+    lookup.organisms.values.tofile(fpSnapshot)
+    fpSnapshot.close()
+    os.replace(tmpPath, path)
+
+    return
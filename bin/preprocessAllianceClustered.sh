@@ -4,12 +4,54 @@
 #
 # invokes the Alliance Clustered preprocessor
 #
+# If the combined preprocessor (alliance_directload, ALLIANCE_COMBINED=1)
+# has already staged the clustered files in this run, they are used
+# instead of parsing the file again (and, with PIPELINE_LOAD=1, loaded
+# here). The staged files belong to this run only when their stamp has
+# this run's ID (HOMOLOGY_RUN_ID, which must be set) and the checksum of
+# the current input file; otherwise they are removed
+#
 #
 # Usage:
 #
 #     preprocessAllianceClustered.sh
 #
 
+STAMP=''
+if [ -f "${COMBINED_CLUSTERED_STAMP}" ]
+then
+    STAMP=`cat ${COMBINED_CLUSTERED_STAMP}`
+fi
+
+if [ "${STAMP}" != "" ]
+then
+    if [ "${ALLIANCE_COMBINED}" = "1" -a "${HOMOLOGY_RUN_ID}" != "" -a "${STAMP}" = "${HOMOLOGY_RUN_ID} `cksum < ${INPUT_FILE_DEFAULT}`" ]
+    then
+        echo 'Using the combined preprocessor output' >> ${LOG_DIAG}
+        rm -f ${COMBINED_CLUSTERED_STAMP}
+        mv ${COMBINED_CLUSTERED_LOAD} ${INPUT_FILE_LOAD} && \
+        mv ${COMBINED_CLUSTERED_QC_RPT} ${QC_RPT} && \
+        mv ${COMBINED_CLUSTERER} ${INPUT_FILE_CLUSTERER}
+        STAT=$?
+        if [ ${STAT} -ne 0 ]
+        then
+            exit ${STAT}
+        fi
+
+        # with PIPELINE_LOAD=1 homologyload.sh runs no loader, so the
+        # staged load ready file is loaded here
+        if [ "${PIPELINE_LOAD}" = "1" ]
+        then
+            echo 'Running loader' >> ${LOG_DIAG}
+            ${PYTHON} ${HOMOLOGYLOAD}/bin/homologyload.py
+            STAT=$?
+        fi
+        exit ${STAT}
+    fi
+    echo "Removing combined preprocessor output from another run: ${STAMP}" >> ${LOG_DIAG}
+fi
+rm -f ${COMBINED_CLUSTERED_STAMP} ${COMBINED_CLUSTERED_LOAD} ${COMBINED_CLUSTERED_QC_RPT} ${COMBINED_CLUSTERER}
+
 echo 'Running Preprocessor' >> ${LOG_DIAG}
 ${PYTHON} ${HOMOLOGYLOAD}/bin/preprocessAllianceClustered.py
 STAT=$?
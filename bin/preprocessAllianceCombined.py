@@ -0,0 +1,260 @@
+##########################################################################
+#
+# Purpose:
+#       From the Alliance input file create both the direct and the
+#	clustered load ready files in a single pass
+#
+# Usage: preprocessAllianceCombined.py
+#
+# Inputs:
+#	1. Alliance file tab-delimited in following format:
+#           1. Gene1ID
+#           2. Gene1Symbol (not used)
+#           3. Gene1SpeciesTaxonID (not used)
+#           4. Gene1SpeciesName (not used)
+#           5. Gene2ID
+#           6. Gene2Symbol (not used)
+#           7. Gene2SpeciesTaxonID (not used)
+#           8. Gene2SpeciesName (not used)
+#           9-13 (not used)
+#
+#	2. Configuration - see alliance_directload.config
+#
+# Outputs:
+#	 1. direct load ready file and QC report file
+#	 2. clustered load ready file, QC report file and clusterer file,
+#	    staged for the alliance_clusteredload run
+#
+# Exit Codes:
+#
+#      0:  Successful completion
+#      1:  An exception occurred
+#
+#  Assumes:  Nothing
+#
+#  Notes:  Runs as the alliance_directload preprocessor when
+#	ALLIANCE_COMBINED=1. The file is parsed once; every line goes to
+#	the direct homologies and the HGNC lines also go to the clustered
+#	homologies. The clustered outputs are written to temporary names
+#	next to the COMBINED_* paths in the alliance_clusteredload input
+#	directory, and renamed to them only once the run has succeeded;
+#	preprocessAllianceCombined.sh then stamps them with the run, and
+#	preprocessAllianceClustered.sh picks them up instead of parsing
+#	the file again only in the same run
+#
+###########################################################################
+
+import os
+import mgi_utils
+import alliance
+import bcpwriter
+import lookupcache
+import tsvreader
+import db
+
+###--- globals ---###
+
+#
+# paths to input and output files
+#
+
+# input file from Alliance
+inFilePath = os.environ['INPUT_FILE']
+print('inFilePath: %s' % inFilePath)
+
+# direct load ready file and QC report
+loadFilePath = os.environ['INPUT_FILE_LOAD']
+qcRptPath = os.environ['QC_RPT']
+
+# clustered load ready file, QC report and clusterer file, staged for
+# the clustered load
+clusteredLoadFilePath = os.environ['COMBINED_CLUSTERED_LOAD']
+clusteredQcRptPath = os.environ['COMBINED_CLUSTERED_QC_RPT']
+clustererFilePath = os.environ['COMBINED_CLUSTERER']
+
+# the clustered load's cluster map and number of clusterizer processes
+clusterMapPath = os.environ['COMBINED_CLUSTER_MAP_FILE']
+clusterWorkers = int(os.environ['COMBINED_CLUSTER_WORKERS'])
+
+# 1 to find the mouse lines with numpy, if it is installed
+vectorParse = os.environ['VECTOR_PARSE'] == '1'
+
+# number of processes parsing byte ranges of an uncompressed input file
+parseWorkers = int(os.environ['PARSE_WORKERS'])
+
+#
+# file descriptors
+#
+
+fpInFile = ''
+fpQcRpt = ''
+fpClusteredLoadFile = ''
+fpClusteredQcRpt = ''
+fpClustererFile = ''
+
+# writes the direct load ready file and/or keeps the clusters for the
+# loader
+loadWriter = None
+
+# direct and clustered homologies, database lookups and QC report sections
+directHomologies = alliance.DirectHomologies()
+clusteredHomologies = alliance.ClusteredHomologies(clusterWorkers, clusterMapPath)
+
+###--- functions ---###
+
+def openOutput(path):
+    # Purpose: open an output file, exiting if it cannot be opened
+    # Returns: file descriptor
+    # Assumes: Nothing
+    # Effects: opens a file
+    # Throws: Nothing
+
+    try:
+        return open(path, 'w')
+    except:
+        exit('Could not open file for writing %s\n' % path)
+
+def stagingPath(path):
+    # Purpose: the name a staged clustered file is written to before it
+    #	is renamed to path
+    # Returns: file path
+    # Assumes: Nothing
+    # Effects: Nothing
+    # Throws: Nothing
+
+    return '%s.tmp' % path
+
+def init():
+    # Purpose: Initialization of  database connection and file descriptors,
+    #       create database lookup dictionaries
+    # Returns: 1 if file descriptors cannot be initialized
+    # Assumes: Nothing
+    # Effects: opens a database connection
+    # Throws: Nothing
+
+    global loadWriter
+    global fpInFile, fpQcRpt
+    global fpClusteredLoadFile, fpClusteredQcRpt, fpClustererFile
+
+    user = os.environ['MGD_DBUSER']
+    passwordFileName = os.environ['MGD_DBPASSWORDFILE']
+    db.useOneConnection(1)
+    db.set_sqlUser(user)
+    db.set_sqlPasswordFromFile(passwordFileName)
+
+    try:
+        fpInFile = tsvreader.openFile(inFilePath, binary=True, mapped=True)
+    except:
+        exit('Could not open file for reading %s\n' % inFilePath)
+
+    loadWriter = bcpwriter.openLoadReadyWriter(loadFilePath)
+    fpQcRpt = openOutput(qcRptPath)
+    fpClusteredLoadFile = openOutput(stagingPath(clusteredLoadFilePath))
+    fpClusteredQcRpt = openOutput(stagingPath(clusteredQcRptPath))
+    fpClustererFile = openOutput(stagingPath(clustererFilePath))
+
+    # with LOOKUP_MODE=input, look up only the IDs in the file;
+    # otherwise load the lookups while the file is parsed
+    if lookupcache.inputDriven:
+        mgiIDs, homologyIDs = alliance.collectIDs(inFilePath, alliance.DIRECT_PREFIXES)
+        directHomologies.initLookups(mgiIDs, homologyIDs)
+        clusteredHomologies.initLookups(mgiIDs, homologyIDs)
+    else:
+        directHomologies.startLookups()
+        clusteredHomologies.startLookups()
+
+    return
+
+def process():
+    # Purpose: parse the file once and create both load ready files
+    # Returns: 0
+    # Assumes: lookups have been initialized or started
+    # Effects: Reads file in file system, writes to the file system
+    # Throws: Nothing
+
+    # skip the header; the parser only returns lines with a mouse MGI ID
+    # and a ZFIN, HGNC or RGD homology ID. Every line goes to the direct
+    # homologies; the clustered homologies keep the HGNC lines
+    alliance.parse(fpInFile, alliance.DIRECT_PREFIXES,
+        [directHomologies, clusteredHomologies], vectorParse, parseWorkers)
+
+    print('writing direct load ready file')
+    directHomologies.writeLoadFile(loadWriter)
+
+    print('writing clustered load ready file')
+    clusteredHomologies.writeLoadFile(bcpwriter.LoadReadyWriter(fpClusteredLoadFile, 0), fpClustererFile)
+
+    return
+
+def writeReports():
+    # Purpose: writes out all sections of both QC reports
+    # Returns: 0
+    # Assumes: the homologies have been processed
+    # Effects: Writes to the file system
+    # Throws: Nothing
+
+    directHomologies.writeReports(fpQcRpt)
+    clusteredHomologies.writeReports(fpClusteredQcRpt)
+
+    return
+
+def closeFiles():
+    # Purpose: closes file descriptors and database connection
+    # Returns: 0
+    # Assumes: file descriptors have been initialized
+    # Effects:  None
+    # Throws: Nothing
+
+    fpInFile.close()
+    loadWriter.close()
+    fpQcRpt.close()
+    fpClusteredLoadFile.close()
+    fpClusteredQcRpt.close()
+    fpClustererFile.close()
+
+    # close the lookup and database connections
+    lookupcache.close()
+    db.useOneConnection(0)
+
+    return
+
+def stageClusteredFiles():
+    # Purpose: rename the clustered files to the COMBINED_* paths for
+    #	the clustered load; the load ready file last, as the clustered
+    #	load checks for it
+    # Returns: 0
+    # Assumes: the files have been written and closed
+    # Effects: Renames files in the file system
+    # Throws: OSError if a file cannot be renamed
+
+    for path in [clusteredQcRptPath, clustererFilePath, clusteredLoadFilePath]:
+        os.replace(stagingPath(path), path)
+
+    return
+
+###--- main program ---###
+
+print('%s' % mgi_utils.date())
+
+print('initializing')
+init()
+
+print('processing direct and clustered homologies')
+process()
+
+print('writing reports')
+writeReports()
+
+print('closing files')
+closeFiles()
+
+print('staging clustered files')
+stageClusteredFiles()
+
+# with PIPELINE_LOAD=1 the clusters go straight to the loader
+if loadWriter.records is not None:
+    print('loading clusters')
+    import homologyload
+    homologyload.loadRecords(loadWriter.records)
+
+print('%s' % mgi_utils.date())
@@ -0,0 +1,38 @@
+#!/bin/sh
+
+#
+#
+# invokes the Alliance combined preprocessor, which writes the direct
+# load ready file and stages the clustered load ready file for the
+# alliance_clusteredload run
+#
+# The stamp written once the preprocessor succeeds ties the staged files
+# to this run: the run ID (HOMOLOGY_RUN_ID) and the checksum of the
+# input file
+#
+#
+# Usage:
+#
+#     preprocessAllianceCombined.sh
+#
+
+echo 'Running Preprocessor' >> ${LOG_DIAG}
+mkdir -p `dirname ${COMBINED_CLUSTERED_LOAD}`
+rm -f ${COMBINED_CLUSTERED_STAMP}
+CHECKSUM=`cksum < ${INPUT_FILE_DEFAULT}`
+${PYTHON} ${HOMOLOGYLOAD}/bin/preprocessAllianceCombined.py
+STAT=$?
+
+# the clustered files are written to .tmp names and renamed only when
+# the preprocessor succeeds; remove any a failed run left behind
+if [ ${STAT} -ne 0 ]
+then
+    rm -f ${COMBINED_CLUSTERED_LOAD}.tmp ${COMBINED_CLUSTERED_QC_RPT}.tmp ${COMBINED_CLUSTERER}.tmp
+    exit ${STAT}
+fi
+
+echo "${HOMOLOGY_RUN_ID} ${CHECKSUM}" > ${COMBINED_CLUSTERED_STAMP}
+STAT=$?
+exit ${STAT}
+
+exit 0
@@ -37,23 +37,16 @@
 #       - initial implementation
 ###########################################################################
 
-import copy
 import os
-import string
 import mgi_utils
-import clusterize
+import alliance
+import bcpwriter
+import lookupcache
+import tsvreader
 import db
 
 ###--- globals ---###
 
-# constants
-TAB= '\t'
-CRT = '\n'
-
-# [ 'human', 'mouse, laboratory', 'rat', 'zebrafish' ]
-
-organismOrder = [2, 1, 40, 84]
-
 #
 # paths to input and output files
 #
@@ -67,48 +60,37 @@ loadFilePath = os.environ['INPUT_FILE_LOAD']
 # The QC report
 qcRptPath = os.environ['QC_RPT']
 
-# QC report descriptions and column headings
-sep = '--------------------------------------------------\n'
+# 1 to find the mouse lines with numpy, if it is installed
+vectorParse = os.environ['VECTOR_PARSE'] == '1'
 
-rptOne = 'Lines where a Mouse MGI ID not in database %s%s%s' % (CRT, sep, CRT)
-rptOne = rptOne + 'LineNum%sline%s' % (TAB, CRT)
-rptTwo = '%s%sLines where a Homology ID not in database%s%s%s%s' % (CRT, CRT, CRT, CRT, sep, CRT)
-rptTwo = rptTwo + 'LineNum%sline%s' % (TAB, CRT)
+# number of processes parsing byte ranges of an uncompressed input file
+parseWorkers = int(os.environ['PARSE_WORKERS'])
 
 #
 # file descriptors
 #
 
 fpInFile = ''
-fpLoadFile = ''
 fpQcRpt = ''
 
-#
-# Database Lookups
-#
-
-# Rat, Human Zebra Fish lookup
-# ( ID:_Marker_key)
-homologyLookup = {}
+# writes the load ready file and/or keeps the clusters for the loader
+loadWriter = None
 
-# Mouse gene lookup
-# (ID:_Marker_key)
-mouseLookup = {}
+# direct homologies, database lookups and QC report sections
+homologies = alliance.DirectHomologies()
 
 ###--- functions ---###
 
 def init():
     # Purpose: Initialization of  database connection and file descriptors,
-    #       create database lookup dictionaries; create dictionary from
-    #       input file
+    #       create database lookup dictionaries
     # Returns: 1 if file descriptors cannot be initialized
     # Assumes: Nothing
     # Effects: opens a database connection
     # Throws: Nothing
 
-
-    global egToMarkerDict, mgiToMarkerDict
-    global fpInFile, fpClustererFile, fpLoadFile, fpQcRpt
+    global loadWriter
+    global fpInFile, fpQcRpt
 
     user = os.environ['MGD_DBUSER']
     passwordFileName = os.environ['MGD_DBPASSWORDFILE']
@@ -117,150 +99,50 @@ def init():
     db.set_sqlPasswordFromFile(passwordFileName)
 
     try:
-        fpInFile = open(inFilePath, 'r')
+        fpInFile = tsvreader.openFile(inFilePath, binary=True, mapped=True)
     except:
         exit('Could not open file for reading %s\n' % inFilePath)
-    try:
-        fpLoadFile = open(loadFilePath, 'w')
-    except:
-        exit('Could not open file for writing %s\n' % loadFilePath)
+    loadWriter = bcpwriter.openLoadReadyWriter(loadFilePath)
 
     try:
         fpQcRpt = open(qcRptPath, 'w')
     except:
         exit('Could not open file for writing %s\n' % qcRptPath)
 
-    # Create lookup of homology IDs to their marker keys
-    results = db.sql('''select a.accid, a._object_key as markerKey, m._organism_key
-        from acc_accession a, mrk_marker m 
-        where a._mgitype_key = 2 
-        and a._logicalDB_key in (47, 64, 172)
-        and a._object_key = m._marker_key
-        and m._marker_status_key = 1''', 'auto')
-    for r in results:
-        #print('hMrkID: %s orgKey: %s hMrkKey: %s' % (r['accid'], int(r['_organism_key']), int(r['markerKey']) ))
-        homologyLookup[r['accid']] = [ int(r['_organism_key']), int(r['markerKey'])]
-
-    # Create lookup of mouse MGI IDs to their marker keys
-    results = db.sql('''select a.accid, a._object_key as markerKey
-        from acc_accession a, mrk_marker m
-        where a._mgitype_key = 2
-        and a._logicalDB_key = 1
-        and a.prefixPart = 'MGI:'
-        and a._object_key = m._marker_key
-        and m._marker_status_key = 1''', 'auto')
-    for r in results:
-        mouseLookup[r['accid']] = r['markerKey']
+    # with LOOKUP_MODE=input, look up only the IDs in the file;
+    # otherwise load the lookups while the file is parsed
+    if lookupcache.inputDriven:
+        mgiIDs, homologyIDs = alliance.collectIDs(inFilePath, alliance.DIRECT_PREFIXES)
+        homologies.initLookups(mgiIDs, homologyIDs)
+    else:
+        homologies.startLookups()
 
     return
 
 def process():
     # Purpose: parse file and create load ready file
     # Returns: 0
-    # Assumes: lookups have been initialized
+    # Assumes: lookups have been initialized or started
     # Effects: Reads file in file system
     # Throws: Nothing
 
-    global rptOne, rptTwo
-
-    # {mgiID:[list of homology IDs], ...}
-    homologyDict = {}
-    lineCt = 0
-    headers = []
-    for line in fpInFile.readlines():
-        line = str.strip(line)
-        lineCt += 1
-        #print('lineCt: %s' % lineCt)
-        #print('line: %s' % line)
-        # skip the header
-        if str.find(line, '#') == 0:
-            #print(line)
-            continue
-        elif str.find(line, 'Gene1ID') == 0:
-            headers = str.split(line, TAB)
-            print("headers.index('Gene1ID'): %s" % headers.index('Gene1ID'))
-            continue
-
-        tokens = str.split(line, TAB)
-        mgiID = tokens[headers.index('Gene1ID')]
-        if str.find(mgiID, 'MGI:') != 0:
-            continue
-        homologyID = tokens[headers.index('Gene2ID')]
-        if not(str.find(homologyID, 'ZFIN:') == 0 or str.find(homologyID, 'HGNC:') == 0 or str.find(homologyID, 'RGD:') == 0):
-            continue
-        #print('\n\nlineCt: %s' % lineCt)
-        #print('line: %s' % line)
-        #print('mgiID: %s' % mgiID)
-        #print('homologyID: %s' % homologyID)
-        #Alliance adds a prefix to the zfin id, remove it
-        if str.find(homologyID, 'ZFIN:') == 0:
-            homologyID = homologyID[5:]
-
-        # Check IDs in the database
-        notIn = 0
-        mouseKey = ''
-        homologyKey = ''
-        
-        # report if mgiID not in db
-        if mgiID not in mouseLookup:
-            #print('mgiID not in db: %s' % mgiID)
-            rptOne = '%s%s%s%s%s' % (rptOne, lineCt, TAB, line, CRT)
-            notIn = 1
-        else:   
-            mouseKey = mouseLookup[mgiID]
-
-        # report if homology ID not in MGI
-        if homologyID not in homologyLookup:
-            #print('homologyID not in db: %s' % homologyID)
-            rptTwo = '%s%s%s%s%s' % (rptTwo, lineCt, TAB, line, CRT)
-            notIn = 1
-        # if either mgiID or homologyID not in MGI skip
-        if notIn == 1:
-            continue
-
-        # create list of homologies for mouseKey
-        if mouseKey not in homologyDict:
-            homologyDict[mouseKey] = []
-            # add the mouse key, it is second
-            homologyDict[mouseKey].append([1, int(mouseKey)])
-
-        l = copy.deepcopy(list(homologyLookup[homologyID])) # l is 2-element list [orgKey, homologyKey]
-        #print ('mouseKey: %s' % mouseKey)
-        #print('homologyLookup[homologyID] before: %s' % l)
-        idx = organismOrder.index(l[0]) # get the index of the orgKey in the organismOrder list
-        #print('idx: %s' % idx)
-        l[0] = idx                      # and replace the orgKey with the index
-        #print('l after: %s' % l)
-        homologyDict[mouseKey].append(l)# add homologies to the dictionary
-        #print('homologyLookup[homologyID] after: %s' % homologyLookup[homologyID])
+    # skip the header; the parser only returns lines with a mouse MGI ID
+    # and a ZFIN, HGNC or RGD homology ID
+    alliance.parse(fpInFile, alliance.DIRECT_PREFIXES, [homologies], vectorParse, parseWorkers)
 
     # now iterate through the clusters and write to the load ready file
-    for mKey in homologyDict:
-        #print('mKey: %s homology: %s' % (mKey, list(homologyDict[mKey])))
-        homologyList = homologyDict[mKey]  # list of lists e.g. [ [2, rKey], [0, hKey], [1, mKey] ]
-        #print('homologyList: %s' % homologyList)
-        sortedList = sorted(homologyList, key=lambda hom: hom[0])    # sort by the index in position 1
-        #print('sortedList: %s' % sortedList)
-
-        # get the list of marker keys for writing out to load ready file
-        keyList = []
-        for l in sortedList:
-            keyList.append(str(l[1]))
-        keyString = ', '.join(keyList)
-        #print('writing keyString to file: %s' % keyString)
-        fpLoadFile.write ('%s%s%s%s' % ('', TAB, keyString, CRT))
+    homologies.writeLoadFile(loadWriter)
 
     return
 
 def writeReports():
     # Purpose: writes out all sections of the QC report
     # Returns: 0
-    # Assumes: rptOneand rptTwo have been initialized
+    # Assumes: homologies has been processed
     # Effects: Writes to the file system
     # Throws: Nothing
 
-    fpQcRpt.write(rptOne)
-    fpQcRpt.write(rptTwo)
+    homologies.writeReports(fpQcRpt)
 
     return
 
@@ -272,10 +154,11 @@ def closeFiles():
     # Throws: Nothing
 
     fpInFile.close()
-    fpLoadFile.close()
+    loadWriter.close()
     fpQcRpt.close()
 
-    # close the database connection
+    # close the lookup and database connections
+    lookupcache.close()
     db.useOneConnection(0)
 
     return
@@ -296,5 +179,11 @@ writeReports()
 print('closing files')
 closeFiles()
 
+# with PIPELINE_LOAD=1 the clusters go straight to the loader
+if loadWriter.records is not None:
+    print('loading clusters')
+    import homologyload
+    homologyload.loadRecords(loadWriter.records)
+
 print('%s' % mgi_utils.date())
 
@@ -2,7 +2,9 @@
 
 #
 #
-# invokes the Alliance direct preprocessor
+# invokes the Alliance direct preprocessor, or with ALLIANCE_COMBINED=1
+# the combined preprocessor, which also stages the alliance_clusteredload
+# files
 #
 #
 # Usage:
@@ -10,6 +12,11 @@
 #     preprocessAllianceDirect.sh
 #
 
+if [ "${ALLIANCE_COMBINED}" = "1" ]
+then
+    exec ${HOMOLOGYLOAD}/bin/preprocessAllianceCombined.sh
+fi
+
 echo 'Running Preprocessor' >> ${LOG_DIAG}
 ${PYTHON} ${HOMOLOGYLOAD}/bin/preprocessAllianceDirect.py
 STAT=$?
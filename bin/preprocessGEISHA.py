@@ -49,6 +49,10 @@ import string
 import Set
 import mgi_utils
 import clusterize
+import bcpwriter
+import idstore
+import lookupcache
+import tsvreader
 import db
 
 ###--- globals ---###
@@ -59,11 +63,11 @@ CRT = '\n'
 
 # EG ID/Chicken Marker associations from the database
 # {egID:chicken marker key, ...}
-egToChickenDict = {}
+egToChickenDict = idstore.FrozenKeyMap()
 
 # EG ID/Mouse Marker associations from the database
 # {egID:mouse marker key, ...}
-egToMouseDict = {}
+egToMouseDict = idstore.FrozenKeyMap()
 
 #
 # paths to input and output files
@@ -78,6 +82,10 @@ inFileExprPath = os.environ['INPUT_FILE']
 # This is the cleaned up load-ready input file
 loadFilePath = os.environ['INPUT_FILE_LOAD']
 
+# Cluster signatures and IDs from the previous load; this run's are
+# staged next to it until the load has succeeded
+clusterMapPath = os.environ['CLUSTER_MAP_FILE']
+
 # Chicken EG gene IDs from the expression file
 exprSet = set([])
 
@@ -102,11 +110,11 @@ rptThree = '%s%sMouse EG IDs not in database%s%s%s' % (CRT, CRT,CRT, CRT, sep)
 
 fpOrthoFile = ''
 fpExprFile = ''
-
-# idList replaces this file, but keeping for time being
-fpLoadFile = ''
 fpQcRpt = ''
 
+# writes the load ready file and/or keeps the clusters for the loader
+loadWriter = None
+
 ###--- functions ---###
 
 def init():
@@ -117,9 +125,8 @@ def init():
     # Effects: opens a database connection
     # Throws: Nothing
 
-    global egToChickenDict, egToMouseDict
     global fpOrthoFile, fpExprFile
-    global fpLoadFile, fpQcRpt
+    global fpQcRpt, loadWriter
 
     user = os.environ['MGD_DBUSER']
     passwordFileName = os.environ['MGD_DBPASSWORDFILE']
@@ -128,19 +135,16 @@ def init():
     db.set_sqlPasswordFromFile(passwordFileName)
 
     try:
-        fpOrthoFile = open(inFileOrthoPath, 'r')
+        fpOrthoFile = tsvreader.openFile(inFileOrthoPath)
     except:
         exit('Could not open file for reading %s\n' % inFileOrthoPath)
 
     try:
-        fpExprFile = open(inFileExprPath, 'r')
+        fpExprFile = tsvreader.openFile(inFileExprPath)
     except:
         exit('Could not open file for reading %s\n' % inFileExprPath)
 
-    try:
-        fpLoadFile = open(loadFilePath, 'w')
-    except:
-        exit('Could not open file for writing %s\n' % loadFilePath)
+    loadWriter = bcpwriter.openLoadReadyWriter(loadFilePath)
 
     try:
         fpQcRpt = open(qcRptPath, 'w')
@@ -148,36 +152,11 @@ def init():
         exit('Could not open file for writing %s\n' % qcRptPath)
 
 
-    # get all chicken markers that are associated with EG IDs
-    results = db.sql('''select distinct a.accid as egId, m._Marker_key
-        from ACC_Accession a, MRK_Marker m
-        where a._MGIType_key = 2
-        and a._LogicalDB_key = 55
-        and a.preferred = 1
-        and a._Object_key = m._Marker_key
-        and m._Marker_Status_key = 1
-        and m._Organism_key = 63''', 'auto')
-    #
-    # create Chicken egID to marker lookup from database
-    #
-    for r in results:
-        egId = r['egId']
-        markerKey = r['_Marker_key']
-        egToChickenDict[egId] = markerKey
-
-    # get all mouse markers
-    results = db.sql('''select distinct a.accID as egId, m._Marker_key
-            from ACC_Accession a, MRK_Marker m
-            where a._MGIType_key = 2
-            and a._LogicalDB_key = 55
-            and a._Object_key = m._Marker_key
-            and m._Marker_Status_key = 1
-            and m._Organism_key = 1''', 'auto')
-
-    for r in results:
-            egId = r['egId']
-            markerKey = r['_Marker_key']
-            egToMouseDict[egId] = markerKey
+    # load the lookups on background threads while the input files are
+    # processed; input-driven lookups need the input IDs, so they are
+    # loaded by initLookups
+    if not lookupcache.inputDriven:
+        lookupcache.startLookups(lookupcache.GEISHA_LOOKUPS)
 
     return
 
@@ -191,33 +170,48 @@ def processInputFiles():
 
     global exprSet, mouseDict
 
-    # remove header
-    header = fpExprFile.readline()
-    line =  fpExprFile.readline()
-    while line:
-        tokens = str.split(line, TAB)
+    # the first line of each file is a header
+    for tokens in tsvreader.records(fpExprFile, comment=None, header=True):
         egChickenID = str.strip(tokens[0])
-        exprSet.add(egChickenID)
-        line =  fpExprFile.readline()
-    # remove header
-    header = fpOrthoFile.readline()
-    line = fpOrthoFile.readline()
-    while line:
-        tokens = str.split(line, TAB)
+        exprSet.add(idstore.canonical(egChickenID))
+    for tokens in tsvreader.records(fpOrthoFile, comment=None, header=True):
         egChickenID = str.strip(tokens[0])
         egMouseIDs = str.strip(tokens[4])
         # skip if no mouse ID(s)  on this line
         if egMouseIDs == '':
-            line = fpOrthoFile.readline()
             continue
         else:
-            mouseList = str.split(egMouseIDs, ',')
-            mouseDict[egChickenID] = mouseList
+            mouseList = list(map(idstore.canonical, str.split(egMouseIDs, ',')))
+            mouseDict[idstore.canonical(egChickenID)] = mouseList
         #for id in mouseList:
         #    if not mouseDict.has_key(egChickenID):
         #	mouseDict[egChickenID] = []
         #    mouseDict[egChickenID].append(id)
-        line = fpOrthoFile.readline()
+
+def initLookups():
+    # Purpose: create database lookup dictionaries, waiting for the
+    #	lookups started by init; with LOOKUP_MODE=input only for the
+    #	IDs in the input files
+    # Returns: 0
+    # Assumes: the input files have been processed
+    # Effects: queries a database
+    # Throws: Nothing
+
+    global egToChickenDict, egToMouseDict
+
+    chickenIDs = None
+    mouseIDs = None
+    if lookupcache.inputDriven:
+        chickenIDs = list(exprSet) + list(mouseDict.keys())
+        mouseIDs = [egMouseID for egChickenID in mouseDict for egMouseID in mouseDict[egChickenID]]
+
+    # create Chicken egID to marker lookup from database
+    egToChickenDict = lookupcache.markerMap(*lookupcache.EG_CHICKEN, accIDs=chickenIDs)
+
+    # get all mouse markers
+    egToMouseDict = lookupcache.markerMap(*lookupcache.EG_MOUSE, accIDs=mouseIDs)
+
+    return
 
 def process():
     # Purpose: Create load ready file from Geisha files and the database
@@ -228,8 +222,8 @@ def process():
 
 
     global rptOne, rptTwo, rptThree
-    # dictionary of id pairs to send to the clusterizer
-    toClusterList = []
+    # id pairs are sent to the clusterizer as they are found
+    clusterizer = clusterize.Clusterizer()
     chickenIdNotInSet = set([])
     chickenIdNotInDBSet = set([])
     mouseIdNotInDBSet = set([])
@@ -239,7 +233,7 @@ def process():
         mouseID = ''
         error = 0
         # get the mouse orthology, if none report
-        if chickenID in list(mouseDict.keys()):
+        if chickenID in mouseDict:
             mouseIdList = mouseDict[chickenID]
         else:
             error = 1
@@ -247,22 +241,23 @@ def process():
         if error:
             continue
         # verify chicken EG ID in database
-        if chickenID not in list(egToChickenDict.keys()):
+        if chickenID not in egToChickenDict:
             chickenIdNotInDBSet.add(chickenID)
             error = 1
         # verify mouse EG ID in database
         currentClusterList = []
         for mouseID in mouseIdList:
             currentClusterList.append([chickenID, mouseID])
-            if mouseID not in list(egToMouseDict.keys()):
+            if mouseID not in egToMouseDict:
                 mouseIdNotInDBSet.add(mouseID)
                 error = 1
         if error:
             continue
         else:
-            # no errors so append the next cluster
-            toClusterList = toClusterList + currentClusterList
-    clusterDict = clusterize.cluster(toClusterList, 'GEISHA')
+            # no errors so add the next cluster
+            clusterizer.add_edges(currentClusterList)
+    clusterDict = clusterizer.clusters('GEISHA', clusterMapPath)
+    print('clusters unchanged from previous load: %s of %s' % (len(clusterizer.unchangedSet), len(clusterDict)))
     # now resolve the ids to database keys; chicken and mouse gene keys
     # NOT SORTING BY ORGANISM for sequenceNum because we don't need to. 
     # If we find we need for this load we will need to create a mouse and a 
@@ -273,15 +268,15 @@ def process():
         mouseKeyList = []
         chickenKeyList = []
         for id in idTuple:
-            if id in list(egToMouseDict.keys()):
-                mouseKeyList.append(str(egToMouseDict[id]))
-            elif id in list(egToChickenDict.keys()):
-                chickenKeyList.append(str(egToChickenDict[id]))
+            if id in egToMouseDict:
+                mouseKeyList.append(egToMouseDict[id])
+            elif id in egToChickenDict:
+                chickenKeyList.append(egToChickenDict[id])
             else:
                 print('not chicken or mouse')
         keyList = mouseKeyList + chickenKeyList
-        keyString = ', '.join(keyList)
-        fpLoadFile.write('%s%s%s%s' % (clusterId, TAB, keyString, CRT))
+        loadWriter.writeCluster(clusterId, keyList)
+    loadWriter.flush()
 
     for id in chickenIdNotInSet:
         rptOne = '%s%s%s' % (rptOne, id, CRT)
@@ -319,10 +314,11 @@ def closeFiles():
 
     fpOrthoFile.close()
     fpExprFile.close()
-    fpLoadFile.close()
+    loadWriter.close()
     fpQcRpt.close()
 
-    # close the database connection
+    # close the lookup and database connections
+    lookupcache.close()
     db.useOneConnection(0)
     
     return
@@ -337,6 +333,9 @@ init()
 print('processing input files')
 processInputFiles()
 
+print('loading lookups')
+initLookups()
+
 print('processing clusters')
 process()
 
@@ -346,4 +345,10 @@ writeReports()
 print('closing files')
 closeFiles()
 
+# with PIPELINE_LOAD=1 the clusters go straight to the loader
+if loadWriter.records is not None:
+    print('loading clusters')
+    import homologyload
+    homologyload.loadRecords(loadWriter.records)
+
 print('%s' % mgi_utils.date())
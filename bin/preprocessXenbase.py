@@ -48,6 +48,10 @@ import string
 import Set
 import mgi_utils
 import clusterize
+import bcpwriter
+import idstore
+import lookupcache
+import tsvreader
 import db
 
 ###--- globals ---###
@@ -61,11 +65,11 @@ debug = 0
 
 # EG ID/Xenopus Marker associations from the database
 # {egID:marker key, ...}
-egToXenMarkerDict = {}
+egToXenMarkerDict = idstore.FrozenKeyMap()
 
 # EG ID/Mouse Marker associations from the database
 # {egID:mouse marker key, ...}
-egToMouseMarkerDict = {}
+egToMouseMarkerDict = idstore.FrozenKeyMap()
 
 #
 # paths to input and output files
@@ -81,18 +85,22 @@ inFileExprPath = os.environ['INPUT_FILE']
 # This is the cleaned up load-ready input file
 loadFilePath = os.environ['INPUT_FILE_LOAD']
 
+# Cluster signatures and IDs from the previous load; this run's are
+# staged next to it until the load has succeeded
+clusterMapPath = os.environ['CLUSTER_MAP_FILE']
+
 # Xenbase gene IDs from the expression file
 exprSet = set([])
 
 # Xenbase gene IDs mapped to their EG IDs from EG file
-egDict = {}
+egDict = idstore.IdMap()
 
 # Xenbase gene IDs mapped to their GenePage IDs from the translation file
 # {gId: [list of gpIds], ...}
-transDict = {}
+transDict = idstore.IdMap()
 
 # Xenbase GenePage IDs mapped to one or more mouse MGI IDs from orthology file
-mouseDict = {}
+mouseDict = idstore.IdMap()
 
 #
 # The QC report 
@@ -121,25 +129,22 @@ fpEgFile = ''
 fpTransFile = ''
 fpOrthoFile = ''
 fpExprFile = ''
-
-# idList replaces this file, but keeping for time being
-fpLoadFile = ''
 fpQcRpt = ''
 
+# writes the load ready file and/or keeps the clusters for the loader
+loadWriter = None
+
 ###--- functions ---###
 
 def init():
-    # Purpose: Initialization of  database connection and file descriptors,
-    #       create database lookup dictionaries; create dictionary from
-    #       input file
+    # Purpose: Initialization of  database connection and file descriptors
     # Returns: 1 if file descriptors cannot be initialized
     # Assumes: Nothing
     # Effects: opens a database connection
     # Throws: Nothing
 
-    global egToXenMarkerDict, egToMouseMarkerDict
     global fpEgFile, fpTransFile, fpOrthoFile, fpExprFile
-    global fpLoadFile, fpQcRpt, mouseEgMultiGeneIdSet
+    global fpQcRpt, loadWriter, mouseEgMultiGeneIdSet
 
     mouseEgMultiGeneIdSet = set([])
 
@@ -150,29 +155,26 @@ def init():
     db.set_sqlPasswordFromFile(passwordFileName)
 
     try:
-        fpEgFile = open(inFileEgPath, 'r')
+        fpEgFile = tsvreader.openFile(inFileEgPath)
     except:
         exit('Could not open file for reading %s\n' % inFileGenePath)
 
     try:
-        fpTransFile = open(inFileTransPath, 'r')
+        fpTransFile = tsvreader.openFile(inFileTransPath)
     except:
         exit('Could not open file for reading %s\n' % inFileTransPath)
 
     try:
-        fpOrthoFile = open(inFileOrthoPath, 'r')
+        fpOrthoFile = tsvreader.openFile(inFileOrthoPath)
     except:
         exit('Could not open file for reading %s\n' % inFileOrthoPath)
 
     try:
-        fpExprFile = open(inFileExprPath, 'r')
+        fpExprFile = tsvreader.openFile(inFileExprPath)
     except:
         exit('Could not open file for reading %s\n' % inFileExprPath)
 
-    try:
-        fpLoadFile = open(loadFilePath, 'w')
-    except:
-        exit('Could not open file for writing %s\n' % loadFilePath)
+    loadWriter = bcpwriter.openLoadReadyWriter(loadFilePath)
 
     try:
         fpQcRpt = open(qcRptPath, 'w')
@@ -180,38 +182,11 @@ def init():
         exit('Could not open file for writing %s\n' % qcRptPath)
 
 
-    # get all xenopus tropicalis markers that are associated with egIds
-    results = db.sql('''select distinct a.accid as egId, m._Marker_key
-        from ACC_Accession a, MRK_Marker m
-        where a._MGIType_key = 2
-        and a._LogicalDB_key = 55
-        and a.preferred = 1
-        and a._Object_key = m._Marker_key
-        and m._Marker_Status_key = 1
-        and m._Organism_key = 95''', 'auto')
-    #
-    # create Xenopus egID to marker lookup from database
-    #
-    for r in results:
-        egId = r['egId']
-        markerKey = r['_Marker_key']
-        egToXenMarkerDict[egId] = markerKey
-
-    # mouse egID to marker lookup from database
-    results = db.sql('''select distinct a.accID as egId, m._Marker_key
-            from ACC_Accession a, MRK_Marker m
-            where a._MGIType_key = 2
-            and a._LogicalDB_key = 55
-            and a._Object_key = m._Marker_key
-            and m._Marker_Status_key = 1
-            and m._Organism_key = 1''', 'auto')
-
-    # removed per Richard
-    # and a.preferred = 1
-    for r in results:
-            egId = r['egId']
-            markerKey = r['_Marker_key']
-            egToMouseMarkerDict[egId] = markerKey
+    # load the lookups on background threads while the input files are
+    # processed; input-driven lookups need the input IDs, so they are
+    # loaded by initLookups
+    if not lookupcache.inputDriven:
+        lookupcache.startLookups(lookupcache.XENBASE_LOOKUPS)
 
     return
 
@@ -227,16 +202,14 @@ def processInputFiles():
 
     xenEgToGeneIdDict = {}
 
-    for line in fpExprFile.readlines():
-        tokens = str.split(line, TAB)
+    for tokens in tsvreader.records(fpExprFile, comment=None):
         # get the xbgid
-        exprSet.add(str.strip(tokens[0]))
+        exprSet.add(idstore.canonical(str.strip(tokens[0])))
 
     #
     # Xenopus tropicalis gene ID to EG ID file
     #
-    for line in fpEgFile.readlines():
-        tokens = str.split(line, TAB)
+    for tokens in tsvreader.records(fpEgFile, comment=None):
         # get the Xenbase Gene ID
         gId = str.strip(tokens[0])
         # get the Xenopus EG ID
@@ -246,8 +219,8 @@ def processInputFiles():
         egDict[gId] = egId
         if egId !='None':
             if egId not in xenEgToGeneIdDict: 
-                xenEgToGeneIdDict[egId] = []
-            xenEgToGeneIdDict[egId].append(gId)
+                xenEgToGeneIdDict[idstore.canonical(egId)] = []
+            xenEgToGeneIdDict[egId].append(idstore.canonical(gId))
     for egId in list(xenEgToGeneIdDict.keys()):
         if len(xenEgToGeneIdDict[egId]) > 1:
             # write to bad egId report
@@ -265,8 +238,7 @@ def processInputFiles():
     #
     # Xenbase Gene Page ID to list of Xenbase Gene IDs file
     #
-    for line in fpTransFile.readlines():
-        tokens = str.split(line, TAB)
+    for tokens in tsvreader.records(fpTransFile, comment=None):
         # get the Xenbase Gene Page ID
         gpId = str.strip(tokens[0])
         # get the Xenbase Gene IDs from every other field, ignoring
@@ -281,8 +253,7 @@ def processInputFiles():
     #
     # Xenopus Gene Page ID to mouse EG ID  file
     #
-    for line in fpOrthoFile.readlines():
-        tokens = str.split(line, TAB)
+    for tokens in tsvreader.records(fpOrthoFile, comment=None):
         # get the mouse EG ID
         egID = str.strip(tokens[0])
         # get the Xenbase Gene Page ID
@@ -295,6 +266,33 @@ def processInputFiles():
         for key in keys:
             print('gpId: %s mouseEgId: %s' % (key, mouseDict[key]))
 
+def initLookups():
+    # Purpose: create database lookup dictionaries, waiting for the
+    #	lookups started by init; with LOOKUP_MODE=input only for the
+    #	IDs in the input files
+    # Returns: 0
+    # Assumes: the input files have been processed
+    # Effects: queries a database
+    # Throws: Nothing
+
+    global egToXenMarkerDict, egToMouseMarkerDict
+
+    xenIDs = None
+    mouseIDs = None
+    if lookupcache.inputDriven:
+        xenIDs = list(xenEgToGeneIdDict.keys())
+        mouseIDs = [mouseDict[gpID] for gpID in mouseDict.keys()]
+
+    # create Xenopus egID to marker lookup from database
+    egToXenMarkerDict = lookupcache.markerMap(*lookupcache.EG_XENOPUS, accIDs=xenIDs)
+
+    # mouse egID to marker lookup from database
+    # removed per Richard
+    # and a.preferred = 1
+    egToMouseMarkerDict = lookupcache.markerMap(*lookupcache.EG_MOUSE, accIDs=mouseIDs)
+
+    return
+
 def process():
     # Purpose: Create load ready file and  QC reports from Xenbase files 
     #	and the database
@@ -312,8 +310,8 @@ def process():
     # transDict = {}
     # mouseDict = {}
 
-    # dictionary of id pairs to send to the clusterizer
-    toClusterList = []
+    # id pairs are sent to the clusterizer as they are found
+    clusterizer = clusterize.Clusterizer()
 
     # set of xen geneIds with no translation
     noTransSet = set([])
@@ -361,10 +359,11 @@ def process():
         if notInDb:
             continue
         # now we have a homology
-        toClusterList.append([xenEg, mouseEg])
+        clusterizer.add_edge(xenEg, mouseEg)
 
-    # send cluster list to clusterizer
-    clusterDict = clusterize.cluster(toClusterList, 'XENBASE')
+    # get the clusters from the clusterizer
+    clusterDict = clusterizer.clusters('XENBASE', clusterMapPath)
+    print('clusters unchanged from previous load: %s of %s' % (len(clusterizer.unchangedSet), len(clusterDict)))
     # now resolve the ids to database keys; xenbase and mouse gene keys
     # NOT SORTING BY ORGANISM for sequenceNum because we don't need to.
     # If we find we need for this load we will need to create a mouse and a
@@ -375,15 +374,15 @@ def process():
         mouseKeyList = []
         xenKeyList = []
         for id in idTuple:
-            if id in list(egToMouseMarkerDict.keys()):
-                mouseKeyList.append(str(egToMouseMarkerDict[id]))
-            elif id in list(egToXenMarkerDict.keys()):
-                xenKeyList.append(str(egToXenMarkerDict[id]))
+            if id in egToMouseMarkerDict:
+                mouseKeyList.append(egToMouseMarkerDict[id])
+            elif id in egToXenMarkerDict:
+                xenKeyList.append(egToXenMarkerDict[id])
             else:
                 print('not xenopus or mouse')
         keyList = mouseKeyList + xenKeyList
-        keyString = ', '.join(keyList)
-        fpLoadFile.write('%s%s%s%s' % (clusterId, TAB, keyString, CRT))
+        loadWriter.writeCluster(clusterId, keyList)
+    loadWriter.flush()
 
     for id in noTransSet:
         rptOne = '%s%s%s' % (rptOne, id, CRT)
@@ -437,10 +436,11 @@ def closeFiles():
     fpEgFile.close()
     fpOrthoFile.close()
     fpExprFile.close()
-    fpLoadFile.close()
+    loadWriter.close()
     fpQcRpt.close()
 
-    # close the database connection
+    # close the lookup and database connections
+    lookupcache.close()
     db.useOneConnection(0)
     
     return
@@ -455,6 +455,9 @@ init()
 print('processing input files')
 processInputFiles()
 
+print('loading lookups')
+initLookups()
+
 print('processing clusters')
 process()
 
@@ -464,4 +467,10 @@ writeReports()
 print('closing files')
 closeFiles()
 
+# with PIPELINE_LOAD=1 the clusters go straight to the loader
+if loadWriter.records is not None:
+    print('loading clusters')
+    import homologyload
+    homologyload.loadRecords(loadWriter.records)
+
 print('%s' % mgi_utils.date())
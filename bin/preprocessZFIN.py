@@ -58,6 +58,10 @@ import string
 import Set
 import mgi_utils
 import clusterize
+import bcpwriter
+import idstore
+import lookupcache
+import tsvreader
 import db
 
 ###--- globals ---###
@@ -68,11 +72,11 @@ CRT = '\n'
 
 # EG ID/ZFIN Marker associations from the database
 # {egID:marker key, ...}
-egToMarkerDict = {}
+egToMarkerDict = idstore.FrozenKeyMap()
 
 # MGI ID/Mouse Marker associations from the database
 # {mgiID:marker key, ...}
-mgiToMarkerDict = {}
+mgiToMarkerDict = idstore.FrozenKeyMap()
 
 #
 # paths to input and output files
@@ -87,11 +91,15 @@ inFileExprPath = os.environ['INPUT_FILE']
 # This is the cleaned up load-ready input file
 loadFilePath = os.environ['INPUT_FILE_LOAD']
 
+# Cluster signatures and IDs from the previous load; this run's are
+# staged next to it until the load has succeeded
+clusterMapPath = os.environ['CLUSTER_MAP_FILE']
+
 # ZFIN gene IDs from the expression file
 exprSet = set([])
 
 # ZFIN gene IDs mapped to their EG IDs from gene file
-geneDict = {}
+geneDict = idstore.IdMap()
 
 # XFIN gene IDs mapped to one or more mouse MGI IDs from orthology file
 mouseDict = {}
@@ -115,25 +123,22 @@ rptThree = '%s%sMouse MGI ID not in database%s%s%s' % (CRT, CRT,CRT, CRT, sep)
 fpGeneFile = ''
 fpOrthoFile = ''
 fpExprFile = ''
-
-# idList replaces this file, but keeping for time being
-fpLoadFile = ''
 fpQcRpt = ''
 
+# writes the load ready file and/or keeps the clusters for the loader
+loadWriter = None
+
 ###--- functions ---###
 
 def init():
-    # Purpose: Initialization of  database connection and file descriptors,
-    #       create database lookup dictionaries; create dictionary from
-    #       input file
+    # Purpose: Initialization of  database connection and file descriptors
     # Returns: 1 if file descriptors cannot be initialized
     # Assumes: Nothing
     # Effects: opens a database connection
     # Throws: Nothing
 
-    global egToMarkerDict, mgiToMarkerDict
     global fpGeneFile, fpOrthoFile, fpExprFile
-    global fpLoadFile, fpQcRpt
+    global fpQcRpt, loadWriter
 
     user = os.environ['MGD_DBUSER']
     passwordFileName = os.environ['MGD_DBPASSWORDFILE']
@@ -142,24 +147,21 @@ def init():
     db.set_sqlPasswordFromFile(passwordFileName)
 
     try:
-        fpGeneFile = open(inFileGenePath, 'r')
+        fpGeneFile = tsvreader.openFile(inFileGenePath)
     except:
         exit('Could not open file for reading %s\n' % inFileGenePath)
 
     try:
-        fpOrthoFile = open(inFileOrthoPath, 'r')
+        fpOrthoFile = tsvreader.openFile(inFileOrthoPath)
     except:
         exit('Could not open file for reading %s\n' % inFileOrthoPath)
 
     try:
-        fpExprFile = open(inFileExprPath, 'r')
+        fpExprFile = tsvreader.openFile(inFileExprPath)
     except:
         exit('Could not open file for reading %s\n' % inFileExprPath)
 
-    try:
-        fpLoadFile = open(loadFilePath, 'w')
-    except:
-        exit('Could not open file for writing %s\n' % loadFilePath)
+    loadWriter = bcpwriter.openLoadReadyWriter(loadFilePath)
 
     try:
         fpQcRpt = open(qcRptPath, 'w')
@@ -167,39 +169,11 @@ def init():
         exit('Could not open file for writing %s\n' % qcRptPath)
 
 
-    # get all human markers that are associated with egIds
-    results = db.sql('''select distinct a.accid as egId, m._Marker_key
-        from ACC_Accession a, MRK_Marker m
-        where a._MGIType_key = 2
-        and a._LogicalDB_key = 55
-        and a.preferred = 1
-        and a._Object_key = m._Marker_key
-        and m._Marker_Status_key = 1
-        and m._Organism_key = 84''', 'auto')
-    #
-    # create ZFIN egID to marker lookup from database
-    #
-    for r in results:
-        egId = r['egId']
-        markerKey = r['_Marker_key']
-        egToMarkerDict[egId] = markerKey
-
-    # get all mouse markers
-    results = db.sql('''select distinct a.accID as mgiId, m._Marker_key
-            from ACC_Accession a, MRK_Marker m
-            where a._MGIType_key = 2
-            and a._LogicalDB_key = 1
-            and a.prefixPart = 'MGI:'
-            and a._Object_key = m._Marker_key
-            and m._Marker_Status_key = 1
-            and m._Organism_key = 1''', 'auto')
-
-    # removed per Richard
-    # and a.preferred = 1
-    for r in results:
-            mgiId = r['mgiId']
-            markerKey = r['_Marker_key']
-            mgiToMarkerDict[mgiId] = markerKey
+    # load the lookups on background threads while the input files are
+    # processed; input-driven lookups need the input IDs, so they are
+    # loaded by initLookups
+    if not lookupcache.inputDriven:
+        lookupcache.startLookups(lookupcache.ZFIN_LOOKUPS)
 
     return
 
@@ -212,28 +186,52 @@ def processInputFiles():
 
     global exprSet, geneDict, mouseDict
 
-    for line in fpExprFile.readlines():
-        tokens = str.split(line, TAB)
+    for tokens in tsvreader.records(fpExprFile, comment=None):
         zfinID = str.strip(tokens[0])
         if zfinID.startswith('ZDB-GENE'):
-            exprSet.add(zfinID)
-    for line in fpGeneFile.readlines():
-        tokens = str.split(line, TAB)
+            exprSet.add(idstore.canonical(zfinID))
+    for tokens in tsvreader.records(fpGeneFile, comment=None):
         zfinID = str.strip(tokens[0])
         if zfinID.startswith('ZDB-GENE'):
             egID = str.strip(tokens[3])
             geneDict[zfinID] = egID
-    for line in fpOrthoFile.readlines():
-        tokens = str.split(line, TAB)
+    for tokens in tsvreader.records(fpOrthoFile, comment=None):
         zfinID = str.strip(tokens[0])
         if zfinID.startswith('ZDB-GENE'):
-            mgiID = str.strip(tokens[5])
+            mgiID = idstore.canonical(str.strip(tokens[5]))
             if zfinID not in mouseDict:
-                mouseDict[zfinID] = []
+                mouseDict[idstore.canonical(zfinID)] = []
             mouseDict[zfinID].append(mgiID)
 
     return
 
+def initLookups():
+    # Purpose: create database lookup dictionaries, waiting for the
+    #	lookups started by init; with LOOKUP_MODE=input only for the
+    #	IDs in the input files
+    # Returns: 0
+    # Assumes: the input files have been processed
+    # Effects: queries a database
+    # Throws: Nothing
+
+    global egToMarkerDict, mgiToMarkerDict
+
+    egIDs = None
+    mgiIDs = None
+    if lookupcache.inputDriven:
+        egIDs = [geneDict[zfinID] for zfinID in geneDict.keys()]
+        mgiIDs = [mgiID for zfinID in mouseDict for mgiID in mouseDict[zfinID]]
+
+    # create ZFIN egID to marker lookup from database
+    egToMarkerDict = lookupcache.markerMap(*lookupcache.EG_ZEBRAFISH, accIDs=egIDs)
+
+    # get all mouse markers
+    # removed per Richard
+    # and a.preferred = 1
+    mgiToMarkerDict = lookupcache.markerMap(*lookupcache.MGI_MOUSE, accIDs=mgiIDs)
+
+    return
+
 def process():
     # Purpose: Create load ready file and  QC reports from Zfin files
     #   and the database
@@ -244,8 +242,8 @@ def process():
 
     global rptOne, rptTwo, rptThree
 
-    # dictionary of id pairs to send to the clusterizer
-    toClusterList = []
+    # id pairs are sent to the clusterizer as they are found
+    clusterizer = clusterize.Clusterizer()
     zfinIdNotInSet = set([])
     egNotInDBSet = set([])
     mgiNotInDBSet = set([])
@@ -255,12 +253,12 @@ def process():
         egID = ''
         mgiID = ''
         error = 0
-        if zfinID in list(geneDict.keys()):
+        if zfinID in geneDict:
             egID = geneDict[zfinID]
         else:
             error = 1
             zfinIdNotInSet.add(zfinID)
-        if zfinID in list(mouseDict.keys()):
+        if zfinID in mouseDict:
             mgiIdList = mouseDict[zfinID]
         else:
             error = 1
@@ -268,22 +266,23 @@ def process():
         if error:
             continue
         # verify zebra fish EG ID in database
-        if egID not in list(egToMarkerDict.keys()):
+        if egID not in egToMarkerDict:
             egNotInDBSet.add(egID)
             error = 1
         # verify mouse mgiIDs in database
         currentClusterList = []
         for mgiID in mgiIdList:
             currentClusterList.append([egID, mgiID])
-            if mgiID not in list(mgiToMarkerDict.keys()):
+            if mgiID not in mgiToMarkerDict:
                 mgiNotInDBSet.add(mgiID)
                 error = 1
         if error:
             continue
         else:
-            # no errors so append the next cluster
-            toClusterList = toClusterList + currentClusterList
-    clusterDict = clusterize.cluster(toClusterList, 'ZFIN')
+            # no errors so add the next cluster
+            clusterizer.add_edges(currentClusterList)
+    clusterDict = clusterizer.clusters('ZFIN', clusterMapPath)
+    print('clusters unchanged from previous load: %s of %s' % (len(clusterizer.unchangedSet), len(clusterDict)))
     # now resolve the ids to database keys; zfin and mouse gene keys
     for clusterId in list(clusterDict.keys()):
         idTuple = clusterDict[clusterId]
@@ -291,13 +290,13 @@ def process():
         mouseKeyList = []
         for id in idTuple:
             if id.startswith('MGI:'):
-                mouseKeyList.append(str(mgiToMarkerDict[id]))
+                mouseKeyList.append(mgiToMarkerDict[id])
             else:
-                zfinKeyList.append(str(egToMarkerDict[id]))
+                zfinKeyList.append(egToMarkerDict[id])
         # we want mouse to come before zfin for cluster member sequence numbering
         keyList = mouseKeyList + zfinKeyList
-        keyString = ', '.join(keyList)
-        fpLoadFile.write('%s%s%s%s' % (clusterId, TAB, keyString, CRT))
+        loadWriter.writeCluster(clusterId, keyList)
+    loadWriter.flush()
 
 
     for id in zfinIdNotInSet:
@@ -337,10 +336,11 @@ def closeFiles():
     fpGeneFile.close()
     fpOrthoFile.close()
     fpExprFile.close()
-    fpLoadFile.close()
+    loadWriter.close()
     fpQcRpt.close()
 
-    # close the database connection
+    # close the lookup and database connections
+    lookupcache.close()
     db.useOneConnection(0)
     
     return
@@ -355,6 +355,9 @@ init()
 print('processing input files')
 processInputFiles()
 
+print('loading lookups')
+initLookups()
+
 print('processing clusters')
 process()
 
@@ -364,4 +367,10 @@ writeReports()
 print('closing files')
 closeFiles()
 
+# with PIPELINE_LOAD=1 the clusters go straight to the loader
+if loadWriter.records is not None:
+    print('loading clusters')
+    import homologyload
+    homologyload.loadRecords(loadWriter.records)
+
 print('%s' % mgi_utils.date())
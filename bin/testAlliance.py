@@ -0,0 +1,208 @@
+#
+#  testAlliance.py
+###########################################################################
+#
+#  Purpose:
+#
+#       Check that alliance.VectorParser keeps the same lines as
+#	alliance.AllianceParser, and that parsing with it gives the same
+#	homologies and QC report lines
+#
+#  Usage:
+#
+#      testAlliance.py [-v]
+#
+#  Env Vars:
+#
+#      LOOKUP_CACHE_DIR, LOOKUP_MODE and LOOKUP_THREADS are set, if not
+#      already, so alliance can be imported; no lookups are loaded
+#
+#  Inputs: None
+#
+#  Outputs:
+#
+#      unittest results to stderr
+#
+#  Exit Codes:
+#
+#      0:  All tests passed
+#      1:  A test failed
+#
+#  Implementation:
+#
+#      Random Alliance files are made with comment lines, short lines,
+#      blank lines, CRLF line endings, padded IDs and no final newline.
+#      alliance.VECTOR_BLOCK is lowered so lines are split across blocks.
+#      Each file is parsed by both parsers from a file object and from a
+#      tsvreader.MappedFile, and by alliance.parse into DirectHomologies
+#      and ClusteredHomologies builders whose lookups are made with
+#      idstore.freeze
+#
+#  Notes:  The tests are skipped when numpy is not installed
+#
+###########################################################################
+
+import io
+import os
+import random
+import tempfile
+import unittest
+
+# lookupcache reads these when imported; no lookups are loaded
+os.environ.setdefault('LOOKUP_CACHE_DIR', '')
+os.environ.setdefault('LOOKUP_MODE', 'all')
+os.environ.setdefault('LOOKUP_THREADS', '1')
+
+import alliance
+import idstore
+import tsvreader
+
+# random files per test, and lines and IDs per file
+FILE_COUNT = 10
+LINE_COUNT = 3000
+ID_COUNT = 500
+
+# VECTOR_BLOCK sizes to parse with
+BLOCK_LIST = [1, 100, 4096, alliance.VECTOR_BLOCK]
+
+# Alliance file header, Gene2ID is the fifth column
+HEADER = b'Gene1ID\tGene1Symbol\tGene1SpeciesTaxonID\tGene1SpeciesName\tGene2ID\tGene2Symbol\tGene2SpeciesTaxonID\tGene2SpeciesName\tAlgorithms\tAlgorithmsMatch\tOutOfAlgorithms\tIsBestScore\tIsBestRevScore'
+
+# Gene2ID prefixes, with their organism keys
+GENE2_PREFIXES = [('HGNC:', 2), ('RGD:', 40), ('ZFIN:ZDB-GENE-', 84), ('Xenbase:', 95), ('MGI:', 1)]
+
+###--- classes ---###
+
+@unittest.skipIf(alliance.numpy is None, 'numpy is not installed')
+class VectorParserTest(unittest.TestCase):
+    # Purpose: alliance.VectorParser equals alliance.AllianceParser
+
+    def setUp(self):
+        self.vectorBlock = alliance.VECTOR_BLOCK
+
+    def tearDown(self):
+        alliance.VECTOR_BLOCK = self.vectorBlock
+
+    def randomFile(self, rnd):
+        # Purpose: a random Alliance file
+        # Returns: the file contents as bytes
+
+        crlf = rnd.random() < 0.3
+        lines = [b'#Alliance orthology', b'#', HEADER]
+        for i in range(LINE_COUNT):
+            r = rnd.random()
+            if r < 0.01:
+                lines.append(b'')
+                continue
+            if r < 0.6:
+                gene1ID = 'MGI:%s' % rnd.randrange(ID_COUNT)
+            elif r < 0.65:
+                gene1ID = ' MGI:%s ' % rnd.randrange(ID_COUNT)
+            else:
+                gene1ID = 'HGNC:%s' % rnd.randrange(ID_COUNT)
+            prefix = rnd.choice(GENE2_PREFIXES)[0]
+            gene2ID = '%s%s' % (prefix, rnd.randrange(ID_COUNT))
+            if rnd.random() < 0.05:
+                gene2ID = gene2ID + ' '
+            tokens = [gene1ID, 'Sym', 'NCBITaxon:10090', 'Mus musculus', gene2ID,
+                'Sym', 'NCBITaxon:9606', 'Homo sapiens', 'PANTHER', '10', '12', 'Yes', 'Yes']
+            # short lines: too few columns, or Gene2ID the last column
+            if rnd.random() < 0.05:
+                tokens = tokens[:rnd.randint(1, 5)]
+            lines.append(str.encode('\t'.join(tokens)))
+        data = (b'\r\n' if crlf else b'\n').join(lines)
+        if rnd.random() < 0.5:
+            data = data + b'\n'
+        return data
+
+    def parseRows(self, parser):
+        # Returns: list of (line number, line, mgiID, homologyID, code)
+        #	of the parsed lines
+
+        rows = []
+        for mgiID, homologyID, code in parser:
+            rows.append((parser.lineNum, parser.rawLine, mgiID, homologyID, code))
+        return rows
+
+    def mappedFile(self, data):
+        # Returns: tsvreader.MappedFile of data, removed when the test ends
+
+        fd, path = tempfile.mkstemp()
+        os.write(fd, data)
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        fp = tsvreader.openFile(path, binary=True, mapped=True)
+        self.addCleanup(fp.close)
+        return fp
+
+    def builders(self, rnd):
+        # Purpose: direct and clustered builders with random lookups
+        # Returns: [DirectHomologies, ClusteredHomologies]
+
+        mgiIDs = ['MGI:%s' % i for i in range(ID_COUNT) if rnd.random() < 0.9]
+        mgiKeys = [rnd.randrange(1, 100000) for id in mgiIDs]
+        homologyIDs = []
+        homologyKeys = []
+        organismKeys = []
+        for prefix, organismKey in GENE2_PREFIXES[:3]:
+            # ZFIN IDs are in the database without their 'ZFIN:' prefix
+            prefix = prefix.replace('ZFIN:', '')
+            for i in range(ID_COUNT):
+                if rnd.random() < 0.9:
+                    homologyIDs.append('%s%s' % (prefix, i))
+                    homologyKeys.append(rnd.randrange(1, 100000))
+                    organismKeys.append(organismKey)
+
+        direct = alliance.DirectHomologies()
+        direct.mouseLookup = idstore.freeze(mgiIDs, [mgiKeys])[0]
+        direct.homologyLookup, direct.homologyOrgLookup = idstore.freeze(homologyIDs, [homologyKeys, organismKeys])
+        direct.lookupsReady = 1
+
+        clustered = alliance.ClusteredHomologies(1, None)
+        clustered.mgiToMarkerDict = direct.mouseLookup
+        clustered.lookupsReady = 1
+        return [direct, clustered]
+
+    def testParserRows(self):
+        rnd = random.Random(1)
+        for i in range(FILE_COUNT):
+            data = self.randomFile(rnd)
+            for prefixes in [alliance.DIRECT_PREFIXES, alliance.CLUSTERED_PREFIXES]:
+                expected = self.parseRows(alliance.AllianceParser(io.BytesIO(data), prefixes))
+                self.assertEqual(expected, self.parseRows(alliance.AllianceParser(self.mappedFile(data), prefixes)))
+                for block in BLOCK_LIST:
+                    alliance.VECTOR_BLOCK = block
+                    rows = self.parseRows(alliance.VectorParser(io.BytesIO(data), prefixes))
+                    self.assertEqual(expected, rows, 'VECTOR_BLOCK=%s' % block)
+                    rows = self.parseRows(alliance.VectorParser(self.mappedFile(data), prefixes))
+                    self.assertEqual(expected, rows, 'mapped, VECTOR_BLOCK=%s' % block)
+
+    def testParse(self):
+        rnd = random.Random(2)
+        for i in range(FILE_COUNT):
+            data = self.randomFile(rnd)
+            seed = rnd.random()
+            expected = self.builders(random.Random(seed))
+            alliance.parse(io.BytesIO(data), alliance.DIRECT_PREFIXES, expected)
+            for block in BLOCK_LIST:
+                alliance.VECTOR_BLOCK = block
+                builders = self.builders(random.Random(seed))
+                alliance.parse(io.BytesIO(data), alliance.DIRECT_PREFIXES, builders, vector=True)
+                for builder, other in zip(expected, builders):
+                    self.assertEqual(builder.state(), other.state(), 'VECTOR_BLOCK=%s' % block)
+
+    def testJoinKeys(self):
+        rnd = random.Random(3)
+        accIDs = ['MGI:%s' % rnd.randrange(ID_COUNT) for i in range(ID_COUNT)]
+        lookup = idstore.freeze(accIDs, [list(range(1, len(accIDs) + 1))])[0]
+        queries = ['MGI:%s' % i for i in range(-5, ID_COUNT + 5)] + ['', 'MGI:', 'MGI:1 ', 'Z']
+        expected = [lookup.get(id, 0) for id in queries]
+        self.assertEqual(expected, alliance.joinKeys(alliance.sortedKeys(lookup), lookup.values, queries))
+
+        empty = idstore.freeze([], [[]])[0]
+        self.assertEqual([0, 0], alliance.joinKeys(alliance.sortedKeys(empty), empty.values, ['MGI:1', '']))
+
+###--- main program ---###
+
+if __name__ == '__main__':
+    unittest.main()
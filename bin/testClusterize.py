@@ -0,0 +1,101 @@
+#
+#  testClusterize.py
+###########################################################################
+#
+#  Purpose:
+#
+#       Check that the parallel mode of clusterize.cluster gives the
+#	same clusters as the serial mode
+#
+#  Usage:
+#
+#      testClusterize.py [-v]
+#
+#  Env Vars: None
+#
+#  Inputs: None
+#
+#  Outputs:
+#
+#      unittest results to stderr
+#
+#  Exit Codes:
+#
+#      0:  All tests passed
+#      1:  A test failed
+#
+#  Implementation:
+#
+#      clusterize.MIN_SHARD_EDGES is lowered so small random graphs are
+#      really sharded across worker processes, then each graph is
+#      clustered with workers=1 and with several workers and the two
+#      dictionaries are compared, IDs included
+#
+#  Notes:  None
+#
+###########################################################################
+
+import random
+import unittest
+import clusterize
+
+# random graphs per test, and edges and IDs per graph
+GRAPH_COUNT = 20
+EDGE_COUNT = 2000
+ID_COUNT = 1500
+
+# worker counts to compare with the serial mode
+WORKER_LIST = [2, 3, 4, 7]
+
+###--- classes ---###
+
+class ParallelClusterTest(unittest.TestCase):
+    # Purpose: clusterize.cluster(pairs, prefix, workers=N) equals
+    #	clusterize.cluster(pairs, prefix, workers=1)
+
+    def setUp(self):
+        self.minShardEdges = clusterize.MIN_SHARD_EDGES
+        clusterize.MIN_SHARD_EDGES = 10
+
+    def tearDown(self):
+        clusterize.MIN_SHARD_EDGES = self.minShardEdges
+
+    def randomPairs(self, rnd, edgeCt, idCt):
+        # Purpose: a random graph, with some IDs clustered on their own
+        # Returns: list of two-element lists
+
+        pairs = []
+        for i in range(edgeCt):
+            idOne = 'H:%s' % rnd.randrange(idCt)
+            if rnd.random() < 0.05:
+                idTwo = 'None'
+            else:
+                idTwo = 'M:%s' % rnd.randrange(idCt)
+            pairs.append([idOne, idTwo])
+
+        return pairs
+
+    def assertSameClusters(self, pairs):
+        serialDict = clusterize.cluster(pairs, 'TEST', workers=1)
+        for workers in WORKER_LIST:
+            parallelDict = clusterize.cluster(pairs, 'TEST', workers=workers)
+            self.assertEqual(serialDict, parallelDict, 'workers=%s' % workers)
+
+    def testRandomGraphs(self):
+        rnd = random.Random(1)
+        for i in range(GRAPH_COUNT):
+            # sparse to dense, so there are many small components
+            # as well as a few large ones
+            idCt = rnd.randint(ID_COUNT // 4, ID_COUNT)
+            self.assertSameClusters(self.randomPairs(rnd, EDGE_COUNT, idCt))
+
+    def testFewEdges(self):
+        # fewer edges than workers * MIN_SHARD_EDGES: fewer shards
+        rnd = random.Random(2)
+        for edgeCt in [1, 9, 10, 11, 25, 35]:
+            self.assertSameClusters(self.randomPairs(rnd, edgeCt, 20))
+
+###--- main program ---###
+
+if __name__ == '__main__':
+    unittest.main()
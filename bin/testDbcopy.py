@@ -0,0 +1,139 @@
+#
+#  testDbcopy.py
+###########################################################################
+#
+#  Purpose:
+#
+#       Check that rows written in the COPY text format by dbcopy are
+#	read back unchanged
+#
+#  Usage:
+#
+#      testDbcopy.py [-v]
+#
+#  Env Vars: None
+#
+#  Inputs: None
+#
+#  Outputs:
+#
+#      unittest results to stderr
+#
+#  Exit Codes:
+#
+#      0:  All tests passed
+#      1:  A test failed
+#
+#  Implementation:
+#
+#      Random rows of nulls, numbers and strings full of tabs, newlines,
+#      carriage returns, backslashes and non-ASCII characters are copied
+#      in and out through a cursor whose copy_expert keeps the data in
+#      memory, reading and writing it in chunks of random sizes so lines
+#      and characters are split across chunks
+#
+#  Notes:  None
+#
+###########################################################################
+
+import random
+import unittest
+import dbcopy
+
+# random row sets per test, and rows per set
+ROWS_COUNT = 20
+ROW_COUNT = 500
+
+# characters the random strings are made of
+CHARACTERS = 'aZ09 :-_\t\n\r\\N.éα中'
+
+###--- classes ---###
+
+class MemoryCursor:
+    # Purpose: cursor whose copy_expert copies to and from a bytes
+    #	buffer instead of a table, in chunks of random sizes
+
+    def __init__(self, rnd):
+        self.rnd = rnd
+        self.data = b''
+        self.sql = []
+
+    def copy_expert(self, sql, fp, size):
+        self.sql.append(sql)
+        if 'from stdin' in sql:
+            self.data = b''
+            while True:
+                chunk = fp.read(self.rnd.randint(1, 64))
+                if not chunk:
+                    break
+                self.data += chunk
+        else:
+            pos = 0
+            while pos < len(self.data):
+                end = pos + self.rnd.randint(1, 64)
+                fp.write(self.data[pos:end])
+                pos = end
+
+class CopyTest(unittest.TestCase):
+    # Purpose: dbcopy.copyOut(copyIn(rows)) equals rows, with every
+    #	value as a string and None for nulls
+
+    def randomRows(self, rnd, rowCt):
+        # Returns: list of random rows of 1 to 5 values
+
+        rows = []
+        for i in range(rowCt):
+            row = []
+            for j in range(rnd.randint(1, 5)):
+                r = rnd.random()
+                if r < 0.1:
+                    row.append(None)
+                elif r < 0.3:
+                    row.append(rnd.randrange(-1000, 1000000))
+                else:
+                    row.append(''.join([rnd.choice(CHARACTERS) for k in range(rnd.randrange(12))]))
+            rows.append(row)
+        return rows
+
+    def expectedRows(self, rows):
+        # Returns: the rows as copyOut reads them back
+
+        return [[None if value is None else str(value) for value in row] for row in rows]
+
+    def testRoundTrip(self):
+        rnd = random.Random(1)
+        for i in range(ROWS_COUNT):
+            rows = self.randomRows(rnd, rnd.randrange(ROW_COUNT))
+            cursor = MemoryCursor(rnd)
+            dbcopy.copyIn(cursor, 'test', rows, ['a', 'b'])
+            self.assertEqual('copy test (a, b) from stdin', cursor.sql[0])
+
+            result = []
+            rowCt = dbcopy.copyOut(cursor, 'select 1', result.append)
+            self.assertEqual('copy (select 1) to stdout', cursor.sql[1])
+            self.assertEqual(len(rows), rowCt)
+            self.assertEqual(self.expectedRows(rows), result)
+
+    def testCopyLine(self):
+        self.assertEqual('1\t\\N\ta\\tb\\nc\\rd\\\\Ne\n', dbcopy.copyLine([1, None, 'a\tb\nc\rd\\Ne']))
+        self.assertEqual('\n', dbcopy.copyLine(['']))
+
+    def testCopyValue(self):
+        self.assertIsNone(dbcopy.copyValue('\\N'))
+        self.assertEqual('\\N', dbcopy.copyValue('\\\\N'))
+        # the other escapes COPY may send, and a backslash before an
+        # ordinary character, which stands for the character
+        self.assertEqual('\b\f\v\t\n\rx', dbcopy.copyValue('\\b\\f\\v\\t\\n\\r\\x'))
+
+    def testCopyLines(self):
+        rnd = random.Random(2)
+        lines = [dbcopy.copyLine(row) for row in self.randomRows(rnd, ROW_COUNT)]
+        cursor = MemoryCursor(rnd)
+        self.assertEqual(len(lines), dbcopy.copyLines(cursor, 'test', lines, null=''))
+        self.assertEqual("copy test from stdin with null as ''", cursor.sql[0])
+        self.assertEqual(str.encode(''.join(lines)), cursor.data)
+
+###--- main program ---###
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,296 @@
+#
+#  testHomologyload.py
+###########################################################################
+#
+#  Purpose:
+#
+#       Check the delta matching of homologyload.findChangedHomologies
+#	and the checks homologyload.stageTables makes of the staged rows
+#
+#  Usage:
+#
+#      testHomologyload.py [-v]
+#
+#  Env Vars:
+#
+#      The loader's configuration is set to a temporary directory
+#      before homologyload is imported
+#
+#  Inputs: None
+#
+#  Outputs:
+#
+#      unittest results to stderr
+#
+#  Exit Codes:
+#
+#      0:  All tests passed
+#      1:  A test failed
+#
+#  Implementation:
+#
+#      No database is used: the db module is replaced before homologyload
+#      imports it, and dbcopy.connect returns a connection whose cursors
+#      answer the loader's COPY queries from memory and keep the rows
+#      copied in. The clusters are handed to the loader as in pipeline
+#      mode (recordList), so no load ready file is read
+#
+#  Notes:  None
+#
+###########################################################################
+
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+# the loader reads its configuration when imported; INPUT_FILE_DEFAULT
+# must exist for the cluster date
+tmpDir = tempfile.mkdtemp()
+loadFile = os.path.join(tmpDir, 'homology.load')
+open(loadFile, 'w').close()
+os.environ.update({
+    'INPUT_FILE_LOAD': loadFile,
+    'INPUT_FILE_DEFAULT': loadFile,
+    'CLUSTER_BCP': os.path.join(tmpDir, 'MRK_Cluster.bcp'),
+    'MEMBER_BCP': os.path.join(tmpDir, 'MRK_ClusterMember.bcp'),
+    'LOAD_MODE': 'staging',
+    'LOAD_TEE_BCP': '0',
+    'LOAD_DELTA': '0',
+    'PIPELINE_LOAD': '0',
+    'DB_SLOT_LOCK': os.path.join(tmpDir, 'dbslot'),
+    'DB_SLOTS': '1',
+    'CLUSTER_TYPE_KEY': '9272150',
+    'CLUSTER_SRC_KEY': '75885739',
+    'JOBSTREAM': 'homologyload_test',
+    'HOM_LDB_KEY': '1',
+    'CLUSTER_MGITYPE_KEY': '39',
+    'MGD_DBUSER': 'test',
+    'MGD_DBPASSWORDFILE': os.devnull,
+    })
+
+# MGI_User key of the load
+USER_KEY = 1600
+
+# the db module, answering only the MGI_User query of init
+db = types.ModuleType('db')
+db.useOneConnection = lambda flag: None
+db.set_sqlUser = lambda user: None
+db.set_sqlPasswordFromFile = lambda path: None
+db.sql = lambda query, mode=None: [{'_User_key': USER_KEY}]
+sys.modules['db'] = db
+
+import dbcopy
+import homologyload
+
+# first keys of mrk_cluster_seq and mrk_clustermember_seq
+SEQUENCE_STARTS = {'mrk_cluster_seq': 1000, 'mrk_clustermember_seq': 50000}
+
+###--- classes ---###
+
+class MemoryConnection:
+    # Purpose: dbcopy connection whose cursors answer the loader's COPY
+    #	queries from memory
+
+    def __init__(self, loadedRows=[]):
+        # loadedRows: (cluster key, marker key or None) rows of the
+        #	clusters already loaded, in cluster and sequence order
+        self.loadedRows = loadedRows
+
+        # {table:[[column, ...], ...], ...} rows copied in
+        self.tables = {}
+
+        # statements executed, and number of commits
+        self.sql = []
+        self.commitCt = 0
+
+        # function(table, rows) returning the rows a table keeps of the
+        # rows copied in
+        self.mangle = lambda table, rows: rows
+
+    def cursor(self):
+        return MemoryCursor(self)
+
+    def commit(self):
+        self.commitCt += 1
+
+    def close(self):
+        pass
+
+class MemoryCursor:
+    # Purpose: cursor of a MemoryConnection
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def copy_expert(self, sql, fp, size):
+        connection = self.connection
+        connection.sql.append(sql)
+        if 'nextval' in sql:
+            # copy (select nextval('seq') from generate_series(1, n)) to stdout
+            sequence = sql.split("'")[1]
+            count = int(sql.split('generate_series(1,')[1].split(')')[0])
+            start = SEQUENCE_STARTS[sequence]
+            fp.write(str.encode(''.join(['%s\n' % key for key in range(start, start + count)])))
+        elif 'to stdout' in sql:
+            fp.write(str.encode(''.join(map(dbcopy.copyLine, connection.loadedRows))))
+        else:
+            # copy table [(columns)] from stdin [with null as '']
+            table = sql.split()[1]
+            data = b''
+            while True:
+                chunk = fp.read(size)
+                if not chunk:
+                    break
+                data += chunk
+            rows = [line.split('\t') for line in bytes.decode(data).splitlines()]
+            connection.tables[table] = connection.mangle(table, rows)
+
+    def execute(self, sql):
+        self.connection.sql.append(' '.join(sql.split()))
+
+    def fetchone(self):
+        # the staging check: cluster count, member count and members
+        # without a cluster
+        tables = self.connection.tables
+        clusterRows = tables['mrk_cluster_stage']
+        memberRows = tables['mrk_clustermember_stage']
+        clusterKeys = set([row[0] for row in clusterRows])
+        orphanCt = len([row for row in memberRows if row[1] not in clusterKeys])
+        return (len(clusterRows), len(memberRows), orphanCt)
+
+    def close(self):
+        pass
+
+class LoaderTest(unittest.TestCase):
+    # Purpose: base class; runs each test on a fresh MemoryConnection
+    #	with the loader's module state restored afterwards
+
+    # module globals of homologyload the tests set
+    GLOBALS = ['recordList', 'loadDelta', 'loadMode', 'copyConnection',
+        'insertList', 'clusterKeys', 'memberKeys', 'createdByKey']
+
+    def setUp(self):
+        self.saved = dict([(name, getattr(homologyload, name)) for name in self.GLOBALS])
+        self.connect = dbcopy.connect
+        self.connection = MemoryConnection()
+        dbcopy.connect = lambda: self.connection
+
+    def tearDown(self):
+        for name in self.GLOBALS:
+            setattr(homologyload, name, self.saved[name])
+        dbcopy.connect = self.connect
+
+    def handOver(self, memberLists):
+        # Purpose: hand the clusters to the loader and initialize it
+        # Returns: Nothing
+
+        homologyload.recordList = [('', memberList) for memberList in memberLists]
+        homologyload.copyConnection = None
+        homologyload.init()
+
+class DeltaTest(LoaderTest):
+    # Purpose: findChangedHomologies matches the loaded clusters to the
+    #	clusters of the load by their members in sequence order
+
+    def setUp(self):
+        LoaderTest.setUp(self)
+        homologyload.loadDelta = True
+
+    def findChanges(self, loadedRows, memberLists):
+        # Purpose: run findChangedHomologies
+        # Returns: (insertList, sorted cluster keys copied to todelete2)
+
+        self.connection.loadedRows = loadedRows
+        self.handOver(memberLists)
+        homologyload.findChangedHomologies()
+        deleteKeys = sorted([int(row[0]) for row in self.connection.tables['todelete2']])
+        return (homologyload.insertList, deleteKeys)
+
+    def testDelta(self):
+        loadedRows = [(10, 1), (10, 2), (10, 3),
+            # the same members twice
+            (11, 4), (11, 5), (12, 4), (12, 5),
+            # no members
+            (13, None),
+            # the members of a new cluster, in another order
+            (14, 7), (14, 6),
+            (15, 8)]
+        memberLists = [[1, 2, 3], [4, 5], [6, 7], [9], [8], [8]]
+
+        insertList, deleteKeys = self.findChanges(loadedRows, memberLists)
+        # a loaded cluster matches at most one cluster of the load
+        self.assertEqual([[6, 7], [9], [8]], insertList)
+        self.assertEqual([11, 13, 14], deleteKeys)
+        self.assertIn('create temp table todelete2 (_Cluster_key int)', self.connection.sql)
+        self.assertIn('where c._CreatedBy_key = %s' % USER_KEY, ' '.join(self.connection.sql[0].split()))
+        self.assertEqual(1, self.connection.commitCt)
+
+    def testUnchanged(self):
+        loadedRows = [(10, 1), (10, 2), (11, 3)]
+        self.assertEqual(([], []), self.findChanges(loadedRows, [[1, 2], [3]]))
+
+    def testFirstLoad(self):
+        self.assertEqual(([[1, 2], [3]], []), self.findChanges([], [[1, 2], [3]]))
+
+    def testReserveKeys(self):
+        # only the new clusters get keys
+        self.findChanges([(10, 1), (10, 2)], [[1, 2], [3, 4, 5]])
+        homologyload.reserveKeys()
+        self.assertEqual([1000], list(homologyload.clusterKeys))
+        self.assertEqual([50000, 50001, 50002], list(homologyload.memberKeys))
+
+class StagingTest(LoaderTest):
+    # Purpose: stageTables copies the clusters into the staging tables
+    #	and exits unless the staged counts match and no member is
+    #	without its cluster
+
+    MEMBER_LISTS = [[1, 2, 3], [4, 5], [6]]
+
+    def setUp(self):
+        LoaderTest.setUp(self)
+        homologyload.loadDelta = False
+        homologyload.loadMode = 'staging'
+        self.handOver(self.MEMBER_LISTS)
+        homologyload.reserveKeys()
+
+    def testStaged(self):
+        homologyload.stageTables()
+        tables = self.connection.tables
+        self.assertEqual(['1000', '1001', '1002'], [row[0] for row in tables['mrk_cluster_stage']])
+        self.assertEqual([['50000', '1000', '1', '1'], ['50001', '1000', '2', '2'], ['50002', '1000', '3', '3'],
+            ['50003', '1001', '4', '1'], ['50004', '1001', '5', '2'], ['50005', '1002', '6', '1']],
+            tables['mrk_clustermember_stage'])
+        self.assertIn('create temp table mrk_cluster_stage (like MRK_Cluster)', self.connection.sql)
+        self.assertIn('create temp table mrk_clustermember_stage (like MRK_ClusterMember)', self.connection.sql)
+
+    def assertCheckFails(self, mangle):
+        self.connection.mangle = mangle
+        with self.assertRaises(SystemExit) as context:
+            homologyload.stageTables()
+        self.assertEqual(1, context.exception.code)
+
+    def testClusterCount(self):
+        self.assertCheckFails(lambda table, rows: rows[:-1] if table == 'mrk_cluster_stage' else rows)
+
+    def testMemberCount(self):
+        self.assertCheckFails(lambda table, rows: rows + rows[:1] if table == 'mrk_clustermember_stage' else rows)
+
+    def testOrphans(self):
+        def orphan(table, rows):
+            if table == 'mrk_clustermember_stage':
+                rows[-1][1] = '999'
+            return rows
+        self.assertCheckFails(orphan)
+
+###--- functions ---###
+
+def tearDownModule():
+    shutil.rmtree(tmpDir)
+
+###--- main program ---###
+
+if __name__ == '__main__':
+    unittest.main()
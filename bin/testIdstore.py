@@ -0,0 +1,176 @@
+#
+#  testIdstore.py
+###########################################################################
+#
+#  Purpose:
+#
+#       Check that the frozen lookups of idstore.freeze match the dict
+#	they replace, and survive the lookup snapshot round trip
+#
+#  Usage:
+#
+#      testIdstore.py [-v]
+#
+#  Env Vars:
+#
+#      LOOKUP_CACHE_DIR, LOOKUP_MODE and LOOKUP_THREADS are set, if not
+#      already, so lookupcache can be imported; no lookups are loaded
+#
+#  Inputs: None
+#
+#  Outputs:
+#
+#      unittest results to stderr
+#
+#  Exit Codes:
+#
+#      0:  All tests passed
+#      1:  A test failed
+#
+#  Implementation:
+#
+#      Random accession IDs, with repeats, are frozen and every lookup
+#      method is compared with a dict built from the same rows. The
+#      frozen lookups are then written and read back, as a KeyTable and
+#      as lookupcache snapshots in a temporary LOOKUP_CACHE_DIR
+#
+#  Notes:  None
+#
+###########################################################################
+
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from array import array
+
+# lookupcache reads these when imported; no lookups are loaded
+os.environ.setdefault('LOOKUP_CACHE_DIR', '')
+os.environ.setdefault('LOOKUP_MODE', 'all')
+os.environ.setdefault('LOOKUP_THREADS', '1')
+
+import idstore
+import lookupcache
+
+# random lookups per test, and rows and IDs per lookup
+LOOKUP_COUNT = 20
+ROW_COUNT = 3000
+ID_COUNT = 2000
+
+###--- classes ---###
+
+class FrozenKeyMapTest(unittest.TestCase):
+    # Purpose: idstore.freeze gives the lookups of a dict, and they are
+    #	unchanged by a write and read
+
+    def assertSameLookup(self, expected, lookup, missing):
+        # Purpose: lookup has the entries of the dict expected and none
+        #	of the IDs of missing
+
+        self.assertEqual(len(expected), len(lookup))
+        self.assertEqual(sorted(expected), lookup.keys())
+        for accID in expected:
+            self.assertIn(accID, lookup)
+            self.assertEqual(expected[accID], lookup[accID])
+            self.assertEqual(expected[accID], lookup.get(accID))
+        for accID in missing:
+            self.assertNotIn(accID, lookup)
+            self.assertIsNone(lookup.get(accID))
+            self.assertEqual(0, lookup.get(accID, 0))
+            self.assertRaises(KeyError, lookup.__getitem__, accID)
+
+    def testFreeze(self):
+        rnd = random.Random(1)
+        missing = ['', 'MGI:', 'MGI:-1', 'mgi:1', 'MGI:1 ', 'X' * 100]
+        for i in range(LOOKUP_COUNT):
+            rowCt = rnd.choice([0, 1, 2, 10, ROW_COUNT])
+            accIDs, markerKeys, organismKeys = randomRows(rnd, rowCt, ID_COUNT)
+            markers, organisms = idstore.freeze(accIDs, [markerKeys, organismKeys])
+            # the last values of a repeated ID are kept, as in a dict
+            self.assertSameLookup(dict(zip(accIDs, markerKeys)), markers, missing)
+            self.assertSameLookup(dict(zip(accIDs, organismKeys)), organisms, missing)
+            self.assertIs(markers.table, organisms.table)
+
+    def testKeyTableRoundTrip(self):
+        rnd = random.Random(2)
+        for i in range(LOOKUP_COUNT):
+            accIDs, markerKeys, organismKeys = randomRows(rnd, rnd.randrange(ROW_COUNT), ID_COUNT)
+            markers = idstore.freeze(accIDs, [markerKeys])[0]
+
+            fp = io.BytesIO()
+            markers.table.write(fp)
+            markers.values.tofile(fp)
+            data = fp.getvalue()
+
+            fp = io.BytesIO(data)
+            table = idstore.readKeyTable(fp)
+            values = array('i')
+            values.fromfile(fp, len(table))
+            self.assertSameLookup(dict(zip(accIDs, markerKeys)), idstore.FrozenKeyMap(table, values), [])
+
+            # a truncated table is refused
+            for size in [0, len(data) // 2, len(data) - len(markers.values) * 4 - 1]:
+                self.assertRaises((ValueError, EOFError), idstore.readKeyTable, io.BytesIO(data[:size]))
+
+class SnapshotTest(unittest.TestCase):
+    # Purpose: lookupcache.writeSnapshot and readSnapshot round trip a
+    #	frozen MarkerLookup, and only for the same freshness probe
+
+    def setUp(self):
+        self.cacheDir = lookupcache.cacheDir
+        lookupcache.cacheDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(lookupcache.cacheDir)
+        lookupcache.cacheDir = self.cacheDir
+
+    def testSnapshot(self):
+        rnd = random.Random(3)
+        lookup = lookupcache.MarkerLookup('test')
+        rows = randomRows(rnd, ROW_COUNT, ID_COUNT)
+        for accID, markerKey, organismKey in zip(*rows):
+            lookup.add(accID, markerKey, organismKey)
+        lookup.freeze()
+        lookupcache.writeSnapshot(lookup, '123 456')
+
+        self.assertIsNone(lookupcache.readSnapshot('test', '123 457'))
+        self.assertIsNone(lookupcache.readSnapshot('other', '123 456'))
+        snapshot = lookupcache.readSnapshot('test', '123 456')
+        self.assertEqual(lookup.markers.keys(), snapshot.markers.keys())
+        self.assertEqual(lookup.markers.values, snapshot.markers.values)
+        self.assertEqual(lookup.organisms.values, snapshot.organisms.values)
+        for accID in rows[0]:
+            self.assertEqual(lookup.markers[accID], snapshot.markers[accID])
+            self.assertEqual(lookup.organisms[accID], snapshot.organisms[accID])
+
+        # a truncated snapshot is ignored
+        path = lookupcache.snapshotPath('test')
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        with open(path, 'wb') as fp:
+            fp.write(data[:len(data) - 1])
+        self.assertIsNone(lookupcache.readSnapshot('test', '123 456'))
+
+###--- functions ---###
+
+def randomRows(rnd, rowCt, idCt):
+    # Purpose: random rows, some accession IDs repeated
+    # Returns: (list of accession IDs, list of marker keys, list of
+    #	organism keys)
+
+    prefixes = ['MGI:', 'HGNC:', 'RGD:', 'ZDB-GENE-', '']
+    accIDs = []
+    markerKeys = []
+    organismKeys = []
+    for i in range(rowCt):
+        accIDs.append('%s%s' % (rnd.choice(prefixes), rnd.randrange(idCt)))
+        markerKeys.append(rnd.randrange(1, 1000000))
+        organismKeys.append(rnd.choice([1, 2, 40, 84]))
+    return (accIDs, markerKeys, organismKeys)
+
+###--- main program ---###
+
+if __name__ == '__main__':
+    unittest.main()
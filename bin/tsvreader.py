@@ -0,0 +1,286 @@
+##########################################################################
+#
+# Purpose:
+#       Streaming reader for the tab-delimited input files, shared by
+#	the preprocessors, the loader and the sanity checks
+#
+# Usage: import tsvreader
+#
+# Inputs:
+#       1. A tab-delimited file, optionally with comment lines and a
+#	   header line of column names
+#
+# Outputs:
+#        1. The records of the file, one list of columns at a time
+#
+# Exit Codes:
+#
+#      0:  Successful completion
+#      1:  An exception occurred
+#
+#  Assumes:  Nothing
+#
+#  Notes:  Files are read lazily through a large buffer, so memory
+#	depends on the size of a record rather than the size of the file.
+#	Gzipped files (*.gz) are read in place; they are decompressed on a
+#	background thread while the caller parses the previous chunks.
+#	Uncompressed files may be memory mapped instead (MappedFile), so
+#	they are read straight from the page cache and lines can be found
+#	without copying the lines that are skipped
+#
+###########################################################################
+
+import gzip
+import io
+import mmap
+import os
+import queue
+import threading
+
+###--- globals ---###
+
+# constants
+TAB = '\t'
+
+# read buffer size in bytes
+BUFFER_SIZE = 1048576
+
+# number of decompressed chunks (of BUFFER_SIZE) the background thread
+# may get ahead of the reader
+QUEUE_CHUNKS = 8
+
+###--- classes ---###
+
+class TsvReader:
+    # Purpose: iterate over the records of an open tab-delimited file
+    #	as lists of columns, skipping comment lines and the header line
+    # Assumes: fp is open for reading text
+    # Effects: Reads the file
+    # Throws: Nothing
+
+    def __init__(self, fp, comment='#', header=None):
+        # comment: lines starting with this are skipped; None keeps
+        #	every line
+        # header: None - the file has no header line;
+        #	True - the first line read is the header;
+        #	a string - a line starting with this string is the header
+        self.fp = fp
+        self.comment = comment
+        self.header = header
+
+        # column names from the header line
+        self.headers = []
+
+        # number of the current line in the file, counting comment and
+        # header lines, and the current line without its line terminator
+        self.lineNum = 0
+        self.line = ''
+
+        self.lines = self.readLines()
+        self.records = self.readRecords()
+
+    def __iter__(self):
+        return self.records
+
+    def readLines(self):
+        # Purpose: the non-comment lines of the file
+        # Returns: generator of lines without line terminators
+
+        comment = self.comment
+        for line in self.fp:
+            self.lineNum += 1
+            line = line.rstrip('\r\n')
+            if comment and line.startswith(comment):
+                continue
+            self.line = line
+            yield line
+
+    def readRecords(self):
+        # Purpose: the data records of the file
+        # Returns: generator of lists of columns
+
+        for line in self.lines:
+            if self.isHeader(line):
+                self.headers = str.split(line, TAB)
+                continue
+            yield str.split(line, TAB)
+
+    def isHeader(self, line):
+        # Returns: true if line is the file's header line
+
+        if self.header is True:
+            return not self.headers
+        elif self.header:
+            return line.startswith(self.header)
+        return False
+
+class GzipReader(io.RawIOBase):
+    # Purpose: raw binary stream of a gzipped file, decompressed on a
+    #	background thread (zlib releases the GIL while it works)
+    # Assumes: Nothing
+    # Effects: Reads the file, starts a daemon thread
+    # Throws: OSError if the file cannot be opened; errors raised by the
+    #	thread are re-raised by readinto
+
+    def __init__(self, path):
+        io.RawIOBase.__init__(self)
+        # open here so a missing file fails in the caller
+        self.fpGzip = gzip.open(path, 'rb')
+        self.queue = queue.Queue(QUEUE_CHUNKS)
+        self.chunk = memoryview(b'')
+        self.eof = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.decompress, daemon=True)
+        self.thread.start()
+
+    def decompress(self):
+        # Purpose: background thread; queue decompressed chunks, then b''
+        #	at the end of the file (or the exception that stopped it)
+
+        try:
+            while not self.stopped.is_set():
+                chunk = self.fpGzip.read(BUFFER_SIZE)
+                self.put(chunk)
+                if not chunk:
+                    break
+        except Exception as e:
+            self.put(e)
+        self.fpGzip.close()
+
+    def put(self, item):
+        # Purpose: queue item unless the reader is closed first
+
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self.chunk and not self.eof:
+            chunk = self.queue.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                self.eof = True
+            self.chunk = memoryview(chunk)
+        n = min(len(b), len(self.chunk))
+        b[:n] = self.chunk[:n]
+        self.chunk = self.chunk[n:]
+        return n
+
+    def close(self):
+        self.stopped.set()
+        io.RawIOBase.close(self)
+
+class MappedFile:
+    # Purpose: read-only memory map of an uncompressed file, read like
+    #	a binary file object or scanned for lines with a given prefix
+    # Assumes: the file is not empty
+    # Effects: Maps the file
+    # Throws: OSError if the file cannot be opened
+
+    def __init__(self, path):
+        self.fp = open(path, 'rb')
+        self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self.mm, 'madvise'):
+            self.mm.madvise(mmap.MADV_SEQUENTIAL)
+
+        # reads stop here; set with seek to read one byte range of a
+        # file whose ranges are read by different processes
+        self.end = len(self.mm)
+
+    def __iter__(self):
+        mm = self.mm
+        while mm.tell() < self.end:
+            yield mm.readline()
+
+    def read(self, size=-1):
+        remaining = max(self.end - self.mm.tell(), 0)
+        if size < 0 or size > remaining:
+            size = remaining
+        return self.mm.read(size)
+
+    def seek(self, pos, end=None):
+        # Purpose: move to pos; reads stop at end if it is given
+        # Assumes: end, if given, is at the start of a line
+
+        self.mm.seek(pos)
+        if end is not None:
+            self.end = end
+
+    def tell(self):
+        return self.mm.tell()
+
+    def scan(self, prefix, lineNum=0):
+        # Purpose: find the lines from the current position on that
+        #	start with prefix; the lines in between are skipped by
+        #	searching the map, without copying them line by line
+        # Returns: generator of (line number, line) where lineNum is the
+        #	number of the line before the current position
+        # Effects: moves the current position to the end of the map
+        #	(or of the range set with seek)
+
+        mm = self.mm
+        size = self.end
+        target = b'\n' + prefix
+        # the lines before counted have been numbered
+        counted = mm.tell()
+
+        if mm[counted:counted + len(prefix)] == prefix:
+            start = counted
+        else:
+            start = mm.find(target, counted, size)
+            if start >= 0:
+                start += 1
+        while 0 <= start < size:
+            end = mm.find(b'\n', start, size) + 1
+            if end == 0:
+                end = size
+            lineNum += mm[counted:start].count(b'\n') + 1
+            counted = end
+            yield (lineNum, mm[start:end])
+            start = mm.find(target, end - 1, size)
+            if start >= 0:
+                start += 1
+        mm.seek(size)
+
+    def close(self):
+        self.mm.close()
+        self.fp.close()
+
+###--- functions ---###
+
+def openFile(path, binary=False, mapped=False):
+    # Purpose: open a tab-delimited file for reading with a large
+    #	buffer; a gzipped file is decompressed as it is read
+    # Returns: file object, reading bytes if binary is true; a
+    #	MappedFile if binary and mapped are true and the file is not
+    #	empty or gzipped
+    # Assumes: Nothing
+    # Effects: Opens a file
+    # Throws: OSError if the file cannot be opened
+
+    if path.endswith('.gz'):
+        fp = io.BufferedReader(GzipReader(path), BUFFER_SIZE)
+        if binary:
+            return fp
+        return io.TextIOWrapper(fp)
+    if binary and mapped and os.path.getsize(path) > 0:
+        return MappedFile(path)
+    if binary:
+        return open(path, 'rb', buffering=BUFFER_SIZE)
+    return open(path, 'r', buffering=BUFFER_SIZE)
+
+def records(fp, comment='#', header=None):
+    # Purpose: iterate over the records of an open tab-delimited file
+    # Returns: generator of lists of columns
+    # Assumes: Nothing
+    # Effects: Reads the file
+    # Throws: Nothing
+
+    return iter(TsvReader(fp, comment, header))